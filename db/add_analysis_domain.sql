@@ -0,0 +1,18 @@
+-- Record the politeness domain on each Analysis so the scraping claim query can use indexes
+-- (see idetect/politeness.py), and allow per-domain limits
+ALTER TABLE idetect_analyses ADD COLUMN domain character varying;
+ALTER TABLE idetect_analysis_histories ADD COLUMN domain character varying;
+
+UPDATE idetect_analyses
+SET domain = coalesce(gkg.source_common_name,
+                      substring(gkg.document_identifier from '://(?:www\.)?([^/:?#]+)'))
+FROM gkg
+WHERE gkg.id = idetect_analyses.gkg_id;
+
+CREATE INDEX document_analyses_scraping_domain
+  ON idetect_analyses (domain)
+  WHERE status = 'scraping';
+
+-- create_all makes idetect_domains with these columns when it doesn't exist yet
+ALTER TABLE idetect_domains ADD COLUMN IF NOT EXISTS seconds_between_requests numeric;
+ALTER TABLE idetect_domains ADD COLUMN IF NOT EXISTS max_concurrent_requests integer;
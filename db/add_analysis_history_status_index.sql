@@ -0,0 +1,3 @@
+-- The autoscaler averages recent processing times per status from the analysis histories
+CREATE INDEX CONCURRENTLY analysis_histories_status_updated
+  ON idetect_analysis_histories (status, updated);
@@ -0,0 +1,6 @@
+-- Priority lanes for Analyses, so that interactive submissions are claimed before the bulk backlog
+ALTER TABLE idetect_analyses ADD COLUMN priority integer NOT NULL DEFAULT 0;
+ALTER TABLE idetect_analysis_histories ADD COLUMN priority integer;
+
+CREATE INDEX document_analyses_status_priority_updated
+  ON idetect_analyses (status, priority DESC, updated);
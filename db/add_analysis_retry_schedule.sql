@@ -0,0 +1,24 @@
+-- Retry scheduling for failed stages
+ALTER TABLE idetect_analyses ADD COLUMN retry_attempts integer DEFAULT 0;
+ALTER TABLE idetect_analyses ADD COLUMN next_attempt_at timestamp with time zone;
+ALTER TABLE idetect_analysis_histories ADD COLUMN retry_attempts integer DEFAULT 0;
+ALTER TABLE idetect_analysis_histories ADD COLUMN next_attempt_at timestamp with time zone;
+
+-- Carry over the old scraping retry rule: up to 3 attempts, 12 hours apart
+UPDATE idetect_analyses
+SET retry_attempts = retrieval_attempts,
+    next_attempt_at = retrieval_date + interval '12 hours'
+WHERE status = 'scraping failed'
+AND retrieval_attempts < 3;
+
+CREATE INDEX document_analyses_status_next_attempt
+  ON idetect_analyses (status, next_attempt_at)
+  WHERE next_attempt_at IS NOT NULL;
+
+-- ... and give up on the ones that have already used up their attempts
+UPDATE idetect_analyses
+SET status = 'dead letter',
+    retry_attempts = retrieval_attempts,
+    next_attempt_at = NULL
+WHERE status = 'scraping failed'
+AND retrieval_attempts >= 3;
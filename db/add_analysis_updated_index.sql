@@ -0,0 +1,3 @@
+-- run_fact_api_sync.py looks up the analyses updated since its last sync, whatever their status
+CREATE INDEX CONCURRENTLY document_analyses_updated
+  ON idetect_analyses (updated);
@@ -0,0 +1,6 @@
+-- Generation counters for the API response cache, bumped by update_mviews.bash
+CREATE TABLE IF NOT EXISTS idetect_cache_generations (
+    name character varying PRIMARY KEY,
+    generation integer NOT NULL DEFAULT 0,
+    updated timestamp with time zone DEFAULT now()
+);
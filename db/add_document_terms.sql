@@ -0,0 +1,19 @@
+-- The most frequent words of each document, for the wordcloud (see idetect/document_terms.py)
+
+CREATE TABLE idetect_document_terms (
+    content_id integer NOT NULL REFERENCES idetect_document_contents (id) ON DELETE CASCADE,
+    word character varying NOT NULL,
+    nentry integer NOT NULL,
+    PRIMARY KEY (content_id, word)
+);
+ALTER TABLE idetect_document_terms OWNER TO idetect;
+
+-- the scraper adds the terms of new documents, this adds them for the existing ones
+INSERT INTO idetect_document_terms (content_id, word, nentry)
+SELECT id, lexeme, nentry
+  FROM (SELECT content.id, terms.lexeme, coalesce(array_length(terms.positions, 1), 1) AS nentry,
+               row_number() OVER (PARTITION BY content.id
+                                  ORDER BY coalesce(array_length(terms.positions, 1), 1) DESC, terms.lexeme) AS rank
+          FROM idetect_document_contents content, unnest(content.content_ts) terms
+         WHERE content.content_ts IS NOT NULL) ranked
+ WHERE rank <= 100;
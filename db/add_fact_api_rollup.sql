@@ -0,0 +1,23 @@
+-- Per day counts of idetect_fact_api rows for the timeline, histogram and filter counts,
+-- kept up to date by run_fact_api_sync.py (see idetect/fact_api_sync.py)
+
+CREATE TABLE idetect_fact_api_rollup (
+    id serial PRIMARY KEY,
+    gdelt_day date,
+    category character varying,
+    unit character varying,
+    term character varying,
+    iso3 character varying,
+    source_common_name character varying,
+    specific_reported_figure integer,
+    fact_count integer NOT NULL
+);
+ALTER TABLE idetect_fact_api_rollup OWNER TO idetect;
+
+INSERT INTO idetect_fact_api_rollup (gdelt_day, category, unit, term, iso3, source_common_name,
+                                     specific_reported_figure, fact_count)
+SELECT gdelt_day, category, unit, term, iso3, source_common_name, specific_reported_figure, count(fact)
+  FROM idetect_fact_api
+ GROUP BY gdelt_day, category, unit, term, iso3, source_common_name, specific_reported_figure;
+
+CREATE INDEX ix_idetect_fact_api_rollup_gdelt_day ON idetect_fact_api_rollup (gdelt_day);
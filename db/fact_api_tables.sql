@@ -0,0 +1,40 @@
+-- Replace the idetect_fact_api_locations and idetect_fact_api materialized views with tables
+-- that are kept up to date per Analysis by run_fact_api_sync.py (see idetect/fact_api_sync.py)
+
+CREATE TABLE idetect_location_sets (
+    id serial PRIMARY KEY,
+    location_ids integer[] NOT NULL UNIQUE
+);
+ALTER TABLE idetect_location_sets OWNER TO idetect;
+-- keep the location_ids_num values the API has already handed out
+INSERT INTO idetect_location_sets (id, location_ids)
+SELECT DISTINCT location_ids_num, location_ids FROM idetect_fact_api_locations;
+SELECT setval('idetect_location_sets_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM idetect_location_sets), false);
+
+CREATE TABLE idetect_fact_api_locations_table AS SELECT * FROM idetect_fact_api_locations;
+CREATE TABLE idetect_fact_api_table AS SELECT * FROM idetect_fact_api;
+DROP MATERIALIZED VIEW idetect_fact_api;
+DROP MATERIALIZED VIEW idetect_fact_api_locations;
+ALTER TABLE idetect_fact_api_locations_table RENAME TO idetect_fact_api_locations;
+ALTER TABLE idetect_fact_api_table RENAME TO idetect_fact_api;
+ALTER TABLE idetect_fact_api_locations OWNER TO idetect;
+ALTER TABLE idetect_fact_api OWNER TO idetect;
+
+ALTER TABLE idetect_fact_api_locations ADD PRIMARY KEY (fact);
+CREATE INDEX idetect_fact_api_fact_day_idx on idetect_fact_api (fact,gdelt_day);
+CREATE INDEX idetect_fact_api_loc_day_idx on idetect_fact_api (location, gdelt_day);
+CREATE INDEX idetect_fact_api_day_loc_idx on idetect_fact_api (gdelt_day, location);
+CREATE INDEX idetect_fact_api_loc_cat_idx on idetect_fact_api (location, category);
+CREATE INDEX idetect_fact_api_day_cat_idx on idetect_fact_api (gdelt_day, category);
+CREATE INDEX idetect_fact_api_cat_idx on idetect_fact_api (category);
+CREATE INDEX idetect_fact_api_fact_hash ON idetect_fact_api USING HASH (fact);
+CREATE INDEX idetect_fact_api_locidsnum_idx ON idetect_fact_api (location_ids_num);
+CREATE INDEX idetect_fact_api_gkg_idx ON idetect_fact_api (gkg_id);
+
+CREATE TABLE IF NOT EXISTS idetect_fact_api_sync (
+    name character varying PRIMARY KEY,
+    synced_until timestamp with time zone
+);
+ALTER TABLE idetect_fact_api_sync OWNER TO idetect;
+-- the tables are current as of the last refresh of the views
+INSERT INTO idetect_fact_api_sync (name, synced_until) VALUES ('fact_api', now());
@@ -0,0 +1,31 @@
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY needs a unique index, so give the
+-- single row of idetect_map_week_mview an id (see idetect/refresh.py)
+DROP MATERIALIZED VIEW IF EXISTS idetect_map_week_mview;
+CREATE MATERIALIZED VIEW idetect_map_week_mview AS (
+          WITH input_table AS (
+         SELECT date_trunc('week'::text, (to_date(substr((gkg.date)::text, 1, 8), 'YYYYMMDD'::text))::timestamp with time zone) AS gdelt_day,
+            idetect_locations.id AS location_id,
+            split_part((idetect_locations.latlong)::text, ','::text, 1) AS latitude,
+            split_part((idetect_locations.latlong)::text, ','::text, 2) AS longitude,
+            idetect_analyses.category,
+            count(*) AS count
+           FROM (((((idetect_facts
+             JOIN idetect_fact_locations ON ((idetect_facts.id = idetect_fact_locations.fact)))
+             JOIN idetect_locations ON ((idetect_fact_locations.location = idetect_locations.id)))
+             JOIN idetect_analysis_facts ON ((idetect_facts.id = idetect_analysis_facts.fact)))
+             JOIN idetect_analyses ON ((idetect_analysis_facts.analysis = idetect_analyses.gkg_id)))
+             JOIN gkg ON ((idetect_analyses.gkg_id = gkg.id)))
+            WHERE ((idetect_facts.specific_reported_figure < 100000000) AND (idetect_analyses.category IS NOT NULL))
+          GROUP BY (date_trunc('week'::text, (to_date(substr((gkg.date)::text, 1, 8), 'YYYYMMDD'::text))::timestamp with time zone)), idetect_locations.id, (split_part((idetect_locations.latlong)::text, ','::text, 1)), (split_part((idetect_locations.latlong)::text, ','::text, 2)), idetect_analyses.category
+          ORDER BY (date_trunc('week'::text, (to_date(substr((gkg.date)::text, 1, 8), 'YYYYMMDD'::text))::timestamp with time zone))
+        ), entries AS (
+         SELECT row_to_json(input_table.*) AS entry
+           FROM input_table
+        )
+ SELECT jsonb_agg(entries.entry) AS entries,
+    1 AS id
+   FROM entries
+);
+ALTER TABLE idetect_map_week_mview OWNER TO idetect;
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY needs a unique index
+CREATE UNIQUE INDEX idetect_map_week_mview_id_idx ON idetect_map_week_mview (id);
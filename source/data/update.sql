@@ -1,10 +1,23 @@
 -- idetect_fact_api_locations
---TODO this can also be replaced by either a sequence or md5 hash of location names
 CREATE EXTENSION intarray;
 
-DROP MATERIALIZED VIEW if EXISTS idetect_fact_api;
-DROP MATERIALIZED VIEW if EXISTS idetect_fact_api_locations;
-CREATE MATERIALIZED VIEW idetect_fact_api_locations AS
+-- These are tables rather than materialized views so that run_fact_api_sync.py can
+-- replace the rows of each Analysis as it is geotagged or edited, see idetect/fact_api_sync.py
+DROP TABLE if EXISTS idetect_fact_api;
+DROP TABLE if EXISTS idetect_fact_api_locations;
+DROP TABLE if EXISTS idetect_location_sets;
+CREATE TABLE idetect_location_sets (
+    id serial PRIMARY KEY,
+    location_ids integer[] NOT NULL UNIQUE
+);
+ALTER TABLE idetect_location_sets OWNER TO idetect;
+INSERT INTO idetect_location_sets (location_ids)
+SELECT DISTINCT sort(array_agg(idetect_fact_locations.location))
+  FROM idetect_fact_locations
+ WHERE idetect_fact_locations.location IS NOT NULL
+ GROUP BY idetect_fact_locations.fact;
+
+CREATE TABLE idetect_fact_api_locations AS
 WITH fact_locations AS (
          SELECT idetect_fact_locations.fact,
             sort(array_agg(idetect_fact_locations.location)) AS location_ids,
@@ -13,20 +26,17 @@ WITH fact_locations AS (
              LEFT JOIN idetect_locations ON ((idetect_fact_locations.location = idetect_locations.id)))
           WHERE (idetect_fact_locations.location IS NOT NULL)
           GROUP BY idetect_fact_locations.fact
-        ), location_ids_uniqueid AS (
-         SELECT DISTINCT ON (fact_locations_1.location_ids) fact_locations_1.location_ids,
-            row_number() OVER (ORDER BY fact_locations_1.location_ids) AS location_ids_num
-           FROM fact_locations fact_locations_1
         )
  SELECT fact_locations.fact,
     fact_locations.location_ids,
     fact_locations.location_names,
-    location_ids_uniqueid.location_ids_num
+    idetect_location_sets.id AS location_ids_num
    FROM (fact_locations
-     LEFT JOIN location_ids_uniqueid USING (location_ids));
+     JOIN idetect_location_sets USING (location_ids));
 ALTER TABLE idetect_fact_api_locations OWNER TO idetect;
+ALTER TABLE idetect_fact_api_locations ADD PRIMARY KEY (fact);
 -- idetect_fact_api
-CREATE MATERIALIZED VIEW idetect_fact_api AS (
+CREATE TABLE idetect_fact_api AS (
           SELECT
     gkg.document_identifier,
     gkg.source_common_name,
@@ -59,8 +69,37 @@ CREATE INDEX idetect_fact_api_loc_cat_idx on idetect_fact_api (location, categor
 CREATE INDEX idetect_fact_api_day_cat_idx on idetect_fact_api (gdelt_day, category);
 CREATE INDEX idetect_fact_api_cat_idx on idetect_fact_api (category);
 CREATE INDEX idetect_fact_api_fact_hash ON idetect_fact_api USING HASH (fact);
-CREATE INDEX idetect_fact_api_locations_fact_idx ON idetect_fact_api_locations (fact);
 CREATE INDEX idetect_fact_api_locidsnum_idx ON idetect_fact_api (location_ids_num);
+CREATE INDEX idetect_fact_api_gkg_idx ON idetect_fact_api (gkg_id);
+
+CREATE TABLE IF NOT EXISTS idetect_fact_api_sync (
+    name character varying PRIMARY KEY,
+    synced_until timestamp with time zone
+);
+ALTER TABLE idetect_fact_api_sync OWNER TO idetect;
+INSERT INTO idetect_fact_api_sync (name, synced_until) VALUES ('fact_api', now())
+ON CONFLICT (name) DO UPDATE SET synced_until = now();
+
+-- idetect_fact_api_rollup
+DROP TABLE if EXISTS idetect_fact_api_rollup;
+CREATE TABLE idetect_fact_api_rollup (
+    id serial PRIMARY KEY,
+    gdelt_day date,
+    category character varying,
+    unit character varying,
+    term character varying,
+    iso3 character varying,
+    source_common_name character varying,
+    specific_reported_figure integer,
+    fact_count integer NOT NULL
+);
+ALTER TABLE idetect_fact_api_rollup OWNER TO idetect;
+INSERT INTO idetect_fact_api_rollup (gdelt_day, category, unit, term, iso3, source_common_name,
+                                     specific_reported_figure, fact_count)
+SELECT gdelt_day, category, unit, term, iso3, source_common_name, specific_reported_figure, count(fact)
+  FROM idetect_fact_api
+ GROUP BY gdelt_day, category, unit, term, iso3, source_common_name, specific_reported_figure;
+CREATE INDEX ix_idetect_fact_api_rollup_gdelt_day ON idetect_fact_api_rollup (gdelt_day);
 
 -- wordcloud
 -- ALTER TABLE idetect_document_contents ADD COLUMN content_ts tsvector;
@@ -83,6 +122,24 @@ REGEXP_REPLACE(content_clean,'[0-9]|said|year|people|says|one|two', '','g'))
 WHERE content_clean IS NOT NULL
 AND content_ts IS NULL;
 
+-- the most frequent words of each document, see idetect/document_terms.py
+DROP TABLE if EXISTS idetect_document_terms;
+CREATE TABLE idetect_document_terms (
+    content_id integer NOT NULL REFERENCES idetect_document_contents (id) ON DELETE CASCADE,
+    word character varying NOT NULL,
+    nentry integer NOT NULL,
+    PRIMARY KEY (content_id, word)
+);
+ALTER TABLE idetect_document_terms OWNER TO idetect;
+INSERT INTO idetect_document_terms (content_id, word, nentry)
+SELECT id, lexeme, nentry
+  FROM (SELECT content.id, terms.lexeme, coalesce(array_length(terms.positions, 1), 1) AS nentry,
+               row_number() OVER (PARTITION BY content.id
+                                  ORDER BY coalesce(array_length(terms.positions, 1), 1) DESC, terms.lexeme) AS rank
+          FROM idetect_document_contents content, unnest(content.content_ts) terms
+         WHERE content.content_ts IS NOT NULL) ranked
+ WHERE rank <= 100;
+
 
 -- index on document identifier to speedup search for analyse_url API
 CREATE INDEX gkg_identifier_idx on gkg (document_identifier);
@@ -109,10 +166,13 @@ CREATE MATERIALIZED VIEW idetect_map_week_mview AS (
          SELECT row_to_json(input_table.*) AS entry
            FROM input_table
         )
- SELECT jsonb_agg(entries.entry) AS entries
+ SELECT jsonb_agg(entries.entry) AS entries,
+    1 AS id
    FROM entries
 );
 ALTER TABLE idetect_map_week_mview OWNER TO idetect;
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY needs a unique index
+CREATE UNIQUE INDEX idetect_map_week_mview_id_idx ON idetect_map_week_mview (id);
 
 DROP TABLE IF EXISTS idetect_validation;
 CREATE TABLE idetect_validation (
@@ -0,0 +1,170 @@
+'''Response cache for the fact API endpoints.
+
+The fact API data only changes when run_fact_api_sync.py changes the rows of the
+fact API tables, or when run_refresh.py refreshes idetect_map_week_mview, so results
+are cached under the endpoint, its normalized filters and the current generation
+of the data it is computed from: FACT_API, or MAP_WEEK for /map_week. Each of
+those writers bumps the generation of its own data in idetect_cache_generations
+(see bump_generation), which makes every result computed from it unreachable at
+once, and leaves the results computed from the other alone.
+
+Results are kept in an LRU in each API process, bounded by the pickled size of the
+results (API_CACHE_BYTES) since a page of /urllist can be far bigger than a count,
+and optionally in a directory shared by all processes, API_CACHE_DIR.
+'''
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from idetect.model import CacheGeneration
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+FACT_API = 'fact_api'
+MAP_WEEK = 'map_week'
+# endpoints that aren't computed from the FACT_API data
+ENDPOINT_DATA = {'map_week': MAP_WEEK}
+CACHE_BYTES = int(os.environ.get('API_CACHE_BYTES', 64 * 2 ** 20))
+CACHE_DIR = os.environ.get('API_CACHE_DIR')
+# how long a process trusts the generation it last read before checking again
+GENERATION_CHECK_SECONDS = 10
+
+_lock = threading.Lock()
+# key: (result, size in bytes, name of the data it was computed from)
+_memory = OrderedDict()
+_memory_bytes = {'value': 0}
+# name: {'value': generation, 'checked': time}
+_generations = {}
+
+
+def current_generation(session, name=FACT_API, force=False):
+    '''
+    The generation of the named data, read from the database at most every
+    GENERATION_CHECK_SECONDS, or right away with force
+    '''
+    now = time.time()
+    state = _generations.setdefault(name, {'value': None, 'checked': 0})
+    if force or state['value'] is None or now - state['checked'] > GENERATION_CHECK_SECONDS:
+        generation = session.query(CacheGeneration.generation) \
+                         .filter(CacheGeneration.name == name).scalar() or 0
+        if generation != state['value']:
+            forget(name)
+            prune_disk(name, generation)
+        state['value'] = generation
+        state['checked'] = now
+    return state['value']
+
+
+def bump_generation(session, name=FACT_API):
+    '''Invalidate every cached result computed from the named data, after changing it'''
+    table = CacheGeneration.__table__
+    session.execute(insert(table).values(name=name, generation=1)
+                    .on_conflict_do_update(index_elements=['name'],
+                                           set_={'generation': table.c.generation + 1, 'updated': func.now()}))
+    session.commit()
+
+
+def normalize(value):
+    '''Make equivalent filters compare equal: filter lists are sets, so sort them'''
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items() if v not in (None, [], '')}
+    if isinstance(value, (list, tuple, set)):
+        return sorted({str(v) for v in value})
+    return str(value)
+
+
+def cache_key(endpoint, generation, filters, **extra):
+    key = json.dumps([endpoint, generation, normalize(filters), normalize(extra)], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def generation_dir(name, generation):
+    return os.path.join(CACHE_DIR, name, str(generation))
+
+
+def prune_disk(name, generation):
+    '''Remove the on-disk results of every other generation of the named data'''
+    if not CACHE_DIR or not os.path.isdir(os.path.join(CACHE_DIR, name)):
+        return
+    for entry in os.listdir(os.path.join(CACHE_DIR, name)):
+        if entry != str(generation):
+            shutil.rmtree(os.path.join(CACHE_DIR, name, entry), ignore_errors=True)
+
+
+def read_disk(name, generation, key):
+    try:
+        with open(os.path.join(generation_dir(name, generation), key), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_disk(name, generation, key, data):
+    directory = generation_dir(name, generation)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(directory, key))
+    except OSError:
+        logger.warning("Couldn't write to API cache {}".format(directory), exc_info=True)
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def cached(session, endpoint, filters, compute, **extra):
+    '''
+    Return the cached result of endpoint for filters (and any extra parameters), calling
+    compute() to produce it if it isn't cached. Results must not be modified by the caller.
+    '''
+    name = ENDPOINT_DATA.get(endpoint, FACT_API)
+    generation = current_generation(session, name)
+    key = cache_key(endpoint, generation, filters, **extra)
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key][0]
+    data = read_disk(name, generation, key) if CACHE_DIR else None
+    try:
+        result = pickle.loads(data) if data is not None else None
+    except (EOFError, pickle.UnpicklingError):
+        data = None
+    if data is None:
+        result = compute()
+        data = pickle.dumps(result)
+        if CACHE_DIR:
+            write_disk(name, generation, key, data)
+    remember(key, result, len(data), name)
+    return result
+
+
+def remember(key, result, size, name=FACT_API):
+    '''Keep result in this process, evicting the least recently used results to stay within CACHE_BYTES'''
+    if size > CACHE_BYTES:
+        return
+    with _lock:
+        if key in _memory:
+            _memory_bytes['value'] -= _memory.pop(key)[1]
+        _memory[key] = (result, size, name)
+        _memory_bytes['value'] += size
+        while _memory_bytes['value'] > CACHE_BYTES:
+            _memory_bytes['value'] -= _memory.popitem(last=False)[1][1]
+
+
+def forget(name):
+    '''Drop the results computed from the named data from this process'''
+    with _lock:
+        for key in [key for key, (result, size, data) in _memory.items() if data == name]:
+            _memory_bytes['value'] -= _memory.pop(key)[1]
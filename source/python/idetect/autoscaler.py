@@ -0,0 +1,187 @@
+'''Stage-aware autoscaling of the worker processes.
+
+The Autoscaler periodically samples the queue depth of each pipeline stage and the
+recent processing time of that stage, estimates how much work is waiting, and spawns
+or retires run_<stage>.py processes so that a fixed CPU and memory budget goes to
+the stages that are the bottleneck.
+'''
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from sqlalchemy import func
+
+from idetect.model import Analysis, AnalysisHistory, Session, Status
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# script: what to run; waiting_status: the queue this stage works on;
+# done_status: the status whose processing_time tells us how long the stage takes;
+# cpu: cores used by one process while busy; memory_mb: resident memory of one process;
+# failure_status: the status of analyses whose retries (when due) are also queued for this stage
+Stage = namedtuple('Stage', ['script', 'waiting_status', 'done_status', 'cpu', 'memory_mb', 'failure_status'])
+Stage.__new__.__defaults__ = (None,)
+
+STAGES = {
+    'scraper': Stage('run_scraper.py', Status.NEW, Status.SCRAPED, 0.25, 150, Status.SCRAPING_FAILED),
+    'classifier': Stage('run_classifier.py', Status.SCRAPED, Status.CLASSIFIED, 1.0, 1500,
+                        Status.CLASSIFYING_FAILED),
+    'extractor': Stage('run_extractor.py', Status.CLASSIFIED, Status.EXTRACTED, 1.0, 1200,
+                       Status.EXTRACTING_FAILED),
+    'geotagger': Stage('run_geotagger.py', Status.EXTRACTED, Status.GEOTAGGED, 0.25, 150,
+                       Status.GEOTAGGING_FAILED),
+}
+
+MIN_PROCESSES = 1  # per stage, so that nothing stalls completely
+DEFAULT_PROCESSING_SECONDS = 5  # assumed when there is no recent processing time for a stage
+SAMPLE_MINUTES = 30
+INTERVAL_SECONDS = 60
+# a stage isn't shrunk until this long after its last change, and then by one process per step,
+# so that a queue that empties and refills doesn't make the pool flap
+SCALE_DOWN_COOLDOWN_SECONDS = 600
+
+
+def default_memory_budget_mb():
+    '''80% of the physical memory of this host'''
+    return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * 0.8 / 2 ** 20)
+
+
+def sample_queues(session, stages=STAGES, minutes=SAMPLE_MINUTES):
+    '''
+    Return {stage: (queue depth, mean processing seconds over the last minutes)}. The queue
+    depth includes failed analyses whose retry is due.
+    '''
+    counts = Analysis.status_counts(session)
+    retries = dict(
+        session.query(Analysis.status, func.count(Analysis.gkg_id))
+            .filter(Analysis.status.in_([s.failure_status for s in stages.values() if s.failure_status]))
+            .filter(Analysis.next_attempt_at <= func.now())
+            .group_by(Analysis.status)
+            .all()
+    )
+    since = func.now() - timedelta(minutes=minutes)
+    # served by the analysis_histories_status_updated index
+    times = dict(
+        session.query(AnalysisHistory.status, func.avg(AnalysisHistory.processing_time))
+            .filter(AnalysisHistory.status.in_([s.done_status for s in stages.values()]))
+            .filter(AnalysisHistory.updated > since)
+            .group_by(AnalysisHistory.status)
+            .all()
+    )
+    return {name: (counts.get(stage.waiting_status, 0) + retries.get(stage.failure_status, 0),
+                   float(times.get(stage.done_status) or DEFAULT_PROCESSING_SECONDS))
+            for name, stage in stages.items()}
+
+
+def plan(samples, stages=STAGES, cpu_budget=None, memory_budget_mb=None, min_processes=MIN_PROCESSES,
+         floors=None):
+    '''
+    Decide how many processes each stage should have. Every stage gets min_processes, or
+    its entry in floors if that is more, then processes are added one at a time to the
+    stage with the most outstanding work (queue depth * processing time) per process,
+    until the CPU or memory budget is used up or every stage has a process for each
+    waiting item.
+    '''
+    cpu_budget = cpu_budget or os.cpu_count()
+    memory_budget_mb = memory_budget_mb or default_memory_budget_mb()
+    floors = floors or {}
+    allocation = {name: max(min_processes, floors.get(name, 0)) for name in stages}
+    cpu = sum(stages[name].cpu * n for name, n in allocation.items())
+    memory = sum(stages[name].memory_mb * n for name, n in allocation.items())
+    while True:
+        candidates = [
+            (samples[name][0] * samples[name][1] / allocation[name], name)
+            for name, stage in stages.items()
+            if samples[name][0] > allocation[name]
+            and cpu + stage.cpu <= cpu_budget
+            and memory + stage.memory_mb <= memory_budget_mb
+        ]
+        if not candidates:
+            return allocation
+        work, name = max(candidates)
+        allocation[name] += 1
+        cpu += stages[name].cpu
+        memory += stages[name].memory_mb
+
+
+class Autoscaler:
+    def __init__(self, stages=STAGES, cpu_budget=None, memory_budget_mb=None, interval=INTERVAL_SECONDS,
+                 directory=None):
+        """
+        Create an Autoscaler that runs the scripts of the given stages from directory,
+        within the given CPU (cores) and memory (MB) budgets.
+        """
+        self.stages = stages
+        self.cpu_budget = cpu_budget
+        self.memory_budget_mb = memory_budget_mb
+        self.interval = interval
+        self.directory = directory or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.processes = {name: [] for name in stages}
+        self.retiring = []  # processes asked to exit, which still have to be waited for
+        self.last_scaled = {name: 0 for name in stages}
+        self.terminated = False
+        signal.signal(signal.SIGINT, self.terminate)
+        signal.signal(signal.SIGTERM, self.terminate)
+
+    def terminate(self, signum, frame):
+        logger.warning("Autoscaler {} terminated".format(os.getpid()))
+        self.terminated = True
+
+    def reap(self):
+        """Forget about processes that have exited. poll() waits for them, so they don't linger as zombies."""
+        for name, processes in self.processes.items():
+            self.processes[name] = [p for p in processes if p.poll() is None]
+        self.retiring = [p for p in self.retiring if p.poll() is None]
+
+    def floors(self, now):
+        """The fewest processes each stage may have after this step"""
+        return {name: len(processes) if now - self.last_scaled[name] < SCALE_DOWN_COOLDOWN_SECONDS
+                else len(processes) - 1
+                for name, processes in self.processes.items()}
+
+    def scale(self, name, num):
+        """Start or retire processes so that stage name has num of them"""
+        processes = self.processes[name]
+        while len(processes) < num:
+            process = subprocess.Popen([sys.executable, self.stages[name].script], cwd=self.directory)
+            logger.info("Autoscaler started {} {}".format(name, process.pid))
+            processes.append(process)
+        while len(processes) > num:
+            # Workers finish their current Analysis before exiting on SIGTERM
+            process = processes.pop()
+            logger.info("Autoscaler retiring {} {}".format(name, process.pid))
+            process.terminate()
+            self.retiring.append(process)
+
+    def step(self):
+        session = Session()
+        try:
+            samples = sample_queues(session, self.stages)
+        finally:
+            session.close()
+        self.reap()
+        now = time.time()
+        allocation = plan(samples, self.stages, self.cpu_budget, self.memory_budget_mb,
+                          floors=self.floors(now))
+        logger.info("Autoscaler samples {} allocation {}".format(samples, allocation))
+        for name, num in allocation.items():
+            if num != len(self.processes[name]):
+                self.scale(name, num)
+                self.last_scaled[name] = now
+
+    def run(self):
+        try:
+            while not self.terminated:
+                self.step()
+                time.sleep(self.interval)
+        finally:
+            for name in self.processes:
+                self.scale(name, 0)
+            for process in self.retiring:
+                process.wait()
@@ -0,0 +1,63 @@
+'''A persistent cache of classifier predictions.
+
+Predictions are stored in idetect_classification_cache under the sha256 of the
+exact text given to the model, plus the model's name and the sha256 of its model
+file, so identical texts (syndicated copies, re-scrapes, re-runs through the API)
+are only predicted once per model. The version label isn't used, because a version
+can be republished with a different model; any change to the model file simply
+misses the cache.
+'''
+import hashlib
+from collections import Counter
+
+from sqlalchemy.dialects.postgresql import insert
+
+from idetect.model import ClassificationResult
+
+# hits and misses by model name in this process
+cache_counts = Counter()
+
+
+def content_hash(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+def cached_predict_batch(session, model, texts):
+    '''
+    Return model.predict_batch(texts), only predicting the texts that this model
+    file hasn't seen before. New predictions are added to session but not
+    committed, so they are saved along with whatever else the caller commits.
+    '''
+    hashes = [content_hash(text) for text in texts]
+    cached = dict(
+        session.query(ClassificationResult.content_hash, ClassificationResult.result)
+            .filter(ClassificationResult.model == model.name)
+            .filter(ClassificationResult.model_sha256 == model.sha256)
+            .filter(ClassificationResult.content_hash.in_(set(hashes)))
+            .all()
+    )
+    missing = {}
+    for h, text in zip(hashes, texts):
+        if h not in cached:
+            missing.setdefault(h, text)
+    cache_counts[model.name + ' hits'] += len(texts) - len(missing)
+    cache_counts[model.name + ' misses'] += len(missing)
+    if missing:
+        results = model.predict_batch(list(missing.values()))
+        predicted = dict(zip(missing.keys(), results))
+        session.execute(
+            insert(ClassificationResult.__table__)
+                .values([{'content_hash': h, 'model': model.name, 'model_sha256': model.sha256, 'result': result}
+                         for h, result in predicted.items()])
+                .on_conflict_do_nothing())
+        cached.update(predicted)
+    return [cached[h] for h in hashes]
+
+
+def prune(session, model):
+    '''Delete the cached predictions of every other model file for model'''
+    session.query(ClassificationResult) \
+        .filter(ClassificationResult.model == model.name) \
+        .filter(ClassificationResult.model_sha256 != model.sha256) \
+        .delete(synchronize_session=False)
+    session.commit()
@@ -1,21 +1,88 @@
+from collections import Counter
+
 from sqlalchemy.orm import object_session
 
+from idetect.classification_cache import cached_predict_batch
+from idetect.model import Relevance
+
 
 '''Method(s) for running classifier on extracted content.
 '''
 
-def classify(analysis, category_model, relevance_model):
+# how many times each skip path has been taken by this process
+skip_counts = Counter()
+
+
+def predict_batch(model, texts, session=None):
+    """Run model on texts, using the classification cache if a session is given"""
+    if session is None:
+        return model.predict_batch(texts)
+    return cached_predict_batch(session, model, texts)
+
+
+def classify(analysis, category_model, relevance_model, cascade=False, use_cache=False):
     """
     Tag and categorize analysis using its content.
+    With cascade, relevance is predicted first and the category of irrelevant
+    articles is left as None, as they never reach the fact API.
+    With use_cache, predictions are looked up in and saved to the classification cache.
     
     :params analysis: An Analysis instance
     :return: None
     """
     session = object_session(analysis)
-    content = analysis.content.content
-    category = category_model.predict(content)
     content_clean = analysis.content.content_clean
-    relevance = relevance_model.predict(content_clean)
+    if use_cache:
+        relevance = cached_predict_batch(session, relevance_model, [content_clean])[0]
+    else:
+        relevance = relevance_model.predict(content_clean)
+    if cascade and relevance == Relevance.NOT_DISPLACEMENT:
+        category = None
+        skip_counts['category'] += 1
+    else:
+        content = analysis.content.content
+        if use_cache:
+            category = cached_predict_batch(session, category_model, [content])[0]
+        else:
+            category = category_model.predict(content)
     analysis.category = category
     analysis.relevance = relevance
     session.commit()
+
+
+def classify_batch(analyses, category_model, relevance_model, cascade=False, use_cache=False):
+    """
+    Tag and categorize several analyses at once, running each model a single time
+    over all of their content. Changes are not committed here; BatchWorker commits
+    them together with the analyses' new status.
+    With cascade, only the relevant analyses are categorized.
+    With use_cache, predictions are looked up in and saved to the classification cache.
+
+    :params analyses: A list of Analysis instances
+    :return: None
+    """
+    session = object_session(analyses[0]) if use_cache else None
+    relevances = predict_batch(relevance_model, [a.content.content_clean for a in analyses], session)
+    for analysis, relevance in zip(analyses, relevances):
+        analysis.relevance = relevance
+        analysis.category = None
+    if cascade:
+        to_categorize = [a for a in analyses if a.relevance != Relevance.NOT_DISPLACEMENT]
+        skip_counts['category'] += len(analyses) - len(to_categorize)
+    else:
+        to_categorize = analyses
+    if to_categorize:
+        categories = predict_batch(category_model, [a.content.content for a in to_categorize], session)
+        for analysis, category in zip(to_categorize, categories):
+            analysis.category = category
+
+
+def skip_extraction(analysis):
+    """
+    True if analysis was classified as not relevant, so extracting and geotagging it
+    would not change the fact API. For use as a Worker skip_function.
+    """
+    if analysis.relevance == Relevance.NOT_DISPLACEMENT:
+        skip_counts['extraction'] += 1
+        return True
+    return False
@@ -0,0 +1,31 @@
+'''Per-document word counts for the wordcloud.
+
+When a document is scraped, the TOP_TERMS most frequent words of its content_ts
+are stored in idetect_document_terms, so the wordcloud for a set of facts is a
+sum over the term rows of their documents instead of a ts_stat over their tsvectors.
+
+That sum is an approximation of ts_stat. A word only counts for the documents it is
+among the TOP_TERMS words of, so a word that is common across many documents without
+making any one document's top words is missing, and the ndoc of a word is the number
+of documents it is a top word of rather than the number it occurs in. For the words
+of a wordcloud, which are frequent in most documents, the two agree closely.
+'''
+from sqlalchemy import text
+
+TOP_TERMS = 100
+
+# a tsvector lexeme has one position per occurrence, as counted by ts_stat
+INSERT_TERMS = text("""
+INSERT INTO idetect_document_terms (content_id, word, nentry)
+SELECT content.id, terms.lexeme, coalesce(array_length(terms.positions, 1), 1) AS nentry
+  FROM idetect_document_contents content, unnest(content.content_ts) terms
+ WHERE content.id = :content_id
+ ORDER BY nentry DESC, terms.lexeme
+ LIMIT :top_terms
+ON CONFLICT (content_id, word) DO NOTHING
+""")
+
+
+def add_terms(session, content_id, top_terms=TOP_TERMS):
+    '''Store the most frequent words of a DocumentContent. Doesn't commit.'''
+    session.execute(INSERT_TERMS, {'content_id': content_id, 'top_terms': top_terms})
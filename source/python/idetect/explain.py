@@ -1,17 +1,22 @@
+import json
+
 from sqlalchemy import *
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import Executable, ClauseElement, _literal_as_text
 
 class explain(Executable, ClauseElement):
-    def __init__(self, stmt, analyze=False):
+    def __init__(self, stmt, analyze=False, format=None):
         self.statement = _literal_as_text(stmt)
         self.analyze = analyze
+        self.format = format
         # helps with INSERT statements
         self.inline = getattr(stmt, 'inline', None)
 
 @compiles(explain, 'postgresql')
 def pg_explain(element, compiler, **kw):
     text = "EXPLAIN "
+    if element.format:
+        text += "(FORMAT {}) ".format(element.format)
     if element.analyze:
         text += "ANALYZE "
     text += compiler.process(element.statement, **kw)
@@ -21,3 +26,10 @@ def explain_text(session, query):
     plan = session.execute(explain(query)).fetchall()
     lines = [r[0] for r in plan]
     return "\n".join(lines)
+
+def estimate_rows(session, query):
+    '''The number of rows the planner expects query to return, without running it'''
+    plan = session.execute(explain(getattr(query, 'statement', query), format='JSON')).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
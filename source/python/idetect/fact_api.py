@@ -3,10 +3,12 @@ import datetime
 import re
 
 
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, column, func, or_, text, literal_column, ARRAY, desc, over
+from sqlalchemy import Column, Integer, Float, String, Date, DateTime, ForeignKey, column, func, or_, text, literal_column, ARRAY, desc, over, \
+    any_, bindparam, select, tablesample, true
+from sqlalchemy.orm import aliased
 
-from idetect.model import Base, Gkg, DocumentContent, Analysis, Location, Country, Fact, Status
-from idetect.values import values
+from idetect.explain import estimate_rows
+from idetect.model import Base, Gkg, DocumentContent, DocumentTerm, Analysis, Location, Country, Fact, Status, Priority
 
 class FactApiLocations(Base):
     __tablename__ = 'idetect_fact_api_locations'
@@ -18,6 +20,34 @@ class FactApiLocations(Base):
     location_ids_num = Column(Integer)
     
 
+class LocationSet(Base):
+    '''A stable number for each distinct set of locations, used as location_ids_num'''
+    __tablename__ = 'idetect_location_sets'
+
+    id = Column(Integer, primary_key=True)
+    location_ids = Column(ARRAY(Integer), nullable=False, unique=True)
+
+
+class FactApiSync(Base):
+    '''How far idetect_fact_api has been brought up to date, see idetect/fact_api_sync.py'''
+    __tablename__ = 'idetect_fact_api_sync'
+
+    name = Column(String, primary_key=True)
+    synced_until = Column(DateTime(timezone=True))
+
+
+class RefreshLog(Base):
+    '''One refresh of a materialized view, see idetect/refresh.py'''
+    __tablename__ = 'idetect_refresh_log'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    method = Column(String)
+    started = Column(DateTime(timezone=True))
+    duration_seconds = Column(Float)
+    row_count = Column(Integer)
+
+
 class FactApi(Base):
     __tablename__ = 'idetect_fact_api'
 
@@ -44,6 +74,25 @@ class FactApi(Base):
     content_id = Column(Integer, ForeignKey('idetect_document_contents.id'))
     location_ids_num = Column(Integer)
 
+
+class FactApiRollup(Base):
+    '''
+    idetect_fact_api rows counted per day and filter value, see idetect/fact_api_sync.py.
+    fact_count is the number of idetect_fact_api rows in the group.
+    '''
+    __tablename__ = 'idetect_fact_api_rollup'
+
+    id = Column(Integer, primary_key=True)
+    gdelt_day = Column(Date, index=True)
+    category = Column(String)
+    unit = Column(String)
+    term = Column(String)
+    iso3 = Column(String)
+    source_common_name = Column(String)
+    specific_reported_figure = Column(Integer)
+    fact_count = Column(Integer, nullable=False)
+
+
 class Validation(Base):
     __tablename__ = 'idetect_validation'
     fact_id = Column(Integer,
@@ -67,46 +116,74 @@ class ValidationValues(Base):
     display_color = Column(String)
 
 
-def filter_by_locations(query, locations):
-    '''Because the location list is typically quite large, this does a VALUES query instead of an IN'''
+def filter_by_locations(query, locations, table=FactApi):
+    '''
+    The location list is typically quite large, so it is passed as a single array
+    parameter: the SQL is the same whatever the number of locations.
+    '''
     null = False
     if None in locations or 'NULL' in locations or 'null' in locations:
         null = True
-        locations = [l for l in locations if isinstance(l, int)]
+    locations = sorted({int(l) for l in locations if l not in (None, 'NULL', 'null')})
 
     if locations:
-        loctuples = [(l,) for l in set(locations)]
-        locs = values(
-            [column('location_id', Integer)],
-            *loctuples,
-            alias_name='locs'
-        )
-
+        in_locations = table.location == any_(bindparam(None, locations, type_=ARRAY(Integer)))
         if null:
             # Both the NULL location and some actual locations
-            return query.filter(or_(FactApi.location == None, FactApi.location == locs.c.location_id))
-        return query.filter(FactApi.location == locs.c.location_id)
+            return query.filter(or_(table.location == None, in_locations))
+        return query.filter(in_locations)
     if null:
         # Specifically looking for the NULL location only
-        return query.filter(FactApi.location == None)
+        return query.filter(table.location == None)
     # No locations to select
     return query
 
 
-def filter_by_specific_reported_figures(query, figures):
+def filter_by_specific_reported_figures(query, figures, table=FactApi):
     filters = []
     if None in figures or 'NULL' in figures or 'null' in figures:
-        filters.append(FactApi.specific_reported_figure == None)
+        filters.append(table.specific_reported_figure == None)
         figures = [l for l in figures if l not in [None,'NULL','null']]
     if figures:
         # figures are typically passed in as all values in a range
         # it's more efficient to just test the endpoints of the range
         least = min(figures)
         greatest = max(figures)
-        filters.append(FactApi.specific_reported_figure.between(least, greatest))
+        filters.append(table.specific_reported_figure.between(least, greatest))
     return query.filter(or_(*filters))
 
 
+def filter_by_text(query, ts, table=FactApi, others=None):
+    '''
+    Keep the facts whose documents match the full text search ts. others is a plain
+    query for the facts that pass the other filters (add_filters builds it), as query
+    itself may be an aggregate that can't be planned on its own. If the planner expects
+    fewer documents to match ts than facts in others, the matching documents are found
+    first with the GIN index and the facts are looked up by content_id. Otherwise the
+    document of each fact that passes the other filters is checked.
+
+    Choosing costs two EXPLAINs, each a round trip planned in a millisecond or so, which
+    is small next to a full text search and isn't repeated for responses in the API cache.
+    '''
+    session = query.session
+    if others is None:
+        others = session.query(table.content_id)
+    documents = select([DocumentContent.id]).where(
+        DocumentContent.content_ts.match(ts, postgresql_regconfig='simple_english'))
+    if estimate_rows(session, documents) <= estimate_rows(session, others):
+        # a CTE is planned on its own, so the GIN scan isn't folded into the other filters
+        matches = documents.cte('text_matches')
+        return query.filter(table.content_id.in_(select([matches.c.id])))
+    # a correlated subquery in the WHERE clause is evaluated after the cheaper conditions
+    content_ts = select([DocumentContent.content_ts]).where(DocumentContent.id == table.content_id).as_scalar()
+    return query.filter(content_ts.match(ts, postgresql_regconfig='simple_english'))
+
+
+class FilterException(Exception):
+    '''A filter parameter that can't be used, e.g. a location id that isn't a number'''
+    pass
+
+
 def parse_list(array_string):
     '''Turn "{Item1,Item2}" string into list'''
     if array_string is None:
@@ -128,104 +205,210 @@ def filter_params(data):
     filters['todate'] = data.get('todate')
     filters['ts'] = data.get('text_in_content')
     filters['location_ids_num'] = data.get('location_ids_num')
+    if filters['location_ids']:
+        for location_id in filters['location_ids']:
+            if location_id not in ('NULL', 'null') and not location_id.strip().lstrip('-').isdigit():
+                raise FilterException("Invalid location id: {}".format(location_id))
+    if filters['location_ids_num'] not in (None, ''):
+        try:
+            int(filters['location_ids_num'])
+        except (TypeError, ValueError):
+            raise FilterException("Invalid location_ids_num: {}".format(filters['location_ids_num']))
     return filters
 
 
+def page_params(data, limit=32):
+    '''The limit and offset of a page of results, as ints'''
+    try:
+        limit = int(data.get('limit', limit))
+        offset = int(data.get('offset', 0))
+    except (TypeError, ValueError):
+        raise FilterException("limit and offset must be integers")
+    if limit <= 0:
+        raise FilterException("limit must be positive: {}".format(limit))
+    if offset < 0:
+        raise FilterException("offset cannot be negative: {}".format(offset))
+    return limit, offset
+
+
 def add_filters(query,
                 fromdate=None, todate=None, location_ids=None,
                 categories=None, units=None, source_common_names=None,
                 terms=None, iso3s=None, specific_reported_figures=None,
-                ts=None,location_ids_num=None):
-    '''Add some of the known filters to the query'''  
+                ts=None,location_ids_num=None, table=FactApi):
+    '''
+    Add some of the known filters to the query. table may be an alias of FactApi,
+    or FactApiRollup if can_use_rollup says the filters allow it.
+    '''
     if fromdate:
-        query = query.filter(FactApi.gdelt_day >= fromdate)
+        query = query.filter(table.gdelt_day >= fromdate)
     if todate:
-        query = query.filter(FactApi.gdelt_day <= todate)
+        query = query.filter(table.gdelt_day <= todate)
     if location_ids:
-        query = filter_by_locations(query, location_ids)
+        query = filter_by_locations(query, location_ids, table)
     if categories:
-        query = query.filter(FactApi.category.in_(categories))
+        query = query.filter(table.category.in_(categories))
     if units:
-        query = query.filter(FactApi.unit.in_(units))
+        query = query.filter(table.unit.in_(units))
     if source_common_names:
-        query = query.filter(FactApi.source_common_name.in_(source_common_names))
+        query = query.filter(table.source_common_name.in_(source_common_names))
     if terms:
-        query = query.filter(FactApi.term.in_(terms))
+        query = query.filter(table.term.in_(terms))
     if iso3s:
-        query = query.filter(FactApi.iso3.in_(iso3s))
+        query = query.filter(table.iso3.in_(iso3s))
     if specific_reported_figures:
-        query = filter_by_specific_reported_figures(query, specific_reported_figures)
+        query = filter_by_specific_reported_figures(query, specific_reported_figures, table)
     # by default we exclude specific reported figures unless it is specifically added in specific_reported_figures
-    else: query = query.filter(FactApi.specific_reported_figure != None)
-    # TODO make sure we do full text search only after all the other filters have been applied
-    if ts:
-        query = (
-            query
-                .join(DocumentContent, DocumentContent.id == FactApi.content_id)
-                .filter(DocumentContent.content_ts.match(ts, postgresql_regconfig='simple_english'))
-        )
+    else: query = query.filter(table.specific_reported_figure != None)
     if location_ids_num:
-        query = query.filter(FactApi.location_ids_num == location_ids_num)
+        query = query.filter(table.location_ids_num == location_ids_num)
+    # full text search goes last, as filter_by_text looks at how selective the other filters are
+    if ts:
+        others = add_filters(query.session.query(table.content_id), fromdate=fromdate, todate=todate,
+                             location_ids=location_ids, categories=categories, units=units,
+                             source_common_names=source_common_names, terms=terms, iso3s=iso3s,
+                             specific_reported_figures=specific_reported_figures,
+                             location_ids_num=location_ids_num, table=table)
+        query = filter_by_text(query, ts, table, others)
     return query
 
 
+def can_use_rollup(filters):
+    '''The rollup has no full text or per-location detail, so it can't answer those filters'''
+    return not (filters.get('ts') or filters.get('location_ids') or filters.get('location_ids_num'))
+
+
+def aggregate_source(filters):
+    '''Return the table to count facts in for these filters, and the expression that counts them'''
+    if can_use_rollup(filters):
+        return FactApiRollup, func.sum(FactApiRollup.fact_count)
+    return FactApi, func.count(FactApi.fact)
+
+
+# number of words in a wordcloud
+WORDCLOUD_WORDS = 100
+
+# characters of context either side of a fact in the excerpt mode of get_urllist
+EXCERPT_MARGIN = 200
+
+# get_count_estimate counts exactly up to this many facts
+COUNT_EXACT_LIMIT = 10000
+
+FILTER_COUNT_COLUMNS = ('category', 'unit', 'source_common_name', 'term', 'iso3', 'specific_reported_figure')
+
+
 def get_filter_counts(session, **filters):
-    filter_counts = []
-    for filter_column in ('category', 'unit', 'source_common_name', 'term', 'iso3', 'specific_reported_figure'):
-        column = FactApi.__table__.c[filter_column]
-        query = (add_filters(session.query(func.count(FactApi.fact), column), **filters)
-        .distinct()
-        ).group_by(column)
-        for count, value in query.all():
-            filter_counts.append({'count': count, 'value': value, 'filter_type': filter_column})
-    return filter_counts
+    '''Count the facts for each value of each filter column, in a single pass over the filtered facts'''
+    table, count = aggregate_source(filters)
+    columns = [table.__table__.c[filter_column] for filter_column in FILTER_COUNT_COLUMNS]
+    # grouping(column) is 0 in the rows of the grouping set for that column
+    query = (
+        add_filters(session.query(count, *columns + [func.grouping(c) for c in columns]),
+                    table=table, **filters)
+            .group_by(func.grouping_sets(*columns))
+    )
+    counts = [[] for _ in columns]
+    for row in query.all():
+        count, values, grouping = row[0], row[1:len(columns) + 1], row[len(columns) + 1:]
+        i = grouping.index(0)
+        counts[i].append({'count': count, 'value': values[i], 'filter_type': FILTER_COUNT_COLUMNS[i]})
+    return [filter_count for column_counts in counts for filter_count in column_counts]
 
 
 def get_timeline_counts(session, **filters):
+    table, count = aggregate_source(filters)
     query = (
-        add_filters(session.query(func.count(FactApi.fact),
-                                  FactApi.gdelt_day,
-                                  FactApi.category),
-                    **filters)
-            .distinct()
-            .group_by(FactApi.gdelt_day, FactApi.category)
-            .order_by(FactApi.gdelt_day, FactApi.category)
+        add_filters(session.query(count,
+                                  table.gdelt_day,
+                                  table.category),
+                    table=table, **filters)
+            .group_by(table.gdelt_day, table.category)
+            .order_by(table.gdelt_day, table.category)
     )
     return [{"count": count, "category": category, "gdelt_day": day}
             for count, day, category in query.all()]
 
 
 def get_histogram_counts(session, **filters):
+    table, count = aggregate_source(filters)
     query = (
-        add_filters(session.query(func.count(FactApi.fact),
-                                  FactApi.unit,
-                                  FactApi.specific_reported_figure),
-                    **filters)
-            .distinct()
-            .group_by(FactApi.unit, FactApi.specific_reported_figure)
-            .order_by(FactApi.unit, FactApi.specific_reported_figure)
+        add_filters(session.query(count,
+                                  table.unit,
+                                  table.specific_reported_figure),
+                    table=table, **filters)
+            .group_by(table.unit, table.specific_reported_figure)
+            .order_by(table.unit, table.specific_reported_figure)
     )
     return [{"count": count, "unit": unit, "specific_reported_figure": specific_reported_figure}
             for count, unit, specific_reported_figure in query.all()]
 
 
-def get_wordcloud(session, engine, sample=1000, **filters):
-    # select a random sampling of matching facts
-    sample = (
+def get_wordcloud(session, sample=1000, **filters):
+    '''
+    The most frequent words in the documents of the matching facts, summed from
+    idetect_document_terms over the sample most recently scraped documents. Falls
+    back to get_wordcloud_sampled if those documents have no terms stored.
+    Only the TOP_TERMS words of each document are stored, so nentry leaves out
+    occurrences in documents where the word isn't a top word, and ndoc counts the
+    documents where it is one rather than every document containing it (see
+    idetect/document_terms.py).
+    '''
+    documents = (
         add_filters(session.query(FactApi.content_id), **filters)
             .distinct()
-            .order_by(func.random())
+            .order_by(FactApi.content_id.desc())
+            .limit(sample)
+    ).subquery()
+    query = (
+        session.query(DocumentTerm.word,
+                      func.sum(DocumentTerm.nentry).label('nentry'),
+                      func.count(DocumentTerm.content_id).label('ndoc'))
+            .join(documents, documents.c.content_id == DocumentTerm.content_id)
+            .group_by(DocumentTerm.word)
+            .order_by(desc('nentry'), desc('ndoc'), DocumentTerm.word)
+            .limit(WORDCLOUD_WORDS)
+    )
+    words = [{"word": r.word, "nentry": r.nentry, "ndoc": r.ndoc} for r in query.all()]
+    if words:
+        return words
+    return get_wordcloud_sampled(session, sample, **filters)
+
+
+def get_wordcloud_sampled(session, sample=1000, **filters):
+    '''
+    The most frequent words in the documents of about sample matching facts, counted from
+    their tsvectors like ts_stat does. The facts come from a repeatable TABLESAMPLE sized by
+    the planner's estimate of how many facts match, rather than from sorting every matching
+    fact randomly. If no more than sample facts are expected to match, they are all used,
+    as a 100 percent sample would read every page of idetect_fact_api instead of the indexes.
+    '''
+    matching = estimate_rows(session, add_filters(session.query(FactApi.content_id), **filters))
+    if matching <= sample:
+        sampled = FactApi
+    else:
+        percent = 100.0 * sample / matching
+        sampled = aliased(FactApi, tablesample(FactApi.__table__, func.system(percent), name='sampled', seed=0))
+    documents = (
+        add_filters(session.query(sampled.content_id), table=sampled, **filters)
+            .distinct()
             .limit(sample)
     ).subquery()
+    # one row per distinct word in each document, with a position for each occurrence
+    terms = func.unnest(DocumentContent.content_ts).alias('terms')
+    word = literal_column('terms.lexeme')
     query = (
-        session.query(DocumentContent.content_ts)
-            .join(sample, sample.c.content_id == DocumentContent.id)
+        session.query(word.label('word'),
+                      func.sum(func.coalesce(func.array_length(literal_column('terms.positions'), 1), 1))
+                      .label('nentry'),
+                      func.count().label('ndoc'))
+            .select_from(DocumentContent)
+            .join(documents, documents.c.content_id == DocumentContent.id)
+            .join(terms, true())
+            .group_by(word)
+            .order_by(desc('nentry'), desc('ndoc'), word)
+            .limit(WORDCLOUD_WORDS)
     )
-    literal_query = query.statement.compile(engine, compile_kwargs={"literal_binds": True})
-    ts_stat = text('''SELECT * FROM ts_stat($${}$$)
-                          ORDER BY nentry DESC, ndoc DESC, word
-                          LIMIT 100'''.format(literal_query))
-    return [{"word": r.word, "nentry": r.nentry, "ndoc": r.ndoc} for r in session.execute(ts_stat)]
+    return [{"word": r.word, "nentry": r.nentry, "ndoc": r.ndoc} for r in query.all()]
 
 
 def get_count(session, **filters):
@@ -233,14 +416,54 @@ def get_count(session, **filters):
     .distinct(FactApi.fact)
     .order_by(FactApi.fact)).count()
 
+
+def get_count_estimate(session, exact_limit=COUNT_EXACT_LIMIT, **filters):
+    '''
+    Return (count, exact): the exact number of facts if there are at most exact_limit,
+    otherwise the planner's estimate, which costs a plan rather than a scan of every match.
+    '''
+    facts = add_filters(session.query(FactApi.fact), **filters).distinct(FactApi.fact)
+    count = session.query(facts.limit(exact_limit + 1).subquery()).count()
+    if count <= exact_limit:
+        return count, True
+    return max(estimate_rows(session, facts), count), False
+
+
 def get_group_count(session, **filters):
     ngroups = (add_filters(session.query(FactApi.fact), **filters)
     .distinct(FactApi.specific_reported_figure,FactApi.location_ids_num,FactApi.term,FactApi.unit)).count()
     return ngroups
 
-def get_urllist(session, limit=32, offset=0, **filters):
-    # select the facts that match the filters
-    facts = (add_filters(
+
+def excerpt_columns(margin=EXCERPT_MARGIN):
+    '''
+    The text of a fact's excerpt with margin characters either side, and excerpt_offset,
+    the position in content_clean where it starts. excerpt_start, excerpt_end and the
+    tags are positions in content_clean, so subtract excerpt_offset to find them in excerpt.
+    '''
+    excerpt_offset = func.greatest(Fact.excerpt_start - margin, 0)
+    return [
+        # substr counts from 1
+        func.substr(DocumentContent.content_clean, excerpt_offset + 1,
+                    Fact.excerpt_end + margin - excerpt_offset).label('excerpt'),
+        excerpt_offset.label('excerpt_offset'),
+    ]
+
+
+def get_urllist(session, limit=32, offset=0, after_fact=None, excerpt=False, **filters):
+    '''
+    One page of the facts that match the filters, in fact order. after_fact is the
+    fact_id of the last row of the previous page: pages fetched with it start from
+    the index rather than rescanning every earlier row, as a large offset does.
+    With excerpt, each row has the excerpt around the fact (see excerpt_columns)
+    instead of the whole content_clean of its document, which get_document returns.
+    '''
+    if excerpt:
+        content = excerpt_columns()
+    else:
+        content = [DocumentContent.content_clean.label('content_clean')]
+    # pick the page of facts first, so the joins below only run for the rows returned
+    page = add_filters(
         session.query(
             FactApi.document_identifier.label('document_identifier'),
             FactApi.fact.label('fact_id'),
@@ -253,34 +476,54 @@ def get_urllist(session, limit=32, offset=0, **filters):
             FactApi.vague_reported_figure.label('vague_reported_figure'),
             FactApi.category.label('category'),
             FactApi.gkg_id.label('gkg_id'),
-            FactApiLocations.location_ids.label('location_ids'),
-            FactApiLocations.location_names.label('location_names'),
-            Analysis.authors.label('authors'),
-            Analysis.title.label('title'),
-            DocumentContent.content_clean.label('content_clean'),
-            Fact.tag_locations.label('tags'),
-            Fact.excerpt_start.label('excerpt_start'),
-            Fact.excerpt_end.label('excerpt_end'),
-            Validation.assigned_to.label('assigned_to'),
-            Validation.missing.label('missing'),
-            Validation.status.label('status'),
-            Validation.wrong.label('wrong'),
-            ValidationValues.display_color.label('display_color'),
+            FactApi.content_id.label('content_id'),
         ), **filters)
-            .distinct(FactApi.fact)
-            .order_by(FactApi.fact,FactApi.gdelt_day)
-            .join(FactApiLocations,FactApi.fact == FactApiLocations.fact)
-            .join(Analysis, FactApi.gkg_id == Analysis.gkg_id)
-            .join(Fact, FactApi.fact == Fact.id)
-            .outerjoin(Validation, FactApi.fact == Validation.fact_id)
+    if after_fact is not None:
+        # a fact has a single gdelt_day, so the fact alone orders the (fact, gdelt_day) keys
+        page = page.filter(FactApi.fact > after_fact)
+    page = (
+        page.distinct(FactApi.fact)
+            .order_by(FactApi.fact, FactApi.gdelt_day)
+            .limit(limit)
+            .offset(offset)
+            .subquery('page')
+    )
+    columns = [
+        page.c.document_identifier,
+        page.c.fact_id,
+        page.c.gdelt_day,
+        page.c.iso3,
+        page.c.source_common_name,
+        page.c.specific_reported_figure,
+        page.c.term,
+        page.c.unit,
+        page.c.vague_reported_figure,
+        page.c.category,
+        page.c.gkg_id,
+        FactApiLocations.location_ids.label('location_ids'),
+        FactApiLocations.location_names.label('location_names'),
+        Analysis.authors.label('authors'),
+        Analysis.title.label('title'),
+    ] + content + [
+        Fact.tag_locations.label('tags'),
+        Fact.excerpt_start.label('excerpt_start'),
+        Fact.excerpt_end.label('excerpt_end'),
+        Validation.assigned_to.label('assigned_to'),
+        Validation.missing.label('missing'),
+        Validation.status.label('status'),
+        Validation.wrong.label('wrong'),
+        ValidationValues.display_color.label('display_color'),
+    ]
+    facts = (
+        session.query(*columns)
+            .join(FactApiLocations, page.c.fact_id == FactApiLocations.fact)
+            .join(Analysis, page.c.gkg_id == Analysis.gkg_id)
+            .join(Fact, page.c.fact_id == Fact.id)
+            .join(DocumentContent, page.c.content_id == DocumentContent.id)
+            .outerjoin(Validation, page.c.fact_id == Validation.fact_id)
             .outerjoin(ValidationValues, Validation.status == ValidationValues.idetect_validation_key_value)
-            
+            .order_by(page.c.fact_id)
     )
-    # if we filter by text this is already joined and SQLAlchemy return an error
-    if filters['ts'] is None:
-        facts=facts.join(DocumentContent, FactApi.content_id == DocumentContent.id)
-    # limit and offset must be applied after all the joins
-    facts=facts.limit(limit).offset(offset)
     return [dict(r.items()) for r in session.execute(facts)]
 
 
@@ -323,7 +566,7 @@ def get_urllist_grouped(session, limit=32, offset=0, **filters):
     return [dict(r.items()) for r in session.execute(fact_groups)]
 
 def get_map_week(session):
-    query = text("SELECT * FROM idetect_map_week_mview")
+    query = text("SELECT entries FROM idetect_map_week_mview")
     return [{'entries': session.execute(query).first()[0]}]
 
 def work(session, analysis, working_status, success_status, failure_status, function):
@@ -355,16 +598,72 @@ def get_scn_from_url(url):
             return  re.search('(?<=\/\/).*?(?=\/)',url).group(0)
         except: return None  
 
-def create_new_analysis_from_url(session,url):
+def create_new_analysis_from_url(session,url,priority=Priority.NORMAL):
     scn=get_scn_from_url(url)
     now=datetime.datetime.now()
     gkg_date=('{:04d}{:02d}{:02d}{:02d}{:02d}{:02d}'.format(now.year,now.month,now.day,now.hour,now.minute,now.second))
     article = Gkg(document_identifier=url,date=gkg_date,source_common_name=scn)
-    analysis=Analysis(gkg=article, status=Status.NEW,retrieval_attempts=0)
+    analysis=Analysis(gkg=article, status=Status.NEW,retrieval_attempts=0,priority=priority)
     session.add(analysis)
     session.commit()
     return analysis
 
+def get_analysis_status(session, gkg_id):
+    '''Return the current status of an Analysis, or None if it doesn't exist'''
+    analysis = session.query(Analysis.status, Analysis.error_msg, Analysis.next_attempt_at) \
+        .filter(Analysis.gkg_id == gkg_id).first()
+    if analysis is None:
+        return None
+    return {'gkg_id': gkg_id, 'status': analysis.status, 'error_msg': analysis.error_msg,
+            'next_attempt_at': analysis.next_attempt_at}
+
+# pipeline stage and number of completed stages for each status an analyse_url job can be in
+JOB_STAGES = {
+    Status.NEW: ('queued', 0),
+    Status.SCRAPING: ('scraping', 0),
+    Status.SCRAPED: ('scraping', 1),
+    Status.CLASSIFYING: ('classifying', 1),
+    Status.CLASSIFIED: ('classifying', 2),
+    Status.EXTRACTING: ('extracting', 2),
+    Status.EXTRACTED: ('extracting', 3),
+    Status.GEOTAGGING: ('geotagging', 3),
+    Status.GEOTAGGED: ('geotagging', 4),
+    Status.SKIPPED: ('skipped', 4),  # not relevant, so there is nothing to extract
+    Status.SCRAPING_FAILED: ('scraping', 0),
+    Status.CLASSIFYING_FAILED: ('classifying', 1),
+    Status.EXTRACTING_FAILED: ('extracting', 2),
+    Status.GEOTAGGING_FAILED: ('geotagging', 3),
+}
+# a job in one of these statuses has failed, unless the worker has scheduled a retry
+JOB_FAILED_STATUSES = {Status.SCRAPING_FAILED, Status.CLASSIFYING_FAILED, Status.EXTRACTING_FAILED,
+                       Status.GEOTAGGING_FAILED, Status.DEAD_LETTER}
+
+def get_job(session, gkg_id, include_result=True):
+    '''Return the progress of the analyse_url job for an Analysis, plus the document
+    and facts once it has finished. A failed stage that will be retried isn't a failed
+    job: it has next_attempt_at instead. Returns None if the job doesn't exist'''
+    analysis_status = get_analysis_status(session, gkg_id)
+    if analysis_status is None:
+        return None
+    status = analysis_status['status']
+    stage, completed = JOB_STAGES.get(status, (status, 0))
+    job = {
+        'job_id': gkg_id,
+        'status': status,
+        'stage': stage,
+        'progress': completed / 4,
+        'done': status in (Status.GEOTAGGED, Status.SKIPPED),
+        'failed': status in JOB_FAILED_STATUSES and analysis_status['next_attempt_at'] is None,
+    }
+    if status in JOB_FAILED_STATUSES:
+        job['error_msg'] = analysis_status['error_msg']
+    if not job['failed'] and analysis_status['next_attempt_at'] is not None:
+        job['next_attempt_at'] = analysis_status['next_attempt_at'].isoformat()
+    if job['done'] and include_result:
+        job['document'] = get_document(session, gkg_id)
+        job['facts'] = get_facts_for_document(session, gkg_id)
+    return job
+
 def get_document(session, gkg_id=None):
     # select the facts that match the filters
     document = (
@@ -0,0 +1,236 @@
+'''Incremental maintenance of the fact API tables.
+
+idetect_fact_api_locations and idetect_fact_api used to be materialized views
+refreshed in full twice a day. They are now plain tables with the same columns
+and indexes, and each Analysis's rows are replaced whenever it changes, using the
+same definition as the views: every fact with a location, and in idetect_fact_api
+only the facts of Analyses with a category. location_ids_num comes from
+idetect_location_sets, which gives every distinct set of locations a stable number.
+
+idetect_fact_api_rollup counts the idetect_fact_api rows per day and filter value,
+for the timeline, histogram and filter counts. Its rows for a day are recomputed
+from idetect_fact_api whenever a row from that day is added, changed or deleted.
+
+sync_analysis rewrites the rows of one Analysis; sync_updated does it for every
+Analysis that has changed since the last sync and is run by run_fact_api_sync.py.
+Analyses that are deleted never show up as changed, so sweep removes the rows of
+Analyses and facts that no longer exist from time to time. sync_once does one pass of
+run_fact_api_sync.py's loop.
+'''
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from sqlalchemy import exists, func, or_, text
+
+from idetect.api_cache import bump_generation
+from idetect.fact_api import FactApi, FactApiSync
+from idetect.model import Analysis, analysis_fact
+from idetect.refresh import warm_fact_api
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SYNC_NAME = 'fact_api'
+# re-sync this far back, to catch Analyses whose transactions committed out of order
+OVERLAP = timedelta(minutes=5)
+
+LOCK_ANALYSIS = text("SELECT pg_advisory_xact_lock(:gkg_id)")
+# a different lock space from the gkg ids
+LOCK_ROLLUP = text("SELECT pg_advisory_xact_lock(hashtext('idetect_fact_api_rollup'), 0)")
+
+ADD_LOCATION_SETS = text("""
+INSERT INTO idetect_location_sets (location_ids)
+SELECT DISTINCT sort(array_agg(idetect_fact_locations.location))
+  FROM idetect_fact_locations
+  JOIN idetect_analysis_facts ON idetect_analysis_facts.fact = idetect_fact_locations.fact
+ WHERE idetect_analysis_facts.analysis = :gkg_id
+   AND idetect_fact_locations.location IS NOT NULL
+ GROUP BY idetect_fact_locations.fact
+ON CONFLICT (location_ids) DO NOTHING
+""")
+
+# the facts the Analysis had when it was last synced as well as its current ones,
+# so that facts dropped by an edit don't stay behind
+DELETE_FACT_LOCATIONS = text("""
+DELETE FROM idetect_fact_api_locations
+ WHERE fact IN (SELECT fact FROM idetect_analysis_facts WHERE analysis = :gkg_id
+                UNION
+                SELECT fact FROM idetect_fact_api WHERE gkg_id = :gkg_id)
+RETURNING *
+""")
+
+INSERT_FACT_LOCATIONS = text("""
+WITH fact_locations AS (
+         SELECT idetect_fact_locations.fact,
+            sort(array_agg(idetect_fact_locations.location)) AS location_ids,
+            array_agg(idetect_locations.location_name) AS location_names
+           FROM idetect_fact_locations
+           JOIN idetect_analysis_facts ON idetect_analysis_facts.fact = idetect_fact_locations.fact
+           LEFT JOIN idetect_locations ON idetect_fact_locations.location = idetect_locations.id
+          WHERE idetect_analysis_facts.analysis = :gkg_id
+            AND idetect_fact_locations.location IS NOT NULL
+          GROUP BY idetect_fact_locations.fact
+        )
+INSERT INTO idetect_fact_api_locations (fact, location_ids, location_names, location_ids_num)
+SELECT fact_locations.fact,
+       fact_locations.location_ids,
+       fact_locations.location_names,
+       idetect_location_sets.id
+  FROM fact_locations
+  JOIN idetect_location_sets USING (location_ids)
+RETURNING *
+""")
+
+DELETE_FACTS = text("DELETE FROM idetect_fact_api WHERE gkg_id = :gkg_id RETURNING *")
+
+INSERT_FACTS = text("""
+INSERT INTO idetect_fact_api
+SELECT
+    gkg.document_identifier,
+    gkg.source_common_name,
+    TO_DATE(SUBSTR((gkg.date)::text, 1, 8), 'YYYYMMDD'::text) AS gdelt_day,
+    idetect_facts.id AS fact,
+    idetect_facts.unit,
+    idetect_facts.term,
+    idetect_facts.specific_reported_figure,
+    idetect_facts.vague_reported_figure,
+    idetect_facts.iso3,
+    idetect_fact_locations.location,
+    idetect_analyses.gkg_id,
+    idetect_analyses.category,
+    idetect_analyses.content_id,
+    idetect_fact_api_locations.location_ids_num
+  from idetect_facts
+  join idetect_analysis_facts ON idetect_facts.id = idetect_analysis_facts.fact
+  join idetect_analyses ON idetect_analysis_facts.analysis = idetect_analyses.gkg_id
+  join gkg ON gkg.id = idetect_analyses.gkg_id
+  inner join idetect_fact_locations ON idetect_facts.id = idetect_fact_locations.fact
+  join idetect_fact_api_locations ON idetect_fact_api_locations.fact=idetect_facts.id
+  where idetect_analyses.category is not null
+    and idetect_analyses.gkg_id = :gkg_id
+RETURNING *
+""")
+
+SWEEP_FACTS = text("""
+DELETE FROM idetect_fact_api
+ WHERE NOT EXISTS (SELECT 1 FROM idetect_analyses WHERE idetect_analyses.gkg_id = idetect_fact_api.gkg_id)
+RETURNING gkg_id, gdelt_day
+""")
+
+SWEEP_FACT_LOCATIONS = text("""
+DELETE FROM idetect_fact_api_locations
+ WHERE NOT EXISTS (SELECT 1 FROM idetect_analysis_facts
+                    WHERE idetect_analysis_facts.fact = idetect_fact_api_locations.fact)
+""")
+
+
+# the NULL day can't be matched with ANY, so it is passed separately as null_day
+DELETE_ROLLUP = text("""
+DELETE FROM idetect_fact_api_rollup
+ WHERE gdelt_day = ANY(:days) OR (:null_day AND gdelt_day IS NULL)
+""")
+
+INSERT_ROLLUP = text("""
+INSERT INTO idetect_fact_api_rollup (gdelt_day, category, unit, term, iso3, source_common_name,
+                                     specific_reported_figure, fact_count)
+SELECT gdelt_day, category, unit, term, iso3, source_common_name, specific_reported_figure, count(fact)
+  FROM idetect_fact_api
+ WHERE gdelt_day = ANY(:days) OR (:null_day AND gdelt_day IS NULL)
+ GROUP BY gdelt_day, category, unit, term, iso3, source_common_name, specific_reported_figure
+""")
+
+
+def sync_analysis(session, gkg_id):
+    '''
+    Replace the fact API rows of one Analysis. Returns whether that changed any of them, as
+    an Analysis is often synced again without having changed, and the days of the
+    idetect_fact_api rows that were added or removed. Doesn't commit.
+    '''
+    params = {'gkg_id': gkg_id}
+    # two syncs of the same Analysis at once would insert its rows twice
+    session.execute(LOCK_ANALYSIS, params)
+    session.execute(ADD_LOCATION_SETS, params)
+    old_locations = Counter(tuple(row) for row in session.execute(DELETE_FACT_LOCATIONS, params))
+    new_locations = Counter(tuple(row) for row in session.execute(INSERT_FACT_LOCATIONS, params))
+    old_facts = session.execute(DELETE_FACTS, params).fetchall()
+    new_facts = session.execute(INSERT_FACTS, params).fetchall()
+    old_counts = Counter(tuple(row) for row in old_facts)
+    new_counts = Counter(tuple(row) for row in new_facts)
+    differing = (old_counts - new_counts) + (new_counts - old_counts)
+    days = {row.gdelt_day for row in old_facts + new_facts if tuple(row) in differing}
+    return old_locations != new_locations or bool(differing), days
+
+
+def sweep(session):
+    '''
+    Delete the fact API rows of Analyses that no longer exist, and the locations of facts
+    that no Analysis has any more, then recompute the rollup rows for their days. Returns
+    the number of deleted Analyses. Doesn't commit.
+    '''
+    deleted = session.execute(SWEEP_FACTS).fetchall()
+    session.execute(SWEEP_FACT_LOCATIONS)
+    sync_rollup(session, {row.gdelt_day for row in deleted})
+    return len({row.gkg_id for row in deleted})
+
+
+def sync_rollup(session, days):
+    '''Recompute the rollup rows for the given days, which may include None. Doesn't commit.'''
+    if not days:
+        return
+    params = {'days': [day for day in days if day is not None], 'null_day': None in days}
+    session.execute(LOCK_ROLLUP)
+    session.execute(DELETE_ROLLUP, params)
+    session.execute(INSERT_ROLLUP, params)
+
+
+def sync_updated(session):
+    '''
+    Sync every Analysis that has been updated since the last sync and has facts or fact
+    API rows, then the rollup rows for the days whose facts changed. It all commits at
+    once, so that a failure part way through can't leave the rollup behind the changes
+    it would need to pick up. Returns the number of Analyses whose rows changed.
+    '''
+    state = session.query(FactApiSync).filter(FactApiSync.name == SYNC_NAME).one_or_none()
+    if state is None:
+        state = FactApiSync(name=SYNC_NAME)
+        session.add(state)
+    started = session.query(func.now()).scalar()
+    # Analyses without either have nothing to sync, whatever their status
+    query = session.query(Analysis.gkg_id) \
+        .filter(or_(exists().where(analysis_fact.c.analysis == Analysis.gkg_id),
+                    exists().where(FactApi.gkg_id == Analysis.gkg_id)))
+    if state.synced_until is not None:
+        query = query.filter(Analysis.updated > state.synced_until - OVERLAP)
+    changed = 0
+    days = set()
+    for gkg_id, in query.all():
+        analysis_changed, analysis_days = sync_analysis(session, gkg_id)
+        changed += analysis_changed
+        days |= analysis_days
+    # once per day rather than per Analysis, as a day can have thousands of facts
+    sync_rollup(session, days)
+    state.synced_until = started
+    session.commit()
+    return changed
+
+
+def sync_once(session, sweep_deleted=False):
+    '''
+    Sync the updated Analyses, and sweep away deleted ones too if sweep_deleted. If any
+    rows changed, invalidate and warm the cached fact API responses. Returns the number
+    of Analyses whose rows changed or were removed.
+    '''
+    count = sync_updated(session)
+    if sweep_deleted:
+        deleted = sweep(session)
+        session.commit()
+        if deleted:
+            logger.info("Removed {} deleted Analyses from the fact API".format(deleted))
+        count += deleted
+    if count:
+        # cached API responses no longer reflect the fact API tables
+        bump_generation(session)
+        logger.info("Changed the fact API rows of {} Analyses".format(count))
+        warm_fact_api(session)
+    return count
@@ -4,16 +4,25 @@ How to ensure has access to pre-loaded models?
 '''
 import json
 
-import spacy
 from itertools import groupby
 from sqlalchemy.orm import object_session
 from sqlalchemy.exc import IntegrityError
 
-from idetect.interpreter import Interpreter
 from idetect.model import Fact, Location, Country
 
-nlp = spacy.load("en_default")
-print("Loaded Spacy English Language NLP Models.")
+nlp = None
+
+
+def get_nlp():
+    '''Return the spaCy English language model, loading it on first use
+    so that importing this module stays cheap
+    '''
+    global nlp
+    if nlp is None:
+        import spacy
+        nlp = spacy.load("en_default")
+        print("Loaded Spacy English Language NLP Models.")
+    return nlp
 
 
 def extract_facts(analysis):
@@ -21,8 +30,9 @@ def extract_facts(analysis):
     :params article: instance of Analysis
     :return: None
     '''
+    from idetect.interpreter import Interpreter
     session = object_session(analysis)
-    interpreter = Interpreter(session, nlp)
+    interpreter = Interpreter(session, get_nlp())
     content = analysis.content.content_clean # Use the cleaned content field
     facts = interpreter.process_article_new(content)
     if len(facts) > 0:
@@ -2,9 +2,11 @@ import os
 import ast
 import re
 import string
+from urllib.parse import urlparse
 
 from sqlalchemy import Column, BigInteger, Integer, String, Date, DateTime, Boolean, \
     Numeric, ForeignKey, Table, Index, Text, UniqueConstraint
+from sqlalchemy import event
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
@@ -51,6 +53,13 @@ class Status:
     GEOTAGGING_FAILED = 'geotagging failed'
     EDITING = 'editing'
     EDITED = 'edited'
+    DEAD_LETTER = 'dead letter'  # failed too many times, won't be retried
+    SKIPPED = 'skipped'  # classified as not relevant, so not extracted or geotagged
+
+
+class Priority:
+    NORMAL = 0
+    INTERACTIVE = 10
 
 
 class DisplacementType:
@@ -138,6 +147,10 @@ class Analysis(Base):
     analyzer = Column(String)
     response_code = Column(Integer)
     retrieval_attempts = Column(Integer, default=0)
+    priority = Column(Integer, nullable=False, default=Priority.NORMAL, server_default='0')
+    retry_attempts = Column(Integer, default=0)  # consecutive failures at the current stage
+    next_attempt_at = Column(DateTime(timezone=True))  # when a failed analysis may be retried
+    domain = Column(String)  # politeness domain of the gkg, see gkg_domain
     completion = Column(Numeric)
     retrieval_date = Column(DateTime(timezone=True))
     created = Column(DateTime(timezone=True), server_default=func.now())
@@ -187,6 +200,34 @@ class Analysis(Base):
         finally:
             session.rollback()  # make sure we release the FOR UPDATE lock
 
+    @classmethod
+    def create_new_versions(cls, session, new_statuses):
+        """
+        Create new versions of several analyses in a single transaction. new_statuses is a list of
+        (analysis, new status) pairs. If any of them is not the most recent version, this will raise
+        NotLatestException and none of them will change.
+        """
+        try:
+            for analysis, new_status in new_statuses:
+                try:
+                    session.query(Analysis) \
+                        .filter(Analysis.gkg_id == analysis.gkg_id) \
+                        .filter(Analysis.status == analysis.status) \
+                        .with_for_update().one()
+                except NoResultFound:
+                    raise NotLatestException(analysis)
+
+                dict = {c.name: analysis.__getattribute__(c.name) for c in Analysis.__table__.columns}
+                history = AnalysisHistory(**dict)
+                history.facts = analysis.facts
+                session.add(history)
+
+                analysis.updated = func.now()
+                analysis.status = new_status
+            session.commit()
+        finally:
+            session.rollback()  # make sure we release the FOR UPDATE locks
+
     def tagged_text(self):
         # Add tags to article content for display purposes
         spans = self.get_unique_tag_spans()
@@ -258,6 +299,16 @@ class Analysis(Base):
 
 
 status_updated_index = Index('document_analyses_status_updated', Analysis.status, Analysis.updated)
+status_priority_updated_index = Index('document_analyses_status_priority_updated',
+                                      Analysis.status, Analysis.priority.desc(), Analysis.updated)
+status_next_attempt_index = Index('document_analyses_status_next_attempt',
+                                  Analysis.status, Analysis.next_attempt_at,
+                                  postgresql_where=Analysis.next_attempt_at.isnot(None))
+# analyses updated since the last sync, for idetect/fact_api_sync.py
+updated_index = Index('document_analyses_updated', Analysis.updated)
+# analyses being scraped, counted per domain by idetect/politeness.py
+scraping_domain_index = Index('document_analyses_scraping_domain', Analysis.domain,
+                              postgresql_where=Analysis.status == Status.SCRAPING)
 
 
 class AnalysisHistory(Base):
@@ -277,6 +328,10 @@ class AnalysisHistory(Base):
     analyzer = Column(String)
     response_code = Column(Integer)
     retrieval_attempts = Column(Integer, default=0)
+    priority = Column(Integer)
+    retry_attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True))
+    domain = Column(String)
     completion = Column(Numeric)
     retrieval_date = Column(DateTime(timezone=True))
     created = Column(DateTime(timezone=True), server_default=func.now())
@@ -288,6 +343,60 @@ class AnalysisHistory(Base):
     processing_time = Column(Numeric)  # time it took to process to bring it to the current status
 
 
+# recent processing times per status, sampled by idetect/autoscaler.py
+history_status_updated_index = Index('analysis_histories_status_updated',
+                                     AnalysisHistory.status, AnalysisHistory.updated)
+
+
+class Domain(Base):
+    """Per-domain scraping state, shared by all scraper processes"""
+    __tablename__ = 'idetect_domains'
+
+    name = Column(String, primary_key=True)
+    next_request = Column(DateTime(timezone=True))  # earliest time the next request may be sent
+    consecutive_failures = Column(Integer, nullable=False, default=0)
+    open_until = Column(DateTime(timezone=True))  # circuit breaker: defer this domain until then
+    # limits for this domain; NULL means the defaults in idetect/politeness.py
+    seconds_between_requests = Column(Numeric)
+    max_concurrent_requests = Column(Integer)
+
+
+def gkg_domain(gkg):
+    """The domain a Gkg is scraped from: its source_common_name, or else the host of its url"""
+    if gkg.source_common_name:
+        return gkg.source_common_name
+    host = urlparse(gkg.document_identifier or '').hostname or ''
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or None
+
+
+@event.listens_for(Analysis, 'before_insert')
+def _set_domain(mapper, connection, analysis):
+    if analysis.domain is None and analysis.gkg is not None:
+        analysis.domain = gkg_domain(analysis.gkg)
+
+
+class CacheGeneration(Base):
+    """A counter that is bumped whenever the data behind a cache changes, see idetect/api_cache.py"""
+    __tablename__ = 'idetect_cache_generations'
+
+    name = Column(String, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+    updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ClassificationResult(Base):
+    """A cached model prediction for a text, identified by the sha256 of the text and of the model file"""
+    __tablename__ = 'idetect_classification_cache'
+
+    content_hash = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    model_sha256 = Column(String, primary_key=True)
+    result = Column(postgresql.JSONB)
+    created = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class DocumentContent(Base):
     __tablename__ = 'idetect_document_contents'
 
@@ -299,6 +408,15 @@ class DocumentContent(Base):
     content_ts = Column(TSVECTOR)
 
 
+class DocumentTerm(Base):
+    """How often one of the most frequent words of a document occurs in it, see idetect/document_terms.py"""
+    __tablename__ = 'idetect_document_terms'
+
+    content_id = Column(Integer, ForeignKey('idetect_document_contents.id', ondelete='CASCADE'), primary_key=True)
+    word = Column(String, primary_key=True)
+    nentry = Column(Integer, nullable=False)
+
+
 class FactUnit:
     PEOPLE = 'Person'
     HOUSEHOLDS = 'Household'
@@ -1,18 +1,17 @@
-import errno
-import fcntl
-import os
 import re
+import time
 import numpy as np
 import pandas as pd
-import requests
-import spacy
-from sklearn.externals import joblib
 from sklearn.base import TransformerMixin, BaseEstimator
 from scipy import sparse
 from gensim import matutils, models
 from gensim.sklearn_integration.sklearn_wrapper_gensim_lsimodel import SklLsiModel
 
 from idetect.geotagger import strip_accents, compare_strings, strip_words, LocationType, subdivision_country_code, match_country_name, city_subdivision_country
+from idetect.nlp_models.model_store import ModelStore
+
+# how often a model checks the store for a new current version
+REFRESH_SECONDS = 60
 
 class DownloadableModel(object):
     """A base class for loading pickeld scikit-learn models that may be stored
@@ -21,63 +20,44 @@ class DownloadableModel(object):
     Attributes:
         model (sklearn model): a scikit-learn Transformer, Estimator, or
             Pipeline, which has the "predict" method.
+        version (str): the model store version that model was loaded from.
+        sha256 (str): the checksum of that version's model file, which changes
+            whenever the model does, even if a version is republished.
     """
 
-#    def __init__(self, model_path, model_url):
-#        self.model = self.load_model(model_path, model_url)
-
-    def load_model(self, model_path, model_url):
-        """Obtains and loads a pickled scikit-learn model. Checks to see if
-        the model exists at the specified directory and if not, downloads it
-        from a URL.
+    def load_from_store(self, version=None):
+        """Load a version of this model from the model store, installing it from
+        self.model_url if necessary, checked against self.model_sha256 if that is set.
+        Subclasses set name, default_version, and model_url.
 
         Args:
-            model_path (str): Path to a model's current location, or the
-                location to which it should be downloaded.
-            model_url (str): URL where a model lives in storage.
+            version (str): The version to load. Defaults to the store's current
+                version of the model, or default_version if there isn't one.
+        """
+        if not hasattr(self, 'store'):
+            self.store = ModelStore()
+        version = version or self.store.current_version(self.name) or self.default_version
+        if not self.store.has(self.name, version):
+            self.store.install(self.name, version, self.model_url,
+                               expected_sha256=getattr(self, 'model_sha256', None),
+                               make_current=self.store.current_version(self.name) is None)
+        self.model = self.store.load(self.name, version)
+        self.version = version
+        self.sha256 = self.store.manifest(self.name, version)['sha256']
+        self.checked = time.time()
 
-        Returns:
-            model (sklearn model): An unpickled sklearn model (Transformer,
-                Estimator, or Pipeline).
+    def refresh(self):
+        """Switch to the store's current version of this model if it has changed,
+        checking at most every REFRESH_SECONDS. Returns True iff a new version was loaded.
         """
-        # Load users model if specified and exists
-        if os.path.isfile(model_path):
-            with open(model_path, 'rb') as f:
-                # get exclusive lock in case currently being downloaded by
-                # another worker
-                try:
-                    fcntl.flock(f, fcntl.LOCK_EX)
-                    if os.path.getsize(model_path) > 0:
-                        model = joblib.load(model_path)
-                        return model
-                except IOError as e:
-                    if e.errno != errno.EAGAIN:
-                        raise
-                finally:
-                    fcntl.flock(f, fcntl.LOCK_UN)
-        # if file directory doesn't exist create it
-        try:
-            os.makedirs(os.path.dirname(model_path))
-        except FileExistsError:
-            if not os.path.isdir(os.path.dirname(model_path)):
-                raise
-        except FileNotFoundError:
-            if os.path.dirname(model_path) == '':
-                pass
-        with open(model_path, 'wb+') as f:
-            try:
-                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                if os.path.getsize(model_path) == 0:
-                    r = requests.get(model_url, stream=True)
-                    for chunk in r.iter_content(chunk_size=1024):
-                        if chunk:  # filter out keep-alive new chunks
-                            f.write(chunk)
-            except BlockingIOError as e:
-                fcntl.flock(f, fcntl.LOCK_EX)
-            finally:
-                fcntl.flock(f, fcntl.LOCK_UN)
-        model = joblib.load(model_path)
-        return model
+        if time.time() - self.checked < REFRESH_SECONDS:
+            return False
+        self.checked = time.time()
+        current = self.store.current_version(self.name)
+        if current is None or current == self.version:
+            return False
+        self.load_from_store(current)
+        return True
 
     def predict(self, text):
         """ This method should be overwritten to fit the specific case of the
@@ -128,19 +108,32 @@ class CustomSklLsiModel(SklLsiModel):
         if self.gensim_model is None:
             raise NotFittedError("This model has not been fitted yet. Call 'fit' with appropriate arguments before using this method.")
 
-        # The input as array of array
-        # import pdb; pdb.set_trace()
-        # check = lambda x: [x] if isinstance(x[0], tuple) else x
-        # docs = check(docs)
-        if sparse.issparse(docs):
-            docs = matutils.Sparse2Corpus(docs, documents_columns=False)
-        X = [[] for i in range(0, len(docs))];
-        for k,v in enumerate(docs):
-            doc_topics = self.gensim_model[v]
-            probs_docs = list(map(lambda x: x[1], doc_topics))
-            # Everything should be equal in length
-            if len(probs_docs) != self.num_topics:
-                probs_docs.extend([1e-12]*(self.num_topics - len(probs_docs)))
-            X[k] = probs_docs
-            probs_docs = []
-        return np.reshape(np.array(X), (len(docs), self.num_topics))
+        if not sparse.issparse(docs):
+            docs = matutils.corpus2csc(docs, num_terms=self.gensim_model.num_terms).T
+        X = lsi_project(self.gensim_model, docs)
+        kept = np.abs(X) > GENSIM_EPS
+        if X.shape[1] == self.num_topics and kept.all():
+            return X
+        # gensim drops topics whose weight is within GENSIM_EPS of zero, and the remaining
+        # weights were then padded out to num_topics with 1e-12; do the same for affected rows
+        padded = np.full((X.shape[0], self.num_topics), 1e-12, dtype=X.dtype)
+        complete = kept.all(axis=1)
+        padded[complete, :X.shape[1]] = X[complete]
+        for i in np.flatnonzero(~complete):
+            weights = X[i][kept[i]]
+            padded[i, :len(weights)] = weights
+        return padded
+
+
+# topic weights this close to zero are left out of gensim's sparse LSI output
+GENSIM_EPS = 1e-9
+
+
+def lsi_project(lsi_model, docs):
+    """
+    Project docs, a sparse matrix with a row for each document's term weights, onto the
+    topics of a gensim LsiModel. Gives the same weights as lsi_model[doc] for each row,
+    but with a single sparse-dense multiply, returning a dense (documents x topics) array.
+    """
+    u = lsi_model.projection.u[:, :lsi_model.num_topics]
+    return np.asarray(sparse.csr_matrix(docs, dtype=u.dtype).dot(u))
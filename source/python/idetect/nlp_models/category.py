@@ -1,19 +1,29 @@
+import os
+from functools import lru_cache
+
 import gensim
 import numpy as np
 import pandas as pd
+from gensim import matutils
 from nltk.tokenize import WordPunctTokenizer
 from nltk.stem import PorterStemmer
 from sklearn.base import TransformerMixin
 
 from idetect.model import DisplacementType
-from idetect.nlp_models.base_model import DownloadableModel
+from idetect.nlp_models.base_model import DownloadableModel, GENSIM_EPS, lsi_project
 
 
 class CategoryModel(DownloadableModel):
+    name = 'category'
+    default_version = 'category'
 
-    def __init__(self, model_path='/home/idetect/python/idetect/nlp_models/category.pkl',
-                 model_url='https://s3-us-west-2.amazonaws.com/idmc-idetect/category_models/category.pkl'):
-        self.model = self.load_model(model_path, model_url)
+    def __init__(self, version=None, model_url=None, store=None):
+        self.model_url = model_url or os.environ.get(
+            'CATEGORY_MODEL_URL', 'https://s3-us-west-2.amazonaws.com/idmc-idetect/category_models/category.pkl')
+        self.model_sha256 = os.environ.get('CATEGORY_MODEL_SHA256')
+        if store is not None:
+            self.store = store
+        self.load_from_store(version)
 
     def predict(self, text):
         try:
@@ -28,49 +38,91 @@ class CategoryModel(DownloadableModel):
             # error can occur if empty text is passed to model
             raise
 
+    def predict_batch(self, texts):
+        """Predict the categories of a list of texts with a single pass through the model"""
+        categories = self.model.predict(pd.Series(texts))
+        return [DisplacementType.DISASTER if category == 'disaster'
+                else DisplacementType.CONFLICT if category == 'conflict'
+                else DisplacementType.OTHER
+                for category in categories]
 
-class Tokenizer(TransformerMixin):
-    def __init__(self, stop_words=None):
-        self.stop_words = stop_words
-        self.tokenizer = WordPunctTokenizer()
 
-    def prepare_tokens(self, text, stop_words):
-        tokens = self.tokenizer.tokenize(text)
-        tokens = [t for t in tokens if len(t) > 2]
-        tokens = [t for t in tokens if t not in stop_words]
-        tokens = [t.lower() for t in tokens]
-        tokens = [t for t in tokens if not t.isdigit()]
-        return tokens
+# number of distinct tokens whose stems are remembered by each Stemmer
+STEM_CACHE_SIZE = 2 ** 16
+
+
+class TokenPreparer(TransformerMixin):
+    """Shared stop word handling for Tokenizer and Stemmer. The stop words are
+    looked up in a frozenset that is built on first use, so that instances
+    unpickled from older models (which skip __init__) get one too."""
+
+    def stop_word_set(self, stop_words):
+        if stop_words is None or stop_words is self.stop_words:
+            if getattr(self, '_stop_word_set', None) is None:
+                self._stop_word_set = frozenset(self.stop_words or ())
+            return self._stop_word_set
+        return frozenset(stop_words)
+
+    def __getstate__(self):
+        # the caches are rebuilt on demand, and an lru_cache can't be pickled
+        return {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
 
     def fit(self, X, *args):
         return self
 
     def transform(self, X, *args):
-        X = X.map(lambda x: self.prepare_tokens(x, self.stop_words))
-        return X
+        return self.prepare_batch(X)
+
+
+class Tokenizer(TokenPreparer):
+    def __init__(self, stop_words=None):
+        self.stop_words = stop_words
+        self.tokenizer = WordPunctTokenizer()
+
+    def prepare_tokens(self, text, stop_words=None):
+        stop_words = self.stop_word_set(stop_words)
+        tokens = []
+        for t in self.tokenizer.tokenize(text):
+            if len(t) > 2 and t not in stop_words:
+                t = t.lower()
+                if not t.isdigit():
+                    tokens.append(t)
+        return tokens
+
+    def prepare_batch(self, texts):
+        """Tokenize a pd.Series of texts, returning a pd.Series of token lists"""
+        stop_words = self.stop_word_set(None)
+        return pd.Series([self.prepare_tokens(text, stop_words) for text in texts], index=texts.index)
 
 
-class Stemmer(TransformerMixin):
+class Stemmer(TokenPreparer):
     def __init__(self, stop_words):
         self.stop_words = stop_words
         self.tokenizer = WordPunctTokenizer()
         self.stemmer = PorterStemmer()
 
-    def prepare_stems(self, text, stop_words):
-        tokens = self.tokenizer.tokenize(text)
-        tokens = [t for t in tokens if len(t) > 2]
-        tokens = [t.lower() for t in tokens]
-        tokens = [t for t in tokens if t not in stop_words]
-        stems = [self.stemmer.stem(t) for t in tokens]
-        stems = [s for s in stems if not s.isdigit()]
+    def stem(self, token):
+        """Stem token, remembering the STEM_CACHE_SIZE most recently used stems"""
+        if getattr(self, '_stem', None) is None:
+            self._stem = lru_cache(maxsize=STEM_CACHE_SIZE)(self.stemmer.stem)
+        return self._stem(token)
+
+    def prepare_stems(self, text, stop_words=None):
+        stop_words = self.stop_word_set(stop_words)
+        stems = []
+        for t in self.tokenizer.tokenize(text):
+            if len(t) > 2:
+                t = t.lower()
+                if t not in stop_words:
+                    stem = self.stem(t)
+                    if not stem.isdigit():
+                        stems.append(stem)
         return stems
 
-    def fit(self, X, *args):
-        return self
-
-    def transform(self, X, *args):
-        X = X.map(lambda x: self.prepare_stems(x, self.stop_words))
-        return X
+    def prepare_batch(self, texts):
+        """Stem a pd.Series of texts, returning a pd.Series of stem lists"""
+        stop_words = self.stop_word_set(None)
+        return pd.Series([self.prepare_stems(text, stop_words) for text in texts], index=texts.index)
 
 
 class TfidfTransformer(TransformerMixin):
@@ -108,12 +160,15 @@ class LsiTransformer(TransformerMixin):
         self.no_below = no_below
         self.no_above = no_above
 
-    def lsi_to_vecs(self, corpus_lsi):
-        lsi_vecs = []
-        for c in corpus_lsi:
-            vec = [x[1] for x in c]
-            lsi_vecs.append(vec)
-        return np.array(lsi_vecs)
+    def lsi_to_vecs(self, corpus_tfidf):
+        corpus_tfidf = list(corpus_tfidf)
+        tfidf = matutils.corpus2csc(corpus_tfidf, num_terms=self.lsi_model.num_terms).T
+        lsi_vecs = lsi_project(self.lsi_model, tfidf)
+        if (np.abs(lsi_vecs) > GENSIM_EPS).all():
+            return lsi_vecs
+        # gensim leaves out topic weights within GENSIM_EPS of zero, which shifts the remaining
+        # weights left (or makes rows ragged), so go through gensim to give the same vectors
+        return np.array([[x[1] for x in c] for c in self.lsi_model[corpus_tfidf]])
 
     def make_tfidf(self, texts):
         self.tfidf_transformer = TfidfTransformer(no_below=self.no_below,
@@ -123,10 +178,6 @@ class LsiTransformer(TransformerMixin):
         dictionary = self.tfidf_transformer.dictionary
         return corpus_tfidf, dictionary
 
-    def make_corpus(self, corpus_tfidf):
-        lsi_corpus = self.lsi_model[corpus_tfidf]
-        return lsi_corpus
-
     def set_lsi_model(self, texts):
         corpus_tfidf, dictionary = self.make_tfidf(texts)
         self.lsi_model = gensim.models.LsiModel(corpus_tfidf,
@@ -140,5 +191,4 @@ class LsiTransformer(TransformerMixin):
 
     def transform(self, texts):
         corpus_tfidf = self.tfidf_transformer.transform(texts)
-        corpus_lsi = self.make_corpus(corpus_tfidf)
-        return self.lsi_to_vecs(corpus_lsi)
+        return self.lsi_to_vecs(corpus_tfidf)
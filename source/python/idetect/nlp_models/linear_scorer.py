@@ -0,0 +1,155 @@
+'''Compile trained pipelines into a compact linear scorer.
+
+The relevance and category pipelines featurize text (spaCy, stemming, ...), then
+apply only linear steps: a TF-IDF vectorizer, LSI projections, and a linear
+classifier. Everything after the vectorizer is a product of matrices, so it can be
+folded into one weight for each vocabulary term:
+
+    decision = sum over branches of tfidf(branch text) . (U_branch . coef_branch) + intercept
+
+LinearScorer keeps the featurizing transformers and vectorizers and replaces
+the LSI models and classifier with a (terms x outputs) weight array per branch,
+so scoring a document is one sparse dot product per branch. It has the same predict
+and decision_function as the pipeline it was compiled from, and is stored in the
+ModelStore like any other model version.
+'''
+import numpy as np
+from gensim import matutils
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.pipeline import Pipeline, FeatureUnion
+
+from idetect.nlp_models.base_model import CustomSklLsiModel
+from idetect.nlp_models.category import LsiTransformer, TfidfTransformer
+
+# how far the compiled decision function may be from the original's
+TOLERANCE = 1e-6
+
+VECTORIZERS = (CountVectorizer, HashingVectorizer)  # TfidfVectorizer is a CountVectorizer
+
+
+class CompileException(Exception):
+    pass
+
+
+class ScorerBranch(object):
+    def __init__(self, prefix, vectorizer, weights):
+        """
+        prefix: the transformers that featurize text for this branch, in order
+        vectorizer: turns their output into a sparse (documents x terms) matrix
+        weights: (terms x outputs) array folding the projections and classifier weights
+        """
+        self.prefix = prefix
+        self.vectorizer = vectorizer
+        self.weights = weights
+
+    def vectorize(self, docs):
+        if isinstance(self.vectorizer, TfidfTransformer):
+            # gensim based, from category.py
+            return matutils.corpus2csc(self.vectorizer.transform(docs),
+                                       num_terms=len(self.vectorizer.dictionary)).T.tocsr()
+        return self.vectorizer.transform(docs)
+
+
+class LinearScorer(object):
+    def __init__(self, branches, intercept, classes):
+        self.branches = branches
+        self.intercept = intercept
+        self.classes = classes
+
+    def decision_function(self, texts):
+        # branches of a FeatureUnion share the transformers before it; run those once
+        featurized = {}
+        scores = np.tile(self.intercept, (len(texts), 1))
+        for branch in self.branches:
+            docs = texts
+            key = ()
+            for transformer in branch.prefix:
+                key += (id(transformer),)
+                if key not in featurized:
+                    featurized[key] = transformer.transform(docs)
+                docs = featurized[key]
+            scores += branch.vectorize(docs).dot(branch.weights)
+        if scores.shape[1] == 1:
+            return scores.ravel()
+        return scores
+
+    def predict(self, texts):
+        scores = self.decision_function(texts)
+        if scores.ndim == 1:
+            return self.classes[(scores > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+
+def projection(step):
+    '''Return the (inputs x outputs) matrix of a linear step after a vectorizer'''
+    if isinstance(step, CustomSklLsiModel):
+        u = step.gensim_model.projection.u[:, :step.gensim_model.num_topics]
+        # transform pads its output out to num_topics with a constant ~1e-12, which we ignore
+        return np.hstack([u, np.zeros((u.shape[0], step.num_topics - u.shape[1]))])
+    raise CompileException("Don't know how to compile {}".format(type(step).__name__))
+
+
+def compile_branches(steps, prefix=()):
+    '''
+    Find the (prefix, vectorizer, projection) branches of a list of pipeline steps, in the
+    order their outputs are concatenated. projection is None for an identity projection.
+    '''
+    for i, step in enumerate(steps):
+        before = prefix + tuple(steps[:i])
+        rest = steps[i + 1:]
+        if isinstance(step, VECTORIZERS):
+            matrix = None
+            for later in rest:
+                matrix = projection(later) if matrix is None else matrix.dot(projection(later))
+            return [(before, step, matrix)]
+        if isinstance(step, LsiTransformer):
+            if rest:
+                raise CompileException("Can't compile steps after an LsiTransformer")
+            lsi = step.lsi_model
+            return [(before, step.tfidf_transformer, lsi.projection.u[:, :lsi.num_topics])]
+        if isinstance(step, Pipeline):
+            return compile_branches([s for _, s in step.steps] + list(rest), before)
+        if isinstance(step, FeatureUnion):
+            if rest or step.transformer_weights:
+                raise CompileException("Can only compile a FeatureUnion at the end of the features")
+            return [branch for _, transformer in step.transformer_list
+                    for branch in compile_branches([transformer], before)]
+    raise CompileException("No vectorizer found in {}".format(steps))
+
+
+def output_width(vectorizer, matrix):
+    if matrix is not None:
+        return matrix.shape[1]
+    if isinstance(vectorizer, HashingVectorizer):
+        return vectorizer.n_features
+    return len(vectorizer.vocabulary_)
+
+
+def compile_pipeline(pipeline):
+    '''Compile a Pipeline whose last step is a linear classifier into a LinearScorer'''
+    classifier = pipeline.steps[-1][1]
+    coef = np.atleast_2d(classifier.coef_)
+    branches = []
+    offset = 0
+    for prefix, vectorizer, matrix in compile_branches([s for _, s in pipeline.steps[:-1]]):
+        width = output_width(vectorizer, matrix)
+        block = coef[:, offset:offset + width].T
+        weights = block if matrix is None else matrix.dot(block)
+        branches.append(ScorerBranch(list(prefix), vectorizer, np.ascontiguousarray(weights)))
+        offset += width
+    if offset != coef.shape[1]:
+        raise CompileException("Features add up to {} columns, but the classifier has {}".format(
+            offset, coef.shape[1]))
+    return LinearScorer(branches, np.atleast_1d(classifier.intercept_), classifier.classes_)
+
+
+def verify(pipeline, scorer, texts, tolerance=TOLERANCE):
+    '''Check that scorer gives the same predictions and decision function as pipeline on texts'''
+    expected = pipeline.decision_function(texts)
+    actual = scorer.decision_function(texts)
+    difference = np.max(np.abs(expected - actual)) if len(texts) else 0
+    if difference > tolerance:
+        raise CompileException("Compiled decision function differs by up to {}".format(difference))
+    if not np.array_equal(pipeline.predict(texts), scorer.predict(texts)):
+        raise CompileException("Compiled predictions differ")
+    return difference
@@ -0,0 +1,143 @@
+'''A versioned, checksummed local store of model artifacts.
+
+Each model version lives in its own directory:
+
+    <root>/<name>/<version>/model.pkl       joblib dump, uncompressed so numpy arrays can be mmapped
+    <root>/<name>/<version>/manifest.json   name, version, sha256, size and mtime of model.pkl and
+                                            where it came from
+    <root>/<name>/CURRENT                   the version workers should be using
+
+Versions are written to a temporary directory and renamed into place, so readers
+never see a partially written version and no file locking is needed. Models are
+loaded with mmap_mode='r', so their arrays are paged in on demand and shared
+between all the processes on a host that use the same version.
+
+The sha256 is checked when a version is installed or published. Loading only compares
+model.pkl's size and mtime with the manifest, so that starting a worker doesn't read the
+whole file; the full checksum is only recomputed if they differ, or if asked for.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import requests
+from sklearn.externals import joblib
+
+DEFAULT_ROOT = '/home/idetect/models'
+MODEL_FILE = 'model.pkl'
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+
+
+class ChecksumException(Exception):
+    pass
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(path):
+    '''The size and mtime of path, which change whenever it is rewritten'''
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def download(url, path):
+    r = requests.get(url, stream=True)
+    r.raise_for_status()
+    with open(path, 'wb') as f:
+        for chunk in r.iter_content(chunk_size=1 << 16):
+            if chunk:  # filter out keep-alive new chunks
+                f.write(chunk)
+
+
+class ModelStore(object):
+    def __init__(self, root=None):
+        self.root = root or os.environ.get('MODEL_STORE_DIR', DEFAULT_ROOT)
+
+    def version_dir(self, name, version):
+        return os.path.join(self.root, name, version)
+
+    def has(self, name, version):
+        return os.path.isfile(os.path.join(self.version_dir(name, version), MANIFEST_FILE))
+
+    def manifest(self, name, version):
+        with open(os.path.join(self.version_dir(name, version), MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def current_version(self, name):
+        '''Return the version of name that should be in use, or None if none has been set'''
+        try:
+            with open(os.path.join(self.root, name, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_current(self, name, version):
+        if not self.has(name, version):
+            raise ValueError("{} version {} is not in the store".format(name, version))
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, name))
+        with os.fdopen(fd, 'w') as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(self.root, name, CURRENT_FILE))
+
+    def publish(self, name, version, model, source=None, make_current=True):
+        '''Add a model object to the store as name/version'''
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.join(self.root, name), prefix='.' + version)
+        try:
+            model_path = os.path.join(tmp, MODEL_FILE)
+            joblib.dump(model, model_path)  # uncompressed, so that load can mmap the arrays
+            manifest = {'name': name, 'version': version, 'sha256': sha256(model_path),
+                        'source': source}
+            manifest.update(file_stamp(model_path))  # renaming tmp doesn't change the mtime
+            with open(os.path.join(tmp, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f)
+            try:
+                os.rename(tmp, self.version_dir(name, version))
+            except OSError:
+                # someone else published this version first
+                if not self.has(name, version):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        if make_current:
+            self.set_current(name, version)
+
+    def install(self, name, version, url, expected_sha256=None, make_current=True):
+        '''
+        Download a pickled model from url and add it to the store as name/version. The model
+        is re-dumped so that it can be memory mapped, whatever format it was published in.
+        '''
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        fd, download_path = tempfile.mkstemp(dir=os.path.join(self.root, name), prefix='.download')
+        os.close(fd)
+        try:
+            download(url, download_path)
+            if expected_sha256 and sha256(download_path) != expected_sha256:
+                raise ChecksumException("{} does not match the expected checksum".format(url))
+            self.publish(name, version, joblib.load(download_path), source=url, make_current=make_current)
+        finally:
+            os.unlink(download_path)
+
+    def load(self, name, version, verify=False):
+        '''
+        Load name/version with its arrays memory mapped read-only. The file is only checked
+        against the sha256 in the manifest, which costs a full read of it, if its size or mtime
+        no longer match the manifest (or the manifest predates them), or if verify is set.
+        Raises ChecksumException if it doesn't match.
+        '''
+        model_path = os.path.join(self.version_dir(name, version), MODEL_FILE)
+        manifest = self.manifest(name, version)
+        stamp = file_stamp(model_path)
+        changed = any(manifest.get(k) != v for k, v in stamp.items())
+        if (verify or changed) and sha256(model_path) != manifest['sha256']:
+            raise ChecksumException("{} version {} is corrupt".format(name, version))
+        return joblib.load(model_path, mmap_mode='r')
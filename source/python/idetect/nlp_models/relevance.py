@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 import pandas as pd
 import re
@@ -5,18 +7,25 @@ import string
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FeatureUnion
 from sklearn.svm import LinearSVC
-from spacy.tokens.token import Token
 
 from idetect.model import Relevance
 from idetect.nlp_models.base_model import DownloadableModel, CustomSklLsiModel
-from idetect.fact_extractor import nlp
+from idetect.fact_extractor import get_nlp
 from idetect.geotagger import strip_accents, compare_strings, strip_words, LocationType, subdivision_country_code, match_country_name, city_subdivision_country
 
 
 class RelevanceModel(DownloadableModel):
-    def __init__(self, model_path='/home/idetect/python/idetect/nlp_models/relevance_classifier_svm_10132017.pkl',
-            model_url='https://s3-us-west-2.amazonaws.com/idmc-idetect/relevance_models/relevance_classifier_svm_10132017.pkl'):
-        self.model = self.load_model(model_path, model_url)
+    name = 'relevance'
+    default_version = 'relevance_classifier_svm_10132017'
+
+    def __init__(self, version=None, model_url=None, store=None):
+        self.model_url = model_url or os.environ.get(
+            'RELEVANCE_MODEL_URL',
+            'https://s3-us-west-2.amazonaws.com/idmc-idetect/relevance_models/relevance_classifier_svm_10132017.pkl')
+        self.model_sha256 = os.environ.get('RELEVANCE_MODEL_SHA256')
+        if store is not None:
+            self.store = store
+        self.load_from_store(version)
 
     def predict(self, text):
         try:
@@ -29,6 +38,14 @@ class RelevanceModel(DownloadableModel):
             # error can occur if empty text is passed to model
             raise
 
+    def predict_batch(self, texts):
+        """Predict the relevance of a list of texts with a single pass through the model"""
+        relevances = self.model.predict(pd.Series(texts))
+        return [Relevance.DISPLACEMENT if relevance == 1
+                else Relevance.NOT_DISPLACEMENT if relevance == 0
+                else None
+                for relevance in relevances]
+
 
 class LocationProcessor(BaseEstimator, TransformerMixin):
     """Transformer that replaces all country and subdivisions
@@ -56,6 +73,7 @@ class LocationProcessor(BaseEstimator, TransformerMixin):
         return tokens
 
     def join_phrases(self, phrases):
+        from spacy.tokens.token import Token
         joined = []
         for phrase in phrases:
             tokens = []
@@ -77,7 +95,7 @@ class LocationProcessor(BaseEstimator, TransformerMixin):
         return self
 
     def transform(self, texts, *args):
-        texts = [nlp(t) for t in texts]
+        texts = [get_nlp()(t) for t in texts]
         texts = [self.tag_entities(t) for t in texts]
         texts = self.single_string(texts)
         return texts
@@ -114,6 +132,7 @@ class PhraseProcessor(BaseEstimator, TransformerMixin):
         return phrases
 
     def join_phrases(self, phrases):
+        from spacy.tokens.token import Token
         joined = []
         for phrase in phrases:
             tokens = []
@@ -136,7 +155,7 @@ class PhraseProcessor(BaseEstimator, TransformerMixin):
 
     def transform(self, texts, *args):
 #         import pdb; pdb.set_trace()
-        docs = [nlp(t) for t in texts]
+        docs = [get_nlp()(t) for t in texts]
         phrases = [self.parse_phrases(d) for d in docs]
         joined = [self.join_phrases(p) for p in phrases]
         text = self.single_string(joined)
@@ -189,7 +208,7 @@ class POSProcessor(BaseEstimator, TransformerMixin):
         return strings
 
     def transform(self, texts, *args):
-        docs = [nlp(sent) for sent in texts]
+        docs = [get_nlp()(sent) for sent in texts]
         docs = [self.tag_pos(d) for d in docs]
         docs = [self.remove_noise(d) for d in docs]
         lemmas = [self.get_lemmas(d) for d in docs]
@@ -0,0 +1,100 @@
+'''Out-of-core retraining of the category and relevance models.
+
+Training documents are streamed from the database through a server-side cursor
+in chunks of CHUNK_SIZE. Each chunk is stemmed, hashed into a fixed number of
+features (so there is no vocabulary to hold in memory), and used to update an
+SGDClassifier with partial_fit. Memory use therefore depends on CHUNK_SIZE and
+N_FEATURES, not on the size of the corpus. The resulting Pipeline predicts the
+same labels as the models it replaces, so CategoryModel and RelevanceModel can
+load it from the ModelStore unchanged.
+
+Nothing in the pipeline records that a person has checked an Analysis' category or
+relevance: the labels of every Analysis it processes come from the models being
+replaced, and training on those would just teach the new model to copy the old one,
+mistakes included. So there is no default training set; callers have to say which
+Analysis statuses hold labels they trust (e.g. ones loaded or corrected by hand), or
+pass statuses=None to knowingly train on every labelled Analysis.
+'''
+import logging
+import time
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+from idetect.model import Analysis, DocumentContent
+from idetect.nlp_models.category import Stemmer
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CHUNK_SIZE = 1000
+N_FEATURES = 2 ** 20
+
+
+def category_label(category):
+    return category.lower()
+
+
+def relevance_label(relevance):
+    return int(relevance)
+
+
+# for each model: the text it is given, the Analysis column holding its labels, the
+# label the model should predict for a column value, and every label it can predict
+TARGETS = {
+    'category': (DocumentContent.content, Analysis.category, category_label, ['conflict', 'disaster', 'other']),
+    'relevance': (DocumentContent.content_clean, Analysis.relevance, relevance_label, [0, 1]),
+}
+
+
+def stream_training_data(session, name, statuses, chunk_size=CHUNK_SIZE):
+    '''
+    Yield lists of (text, label) for training the named model, chunk_size at a time,
+    without loading the whole result set into memory. Only Analyses in statuses are
+    used, or every labelled Analysis if statuses is None.
+    '''
+    if statuses is not None and not statuses:
+        raise ValueError("No statuses to train {} on".format(name))
+    text, column, label, classes = TARGETS[name]
+    query = session.query(text, column) \
+        .join(Analysis, Analysis.content_id == DocumentContent.id) \
+        .filter(column.isnot(None)) \
+        .filter(text.isnot(None))
+    if statuses is not None:
+        query = query.filter(Analysis.status.in_(statuses))
+    chunk = []
+    for row_text, row_label in query.execution_options(stream_results=True).yield_per(chunk_size):
+        chunk.append((row_text, label(row_label)))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def make_vectorizer(stop_words, n_features=N_FEATURES):
+    return HashingVectorizer(analyzer=Stemmer(stop_words).prepare_stems, n_features=n_features,
+                             alternate_sign=False, norm='l2')
+
+
+def train(session, name, stop_words, statuses, chunk_size=CHUNK_SIZE, n_features=N_FEATURES, passes=1):
+    '''
+    Train a new Pipeline for the named model by streaming over the Analyses in statuses
+    (every labelled Analysis if None) passes times
+    '''
+    classes = np.array(TARGETS[name][3])
+    vectorizer = make_vectorizer(stop_words, n_features)
+    classifier = SGDClassifier(loss='hinge', alpha=1e-6)
+    start = time.time()
+    for n in range(passes):
+        count = 0
+        for chunk in stream_training_data(session, name, statuses, chunk_size):
+            texts, labels = zip(*chunk)
+            classifier.partial_fit(vectorizer.transform(texts), np.array(labels), classes=classes)
+            count += len(chunk)
+            logger.info("Retraining {} pass {}: {} documents, {:.0f}s".format(name, n + 1, count, time.time() - start))
+        if count == 0:
+            raise ValueError("No training data for {} in statuses {}".format(name, statuses))
+    return Pipeline([('vectorizer', vectorizer), ('classifier', classifier)])
@@ -0,0 +1,115 @@
+'''Per-domain politeness for scraping.
+
+Scrapers share a row per domain in idetect_domains that rate limits requests to
+that domain and acts as a circuit breaker when the domain keeps failing. Each
+Analysis records its domain when it is created (see model.gkg_domain), so the
+claim query can check the domain's row and count the analyses of that domain
+being scraped through indexes. A domain's row can override the default rate and
+concurrency limits below.
+'''
+import logging
+import os
+import time
+from datetime import timedelta
+
+import requests
+from sqlalchemy import and_, exists, func, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import object_session
+
+from idetect.model import Analysis, Domain, Status, gkg_domain
+from idetect.scraper import RetrievalException
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SECONDS_BETWEEN_REQUESTS = 5
+MAX_CONCURRENT_REQUESTS = 2
+CIRCUIT_BREAKER_FAILURES = 5
+CIRCUIT_BREAKER_MINUTES = 60
+
+# failures that say something about the domain rather than about the document
+DOMAIN_FAILURES = (RetrievalException, requests.RequestException, TimeoutError)
+
+domain_name = gkg_domain
+
+
+def polite_filter(query):
+    '''
+    Exclude analyses whose domain is currently rate limited, has its circuit
+    breaker open, or already has its maximum number of requests being scraped.
+    '''
+    now = func.now()
+    domain_blocked = exists().where(and_(Domain.name == Analysis.domain,
+                                         or_(Domain.next_request > now, Domain.open_until > now)))
+    max_concurrent = func.coalesce(
+        select([Domain.max_concurrent_requests]).where(Domain.name == Analysis.domain).as_scalar(),
+        MAX_CONCURRENT_REQUESTS)
+    scraping = Analysis.__table__.alias('scraping')
+    # served by the partial document_analyses_scraping_domain index
+    in_flight = (
+        select([func.count()])
+            .where(scraping.c.status == Status.SCRAPING)
+            .where(scraping.c.domain == Analysis.domain)
+            .as_scalar()
+    )
+    return query.filter(~domain_blocked).filter(in_flight < max_concurrent)
+
+
+def reserve(session, name):
+    '''
+    Reserve the next request slot for a domain, returning the number of seconds to
+    wait before sending it. Two scrapers that claim the same domain at once are
+    spaced SECONDS_BETWEEN_REQUESTS apart.
+    '''
+    session.execute(insert(Domain.__table__).values(name=name, consecutive_failures=0)
+                    .on_conflict_do_nothing(index_elements=['name']))
+    domain = session.query(Domain).filter(Domain.name == name).with_for_update().one()
+    now = session.query(func.now()).scalar()
+    start = max(now, domain.next_request or now)
+    interval = domain.seconds_between_requests
+    domain.next_request = start + timedelta(
+        seconds=float(interval) if interval is not None else SECONDS_BETWEEN_REQUESTS)
+    session.commit()
+    return (start - now).total_seconds()
+
+
+def record_success(session, name):
+    domain = session.query(Domain).filter(Domain.name == name).with_for_update().one()
+    domain.consecutive_failures = 0
+    domain.open_until = None
+    session.commit()
+
+
+def record_failure(session, name):
+    '''Count a failure against the domain, opening its circuit breaker after too many in a row'''
+    domain = session.query(Domain).filter(Domain.name == name).with_for_update().one()
+    domain.consecutive_failures += 1
+    if domain.consecutive_failures >= CIRCUIT_BREAKER_FAILURES:
+        domain.open_until = func.now() + timedelta(minutes=CIRCUIT_BREAKER_MINUTES)
+        logger.warning("Worker {} opened circuit breaker for {} after {} failures".format(
+            os.getpid(), name, domain.consecutive_failures))
+    session.commit()
+
+
+def polite(function):
+    '''Wrap a scraping function so that it respects the per-domain rate limit and circuit breaker'''
+
+    def polite_function(analysis):
+        session = object_session(analysis)
+        name = analysis.domain or domain_name(analysis.gkg)
+        if name is None:
+            return function(analysis)
+        wait = reserve(session, name)
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            result = function(analysis)
+        except DOMAIN_FAILURES:
+            session.rollback()
+            record_failure(session, name)
+            raise
+        record_success(session, name)
+        return result
+
+    return polite_function
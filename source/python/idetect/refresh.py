@@ -0,0 +1,101 @@
+'''Refreshing the materialized views behind the fact API without blocking readers.
+
+Views are refreshed with REFRESH MATERIALIZED VIEW CONCURRENTLY, which builds the
+new contents alongside the old and applies the difference, so API queries keep
+reading the old contents instead of waiting on an exclusive lock. CONCURRENTLY
+needs a unique index on each view and a view that has been populated before, so
+a view that has never been populated gets a plain REFRESH first.
+
+Each refresh is recorded in idetect_refresh_log with its duration and row count,
+which for a view holding a single jsonb array (ROW_COUNTS) is the length of the array.
+Afterwards the MAP_WEEK cache generation is bumped, which only invalidates
+/map_week, and /map_week is computed into the API cache again.
+
+Warming only helps when the API processes share an API_CACHE_DIR: the refresh (and
+run_fact_api_sync.py, which warms the FACT_API requests after changing the fact API
+tables) runs in a process of its own, whose in-memory cache no API process can see.
+Without API_CACHE_DIR nothing is warmed, and each API process computes the first
+request after a change itself.
+'''
+import logging
+import time
+
+from sqlalchemy import text
+
+from idetect import api_cache
+from idetect.fact_api import RefreshLog, filter_params, get_filter_counts, get_timeline_counts, \
+    get_histogram_counts, get_wordcloud, get_map_week
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# refreshed in this order, so a view must come after any view it selects from
+VIEWS = [
+    'idetect_map_week_mview',
+]
+
+# how to count the rows of views that aren't one row per entry, by default count(*)
+ROW_COUNTS = {
+    # a single row with a jsonb array of entries, or NULL when there are none
+    'idetect_map_week_mview': "SELECT coalesce(jsonb_array_length(entries), 0) FROM idetect_map_week_mview",
+}
+
+
+def is_populated(session, name):
+    return session.execute(text("SELECT ispopulated FROM pg_matviews WHERE matviewname = :name"),
+                           {'name': name}).scalar()
+
+
+def refresh_view(session, name):
+    '''Refresh one view, concurrently if possible, and record it in idetect_refresh_log'''
+    method = 'concurrently' if is_populated(session, name) else 'blocking'
+    started = session.execute(text("SELECT now()")).scalar()
+    start = time.time()
+    if method == 'concurrently':
+        session.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY {}".format(name)))
+    else:
+        session.execute(text("REFRESH MATERIALIZED VIEW {}".format(name)))
+    session.commit()
+    duration = time.time() - start
+    count_rows = ROW_COUNTS.get(name, "SELECT count(*) FROM {}".format(name))
+    row_count = session.execute(text(count_rows)).scalar()
+    session.add(RefreshLog(name=name, method=method, started=started, duration_seconds=duration,
+                           row_count=row_count))
+    session.commit()
+    logger.info("Refreshed {} {} in {:.1f}s, {} rows".format(name, method, duration, row_count))
+    return duration
+
+
+def warm_fact_api(session):
+    '''Compute the unfiltered dashboard requests into the shared API cache, if there is one'''
+    if not api_cache.CACHE_DIR:
+        return
+    start = time.time()
+    filters = filter_params({})
+    requests = [
+        ('filters', lambda: get_filter_counts(session, **filters)),
+        ('timeline', lambda: get_timeline_counts(session, **filters)),
+        ('histogram', lambda: get_histogram_counts(session, **filters)),
+        ('wordcloud', lambda: get_wordcloud(session, **filters)),
+    ]
+    api_cache.current_generation(session, api_cache.FACT_API, force=True)
+    for endpoint, compute in requests:
+        api_cache.cached(session, endpoint, filters, compute)
+    logger.info("Warmed the fact API cache in {:.1f}s".format(time.time() - start))
+
+
+def warm_map_week(session):
+    '''Compute /map_week into the shared API cache, if there is one'''
+    if not api_cache.CACHE_DIR:
+        return
+    api_cache.current_generation(session, api_cache.MAP_WEEK, force=True)
+    api_cache.cached(session, 'map_week', {}, lambda: get_map_week(session))
+
+
+def refresh_all(session, views=VIEWS, warm=True):
+    '''Refresh every view in order, then invalidate and warm the cached /map_week'''
+    for name in views:
+        refresh_view(session, name)
+    api_cache.bump_generation(session, api_cache.MAP_WEEK)
+    if warm:
+        warm_map_week(session)
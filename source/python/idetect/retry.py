@@ -0,0 +1,76 @@
+'''Retry scheduling for Analyses that failed a stage.
+
+When a Worker with retry policies fails to process an Analysis, the policy for
+the exception's failure class decides when it may be retried. That time is stored
+in Analysis.next_attempt_at, which the claim queries read through the partial
+document_analyses_status_next_attempt index. Once a policy's attempts run out
+the Analysis is moved to Status.DEAD_LETTER and is no longer considered; its
+error_msg says which stage it failed. Exceptions that no policy covers leave the
+Analysis in the stage's failure status without a next attempt, as Workers without
+retry policies do.
+'''
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+
+from idetect.model import Analysis, Status
+
+
+class RetryPolicy:
+    def __init__(self, base_seconds, max_seconds, max_attempts):
+        """
+        Allow max_attempts attempts in total, waiting base_seconds * 2^(n-1) (capped at
+        max_seconds, with jitter) after the nth consecutive failure.
+        """
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.max_attempts = max_attempts
+
+    def delay(self, attempts):
+        """Seconds to wait after the given number of consecutive failures"""
+        delay = min(self.max_seconds, self.base_seconds * 2 ** (attempts - 1))
+        # "equal jitter": keep at least half the backoff, randomize the rest
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_policy(exception, policies):
+    '''
+    Find the policy for an exception. policies is a list of (exception class, RetryPolicy)
+    pairs checked in order; the first matching class wins. Returns None if none match.
+    '''
+    for exception_class, policy in policies:
+        if isinstance(exception, exception_class):
+            return policy
+    return None
+
+
+def schedule_retry(analysis, exception, policies, failure_status):
+    '''
+    Record a failed attempt on analysis and return the status it should move to:
+    failure_status with next_attempt_at set if it should be retried, Status.DEAD_LETTER
+    if it has failed too many times, or failure_status with no next attempt if no policy
+    covers the exception.
+    '''
+    policy = retry_policy(exception, policies)
+    analysis.retry_attempts = (analysis.retry_attempts or 0) + 1
+    if policy is None:
+        analysis.next_attempt_at = None
+        return failure_status
+    if analysis.retry_attempts >= policy.max_attempts:
+        analysis.next_attempt_at = None
+        return Status.DEAD_LETTER
+    delay = policy.delay(analysis.retry_attempts)
+    analysis.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+    return failure_status
+
+
+def clear_retry(analysis):
+    '''Reset the retry state of an analysis that was processed successfully'''
+    analysis.retry_attempts = 0
+    analysis.next_attempt_at = None
+
+
+def retry_due(failure_status):
+    '''Filter expression for analyses in failure_status whose next attempt is due'''
+    return (Analysis.status == failure_status) & (Analysis.next_attempt_at <= func.now())
@@ -3,7 +3,6 @@ import os
 import re
 from io import StringIO
 from tempfile import NamedTemporaryFile
-from urllib.parse import urlparse
 
 import newspaper
 import requests
@@ -17,9 +16,15 @@ from sqlalchemy.orm import object_session
 from langdetect import detect
 from langdetect.lang_detect_exception import LangDetectException
 
+from idetect.document_terms import add_terms
 from idetect.model import DocumentContent, cleanup, remove_wordcloud_stopwords
 
 
+class RetrievalException(Exception):
+    """Raised when a document couldn't be downloaded from its host"""
+    pass
+
+
 def scrape(analysis, scrape_pdfs=True):
     """
     Scrapes content and metadata from an url
@@ -120,10 +125,12 @@ def scrape_html(analysis):
                                   )
         session = object_session(analysis)
         session.add(content)
+        session.flush()
+        add_terms(session, content.id)
         session.commit()
         return analysis
     else:  # Temporary fix to deal with https://github.com/codelucas/newspaper/issues/280
-        raise Exception("Retrieval Failed")
+        raise RetrievalException("Retrieval Failed")
 
 
 def download_pdf(url):
@@ -155,7 +162,6 @@ def scrape_pdf(url, analysis):
             raise Exception("No text extracted from PDF at {}".format(url))
         text = re.sub('\s+', ' ', text)  # collapse all whitespace
         text_clean = cleanup(text) # Clean text for analysis steps
-        analysis.domain = urlparse(url).hostname
         analysis.publication_date = last_modified or None
         try:
             analysis.language = detect(text)
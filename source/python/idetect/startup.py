@@ -0,0 +1,39 @@
+'''Startup time and memory reporting for the API and worker entry points.
+
+For a full import profile, run an entry point with PYTHONPROFILEIMPORTTIME=1
+(or python3 -X importtime), which prints the time spent importing every module.
+'''
+import logging
+import os
+import resource
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# modules that are expensive to import or load models when they are used
+HEAVY_MODULES = ('spacy', 'textacy', 'gensim', 'sklearn', 'nltk', 'newspaper', 'pdfminer', 'pandas')
+
+
+def process_age():
+    '''Seconds since this process started, or None if that can't be determined'''
+    try:
+        with open('/proc/self/stat') as f:
+            # the command name may contain spaces, so count fields from the closing paren
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def report_startup(name):
+    '''Log how long this process took to start, its peak memory, and which heavy modules it loaded'''
+    age = process_age()
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+    logger.info("{} {} started in {} max RSS {:.0f}MB heavy modules loaded: {}".format(
+        name, os.getpid(), "{:.2f}s".format(age) if age is not None else "unknown time",
+        max_rss_mb, ", ".join(heavy) or "none"))
@@ -0,0 +1,77 @@
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from idetect import api_cache
+from idetect.model import Base, Session, CacheGeneration
+
+
+class TestApiCache(TestCase):
+    def setUp(self):
+        db_host = os.environ.get('DB_HOST')
+        db_url = 'postgresql://{user}:{passwd}@{db_host}/{db}'.format(
+            user='tester', passwd='tester', db_host=db_host, db='idetect_test')
+        engine = create_engine(db_url)
+        Session.configure(bind=engine)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        self.session = Session()
+        self.calls = 0
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.query(CacheGeneration).delete()
+        self.session.commit()
+
+    def compute(self):
+        self.calls += 1
+        return [{'count': self.calls}]
+
+    def test_cache_key(self):
+        self.assertEqual(api_cache.cache_key('filters', 1, {'iso3s': ['SYR', 'IRQ'], 'ts': None}),
+                         api_cache.cache_key('filters', 1, {'iso3s': ['IRQ', 'SYR']}))
+        self.assertNotEqual(api_cache.cache_key('filters', 1, {'iso3s': ['SYR']}),
+                            api_cache.cache_key('filters', 2, {'iso3s': ['SYR']}))
+        self.assertNotEqual(api_cache.cache_key('urllist', 1, {}, offset=0),
+                            api_cache.cache_key('urllist', 1, {}, offset=32))
+
+    def test_cached(self):
+        filters = {'iso3s': ['SYR']}
+        first = api_cache.cached(self.session, 'filters', filters, self.compute)
+        self.assertEqual(api_cache.cached(self.session, 'filters', filters, self.compute), first)
+        self.assertEqual(self.calls, 1)
+
+        api_cache.bump_generation(self.session)
+        api_cache._generations[api_cache.FACT_API]['checked'] = 0  # don't wait for GENERATION_CHECK_SECONDS
+        self.assertNotEqual(api_cache.cached(self.session, 'filters', filters, self.compute), first)
+        self.assertEqual(self.calls, 2)
+
+    def test_cached_map_week(self):
+        week = api_cache.cached(self.session, 'map_week', {}, self.compute)
+        # syncing the fact API tables doesn't change the map_week view
+        api_cache.bump_generation(self.session)
+        api_cache._generations[api_cache.MAP_WEEK]['checked'] = 0
+        self.assertEqual(api_cache.cached(self.session, 'map_week', {}, self.compute), week)
+        self.assertEqual(self.calls, 1)
+
+        api_cache.bump_generation(self.session, api_cache.MAP_WEEK)
+        api_cache._generations[api_cache.MAP_WEEK]['checked'] = 0
+        self.assertNotEqual(api_cache.cached(self.session, 'map_week', {}, self.compute), week)
+        self.assertEqual(self.calls, 2)
+
+    def test_cache_bytes(self):
+        cache_bytes = api_cache.CACHE_BYTES
+        api_cache.CACHE_BYTES = 100
+        try:
+            api_cache.remember('small1', 'a', 40)
+            api_cache.remember('small2', 'b', 40)
+            api_cache.remember('large', 'c', 200)  # too big to keep at all
+            self.assertEqual(set(api_cache._memory), {'small1', 'small2'})
+            api_cache.remember('small3', 'd', 40)  # evicts the least recently used
+            self.assertEqual(set(api_cache._memory), {'small2', 'small3'})
+            self.assertEqual(api_cache._memory_bytes['value'], 80)
+        finally:
+            api_cache.CACHE_BYTES = cache_bytes
+            api_cache._memory.clear()
+            api_cache._memory_bytes['value'] = 0
@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+from idetect.autoscaler import plan, Stage
+from idetect.model import Status
+
+STAGES = {
+    'scraper': Stage('run_scraper.py', Status.NEW, Status.SCRAPED, 0.5, 100),
+    'extractor': Stage('run_extractor.py', Status.CLASSIFIED, Status.EXTRACTED, 1.0, 1000),
+}
+
+
+class TestAutoscaler(TestCase):
+    def test_plan_bottleneck(self):
+        # lots of slow extraction waiting, scrapers are keeping up
+        samples = {'scraper': (2, 1.0), 'extractor': (1000, 10.0)}
+        allocation = plan(samples, STAGES, cpu_budget=4, memory_budget_mb=100000)
+        self.assertEqual(allocation, {'scraper': 2, 'extractor': 3})
+
+    def test_plan_memory_budget(self):
+        samples = {'scraper': (1000, 1.0), 'extractor': (1000, 10.0)}
+        allocation = plan(samples, STAGES, cpu_budget=100, memory_budget_mb=2500)
+        self.assertEqual(allocation['extractor'], 2)
+        self.assertLessEqual(sum(STAGES[name].memory_mb * n for name, n in allocation.items()), 2500)
+
+    def test_plan_idle(self):
+        samples = {'scraper': (0, 1.0), 'extractor': (0, 10.0)}
+        allocation = plan(samples, STAGES, cpu_budget=4, memory_budget_mb=100000)
+        self.assertEqual(allocation, {'scraper': 1, 'extractor': 1})
+
+    def test_plan_floors(self):
+        # a stage that may not shrink yet keeps its processes, and they count against the budget
+        samples = {'scraper': (0, 1.0), 'extractor': (1000, 10.0)}
+        allocation = plan(samples, STAGES, cpu_budget=4, memory_budget_mb=100000, floors={'scraper': 4})
+        self.assertEqual(allocation, {'scraper': 4, 'extractor': 2})
@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from idetect.nlp_models.category import LsiTransformer, Tokenizer
+
+TEXTS = [
+    "Thousands of people were evacuated from their homes after the flood",
+    "The earthquake destroyed houses and left families homeless after the flood",
+    "Refugees fled across the border to escape the fighting",
+    "Villagers were displaced by the fighting in the region",
+    "The football team won the championship on Sunday",
+    "Shares rose sharply after the company reported strong earnings",
+]
+
+
+class TestLsiTransformer(TestCase):
+    def setUp(self):
+        self.tokens = Tokenizer().transform(pd.Series(TEXTS))
+        self.transformer = LsiTransformer(n_dimensions=3, no_below=1, no_above=1.0)
+        self.transformer.set_lsi_model(self.tokens)
+
+    def gensim_vecs(self, tokens):
+        corpus_tfidf = self.transformer.tfidf_transformer.transform(tokens)
+        return np.array([[x[1] for x in c] for c in self.transformer.lsi_model[corpus_tfidf]])
+
+    def test_transform(self):
+        vecs = self.transformer.transform(self.tokens)
+        self.assertEqual(vecs.shape, (len(TEXTS), 3))
+        np.testing.assert_allclose(vecs, self.gensim_vecs(self.tokens))
+
+    def test_transform_dropped_weights(self):
+        # a document with no known terms gets no topic weights at all from gensim
+        tokens = pd.Series(list(self.tokens) + [["unknown", "words"]])
+        vecs = self.transformer.transform(tokens)
+        expected = self.gensim_vecs(tokens)
+        self.assertEqual(len(vecs), len(expected))
+        for vec, expected_vec in zip(vecs, expected):
+            np.testing.assert_allclose(vec, expected_vec)
+        self.assertEqual(len(vecs[-1]), 0)
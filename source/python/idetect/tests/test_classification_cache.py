@@ -0,0 +1,57 @@
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from idetect.classification_cache import cached_predict_batch, prune
+from idetect.model import Base, Session, ClassificationResult, DisplacementType
+
+
+class CountingModel:
+    """Stands in for a classifier model, counting the texts it is asked to predict"""
+    name = 'category'
+
+    def __init__(self, sha256):
+        self.sha256 = sha256
+        self.predicted = []
+
+    def predict_batch(self, texts):
+        self.predicted.extend(texts)
+        return [DisplacementType.DISASTER if 'flood' in text else DisplacementType.OTHER for text in texts]
+
+
+class TestClassificationCache(TestCase):
+    def setUp(self):
+        db_host = os.environ.get('DB_HOST')
+        db_url = 'postgresql://{user}:{passwd}@{db_host}/{db}'.format(
+            user='tester', passwd='tester', db_host=db_host, db='idetect_test')
+        engine = create_engine(db_url)
+        Session.configure(bind=engine)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.query(ClassificationResult).delete()
+        self.session.commit()
+
+    def test_cached_predict_batch(self):
+        model = CountingModel('v1')
+        texts = ["a flood", "a meeting", "a flood"]
+        expected = [DisplacementType.DISASTER, DisplacementType.OTHER, DisplacementType.DISASTER]
+        self.assertEqual(cached_predict_batch(self.session, model, texts), expected)
+        self.assertEqual(model.predicted, ["a flood", "a meeting"])
+        self.session.commit()
+
+        self.assertEqual(cached_predict_batch(self.session, model, texts), expected)
+        self.assertEqual(model.predicted, ["a flood", "a meeting"])
+
+        # a different model file doesn't use the old predictions
+        model2 = CountingModel('v2')
+        self.assertEqual(cached_predict_batch(self.session, model2, texts), expected)
+        self.assertEqual(model2.predicted, ["a flood", "a meeting"])
+        self.session.commit()
+
+        prune(self.session, model2)
+        self.assertEqual({r.model_sha256 for r in self.session.query(ClassificationResult)}, {'v2'})
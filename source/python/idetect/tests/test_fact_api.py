@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from idetect.fact_api import FactApi, FactApiRollup, FilterException, aggregate_source, can_use_rollup, \
+    filter_by_locations, filter_params, page_params
+
+
+def compile_sql(query):
+    return str(query.statement.compile(dialect=postgresql.dialect()))
+
+
+class TestFactApi(TestCase):
+    def test_can_use_rollup(self):
+        filters = filter_params({'fromdate': '2017-01-01', 'categories': '{disaster}'})
+        self.assertTrue(can_use_rollup(filters))
+        self.assertEqual(aggregate_source(filters)[0], FactApiRollup)
+
+    def test_cannot_use_rollup(self):
+        for data in ({'text_in_content': 'flood'}, {'location_ids': '{1,2}'}, {'location_ids_num': '3'}):
+            filters = filter_params(data)
+            self.assertFalse(can_use_rollup(filters))
+            self.assertEqual(aggregate_source(filters)[0], FactApi)
+
+    def test_filter_by_locations(self):
+        few = compile_sql(filter_by_locations(Query(FactApi.fact), ['1', 2]))
+        many = compile_sql(filter_by_locations(Query(FactApi.fact), list(range(10000))))
+        self.assertEqual(few, many)
+        self.assertIn('ANY', few)
+        self.assertNotIn('IS NULL', few)
+        self.assertIn('IS NULL', compile_sql(filter_by_locations(Query(FactApi.fact), ['NULL', 2])))
+        self.assertNotIn('ANY', compile_sql(filter_by_locations(Query(FactApi.fact), ['null'])))
+
+    def test_filter_params_location_ids(self):
+        self.assertEqual(filter_params({'location_ids': '{1, 2,NULL}'})['location_ids'], ['1', ' 2', 'NULL'])
+        for data in ({'location_ids': '{1,Syria}'}, {'location_ids': '{1.5}'}, {'location_ids_num': 'x'}):
+            with self.assertRaises(FilterException):
+                filter_params(data)
+
+    def test_page_params(self):
+        self.assertEqual(page_params({}), (32, 0))
+        self.assertEqual(page_params({'limit': '10', 'offset': '20'}), (10, 20))
+        for data in ({'limit': '0'}, {'limit': '-1'}, {'offset': '-32'}, {'limit': 'ten'}, {'offset': None}):
+            with self.assertRaises(FilterException):
+                page_params(data)
@@ -0,0 +1,120 @@
+import os
+from datetime import date
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from idetect import api_cache
+from idetect.fact_api import FactApi, FactApiLocations, FactApiRollup
+from idetect.fact_api_sync import sync_analysis, sync_rollup, sync_once
+from idetect.model import Base, Session, Status, Gkg, Analysis, Fact, Location
+
+DAY = date(2017, 2, 15)
+
+
+class TestFactApiSync(TestCase):
+    def setUp(self):
+        db_host = os.environ.get('DB_HOST')
+        db_url = 'postgresql://{user}:{passwd}@{db_host}/{db}'.format(
+            user='tester', passwd='tester', db_host=db_host, db='idetect_test')
+        engine = create_engine(db_url)
+        Session.configure(bind=engine)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        self.session = Session()
+        # for sort(int[])
+        self.session.execute("CREATE EXTENSION IF NOT EXISTS intarray")
+        self.sample_data()
+
+    def sample_data(self):
+        gkg = Gkg(
+            id=3771256,
+            gkgrecordid="20170215174500-2503",
+            date=20170215174500,
+            document_identifier="http://www.philstar.com/headlines/2017/02/16/1672746/yasay-harris-affirm-stronger-phl-us-ties"
+        )
+        self.analysis = Analysis(gkg=gkg, status=Status.EXTRACTED, category='disaster')
+        india = Location(location_name='India')
+        pakistan = Location(location_name='Pakistan')
+        self.fact1 = Fact(unit='person', term='displaced', specific_reported_figure=500, iso3='IND')
+        self.fact1.locations.append(india)
+        self.fact2 = Fact(unit='house', term='destroyed', specific_reported_figure=100, iso3='PAK')
+        self.fact2.locations.append(pakistan)
+        self.analysis.facts.append(self.fact1)
+        self.analysis.facts.append(self.fact2)
+        self.session.add(self.analysis)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def sync(self):
+        changed, days = sync_analysis(self.session, self.analysis.gkg_id)
+        self.session.commit()
+        return changed, days
+
+    def test_sync_new_analysis(self):
+        self.assertEqual(self.sync(), (True, {DAY}))
+        facts = self.session.query(FactApi).order_by(FactApi.fact).all()
+        self.assertEqual([f.fact for f in facts], [self.fact1.id, self.fact2.id])
+        self.assertEqual({f.gdelt_day for f in facts}, {DAY})
+        self.assertEqual({f.category for f in facts}, {'disaster'})
+        self.assertEqual(self.session.query(FactApiLocations).count(), 2)
+        # syncing again without changing anything changes nothing
+        self.assertEqual(self.sync(), (False, set()))
+        self.assertEqual(self.session.query(FactApi).count(), 2)
+
+    def test_sync_removed_fact(self):
+        self.sync()
+        self.analysis.facts.remove(self.fact2)
+        self.session.commit()
+        self.assertEqual(self.sync(), (True, {DAY}))
+        self.assertEqual([f.fact for f in self.session.query(FactApi)], [self.fact1.id])
+        self.assertEqual([f.fact for f in self.session.query(FactApiLocations)], [self.fact1.id])
+
+    def test_sync_recategorised(self):
+        self.sync()
+        self.analysis.category = 'conflict'
+        self.session.commit()
+        self.assertEqual(self.sync(), (True, {DAY}))
+        self.assertEqual({f.category for f in self.session.query(FactApi)}, {'conflict'})
+
+        # only Analyses with a category are in idetect_fact_api
+        self.analysis.category = None
+        self.session.commit()
+        self.assertEqual(self.sync(), (True, {DAY}))
+        self.assertEqual(self.session.query(FactApi).count(), 0)
+        self.assertEqual(self.session.query(FactApiLocations).count(), 2)
+
+    def test_sync_rollup(self):
+        changed, days = self.sync()
+        sync_rollup(self.session, days)
+        self.session.commit()
+        rollup = self.session.query(FactApiRollup).order_by(FactApiRollup.unit).all()
+        self.assertEqual([(r.gdelt_day, r.category, r.unit, r.fact_count) for r in rollup],
+                         [(DAY, 'disaster', 'house', 1), (DAY, 'disaster', 'person', 1)])
+
+        self.analysis.category = 'conflict'
+        self.analysis.facts.remove(self.fact2)
+        self.session.commit()
+        changed, days = self.sync()
+        sync_rollup(self.session, days)
+        self.session.commit()
+        rollup = self.session.query(FactApiRollup).all()
+        self.assertEqual([(r.gdelt_day, r.category, r.unit, r.fact_count) for r in rollup],
+                         [(DAY, 'conflict', 'person', 1)])
+
+        # nothing to recompute
+        sync_rollup(self.session, set())
+        self.assertEqual(self.session.query(FactApiRollup).count(), 1)
+
+    def test_sync_once(self):
+        generation = api_cache.current_generation(self.session, force=True)
+        self.assertEqual(sync_once(self.session, sweep_deleted=True), 1)
+        self.assertEqual(self.session.query(FactApi).count(), 2)
+        self.assertEqual(self.session.query(FactApiRollup).count(), 2)
+        self.assertEqual(api_cache.current_generation(self.session, force=True), generation + 1)
+        # nothing has changed or been deleted since, so the cached responses are kept
+        self.assertEqual(sync_once(self.session, sweep_deleted=True), 0)
+        self.assertEqual(api_cache.current_generation(self.session, force=True), generation + 1)
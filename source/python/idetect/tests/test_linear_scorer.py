@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.pipeline import Pipeline, FeatureUnion
+from sklearn.svm import LinearSVC
+
+from idetect.nlp_models.base_model import CustomSklLsiModel
+from idetect.nlp_models.linear_scorer import compile_pipeline, verify
+
+TEXTS = [
+    "Thousands of people were evacuated from their homes after the flood",
+    "The earthquake destroyed houses and left families homeless",
+    "Refugees fled across the border to escape the fighting",
+    "Villagers were displaced by the armed conflict in the region",
+    "The football team won the championship on Sunday",
+    "Shares rose sharply after the company reported strong earnings",
+    "The new museum exhibition opens to the public next week",
+    "The minister announced a budget for schools and hospitals",
+]
+LABELS = [1, 1, 1, 1, 0, 0, 0, 0]
+
+
+class TestLinearScorer(TestCase):
+    def test_compile_lsi_union(self):
+        pipeline = Pipeline([
+            ('union', FeatureUnion(transformer_list=[
+                ('words', Pipeline([
+                    ('tfidf', TfidfVectorizer()),
+                    ('lsi', CustomSklLsiModel(num_topics=3))
+                ])),
+                ('bigrams', Pipeline([
+                    ('tfidf', TfidfVectorizer(ngram_range=(2, 2))),
+                    ('lsi', CustomSklLsiModel(num_topics=3))
+                ]))
+            ])),
+            ('svm', LinearSVC())
+        ])
+        pipeline.fit(TEXTS, LABELS)
+        scorer = compile_pipeline(pipeline)
+        verify(pipeline, scorer, TEXTS + ["People fled the flooding", "The team lost"])
+
+    def test_compile_multiclass(self):
+        pipeline = Pipeline([('tfidf', TfidfVectorizer()), ('svm', LinearSVC())])
+        labels = ['disaster', 'disaster', 'conflict', 'conflict', 'other', 'other', 'other', 'other']
+        pipeline.fit(TEXTS, labels)
+        scorer = compile_pipeline(pipeline)
+        verify(pipeline, scorer, TEXTS)
+        self.assertEqual(list(scorer.predict(TEXTS)), list(pipeline.predict(TEXTS)))
@@ -84,8 +84,7 @@ class TestManager(TestCase):
 
     def test_wordcloud(self):
         t0 = time.time()
-        terms = get_wordcloud(self.session,
-                              self.engine)
+        terms = get_wordcloud(self.session)
         t1 = time.time()
         print(t1 - t0)
         print(len(terms))
@@ -135,7 +134,6 @@ class TestManager(TestCase):
     def test_wordcloud_year(self):
         t0 = time.time()
         terms = get_wordcloud(self.session,
-                              self.engine,
                               fromdate=self.start_date,
                               todate=self.plus_1_yr)
         t1 = time.time()
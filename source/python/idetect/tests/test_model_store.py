@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+import numpy as np
+
+from idetect.nlp_models.model_store import ChecksumException, MODEL_FILE, ModelStore
+
+
+class TestModelStore(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = ModelStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_publish_load(self):
+        model = {'weights': np.arange(1000, dtype=np.float64)}
+        self.assertIsNone(self.store.current_version('test'))
+        self.store.publish('test', 'v1', model)
+        self.assertTrue(self.store.has('test', 'v1'))
+        self.assertEqual(self.store.current_version('test'), 'v1')
+
+        loaded = self.store.load('test', 'v1', verify=True)
+        self.assertIsInstance(loaded['weights'], np.memmap)
+        np.testing.assert_array_equal(loaded['weights'], model['weights'])
+
+    def test_load_skips_checksum(self):
+        self.store.publish('test', 'v1', {'weights': np.zeros(10)})
+        with mock.patch('idetect.nlp_models.model_store.sha256') as checksum:
+            self.store.load('test', 'v1')
+        checksum.assert_not_called()
+
+    def test_versions(self):
+        self.store.publish('test', 'v1', {'weights': np.zeros(10)})
+        self.store.publish('test', 'v2', {'weights': np.ones(10)}, make_current=False)
+        self.assertEqual(self.store.current_version('test'), 'v1')
+        self.store.set_current('test', 'v2')
+        self.assertEqual(self.store.current_version('test'), 'v2')
+        with self.assertRaises(ValueError):
+            self.store.set_current('test', 'v3')
+
+    def test_load_verifies(self):
+        self.store.publish('test', 'v1', {'weights': np.zeros(10)})
+        with open(os.path.join(self.store.version_dir('test', 'v1'), MODEL_FILE), 'ab') as f:
+            f.write(b'corrupt')
+        with self.assertRaises(ChecksumException):
+            self.store.load('test', 'v1')
+
+    def test_load_verifies_rewritten(self):
+        # same size, but rewritten since it was published
+        self.store.publish('test', 'v1', {'weights': np.zeros(10)})
+        model_path = os.path.join(self.store.version_dir('test', 'v1'), MODEL_FILE)
+        with open(model_path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b'x')
+        stat = os.stat(model_path)
+        os.utime(model_path, (stat.st_atime, stat.st_mtime + 1))
+        with self.assertRaises(ChecksumException):
+            self.store.load('test', 'v1')
@@ -0,0 +1,78 @@
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from idetect.model import Base, Session, Status, Gkg, Analysis, Domain
+from idetect.politeness import domain_name, polite_filter, reserve, record_failure, record_success, \
+    SECONDS_BETWEEN_REQUESTS, CIRCUIT_BREAKER_FAILURES
+
+
+class TestPoliteness(TestCase):
+    def setUp(self):
+        db_host = os.environ.get('DB_HOST')
+        db_url = 'postgresql://{user}:{passwd}@{db_host}/{db}'.format(
+            user='tester', passwd='tester', db_host=db_host, db='idetect_test')
+        engine = create_engine(db_url)
+        Session.configure(bind=engine)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        for gkg in self.session.query(Gkg).all():
+            self.session.delete(gkg)
+        self.session.query(Domain).delete()
+        self.session.commit()
+
+    def test_domain_name(self):
+        self.assertEqual(domain_name(Gkg(source_common_name="cnn.com",
+                                         document_identifier="http://edition.cnn.com/a")), "cnn.com")
+        self.assertEqual(domain_name(Gkg(document_identifier="http://www.cnn.com/2013/08/23/index.html")),
+                         "cnn.com")
+        self.assertIsNone(domain_name(Gkg(document_identifier="not a url")))
+
+    def test_reserve(self):
+        self.assertEqual(reserve(self.session, "cnn.com"), 0)
+        # a second request to the same domain has to wait its turn
+        self.assertGreater(reserve(self.session, "cnn.com"), SECONDS_BETWEEN_REQUESTS - 1)
+        # ... but other domains don't
+        self.assertEqual(reserve(self.session, "bbc.co.uk"), 0)
+
+    def test_circuit_breaker(self):
+        gkg = Gkg(document_identifier="http://www.cnn.com/2013/08/23/us/hurricane-katrina-statistics-fast-facts/index.html")
+        analysis = Analysis(gkg=gkg, status=Status.NEW)
+        self.session.add(analysis)
+        self.session.commit()
+        query = self.session.query(Analysis).filter(Analysis.status == Status.NEW)
+
+        reserve(self.session, "cnn.com")
+        # rate limited straight after a request
+        self.assertEqual(polite_filter(query).count(), 0)
+        self.session.query(Domain).update({Domain.next_request: None})
+        self.session.commit()
+        self.assertEqual(polite_filter(query).count(), 1)
+
+        for i in range(CIRCUIT_BREAKER_FAILURES):
+            record_failure(self.session, "cnn.com")
+        self.assertEqual(polite_filter(query).count(), 0)
+
+        record_success(self.session, "cnn.com")
+        self.assertEqual(polite_filter(query).count(), 1)
+
+    def test_max_concurrent_requests(self):
+        for i in range(2):
+            gkg = Gkg(document_identifier="http://www.cnn.com/{}".format(i))
+            self.session.add(Analysis(gkg=gkg, status=Status.NEW))
+        self.session.commit()
+        self.assertEqual({a.domain for a in self.session.query(Analysis)}, {"cnn.com"})
+        query = self.session.query(Analysis).filter(Analysis.status == Status.NEW)
+        self.assertEqual(polite_filter(query).count(), 2)
+
+        self.session.add(Domain(name="cnn.com", consecutive_failures=0, max_concurrent_requests=1))
+        self.session.query(Analysis).filter(Analysis.gkg_id == query.first().gkg_id) \
+            .update({Analysis.status: Status.SCRAPING})
+        self.session.commit()
+        # one is being scraped, which is all this domain allows
+        self.assertEqual(polite_filter(query).count(), 0)
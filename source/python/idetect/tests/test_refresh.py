@@ -0,0 +1,68 @@
+import os
+from unittest import TestCase, mock
+
+from sqlalchemy import create_engine
+
+from idetect import api_cache, refresh
+from idetect.fact_api import RefreshLog
+from idetect.model import Base, Session, CacheGeneration
+
+VIEW = 'test_refresh_mview'
+JSONB_VIEW = 'test_refresh_jsonb_mview'
+
+
+class TestRefresh(TestCase):
+    def setUp(self):
+        db_host = os.environ.get('DB_HOST')
+        db_url = 'postgresql://{user}:{passwd}@{db_host}/{db}'.format(
+            user='tester', passwd='tester', db_host=db_host, db='idetect_test')
+        engine = create_engine(db_url)
+        Session.configure(bind=engine)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        self.session = Session()
+        self.session.execute("DROP MATERIALIZED VIEW IF EXISTS {}".format(VIEW))
+        self.session.execute("CREATE MATERIALIZED VIEW {} AS SELECT generate_series(1, 3) AS id WITH NO DATA"
+                             .format(VIEW))
+        self.session.execute("CREATE UNIQUE INDEX {0}_id_idx ON {0} (id)".format(VIEW))
+        # like idetect_map_week_mview, a single row holding every entry
+        self.session.execute("DROP MATERIALIZED VIEW IF EXISTS {}".format(JSONB_VIEW))
+        self.session.execute("CREATE MATERIALIZED VIEW {} AS SELECT jsonb_agg(x) AS entries, 1 AS id "
+                             "FROM generate_series(1, 3) x WITH NO DATA".format(JSONB_VIEW))
+        self.session.execute("CREATE UNIQUE INDEX {0}_id_idx ON {0} (id)".format(JSONB_VIEW))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.execute("DROP MATERIALIZED VIEW IF EXISTS {}".format(VIEW))
+        self.session.execute("DROP MATERIALIZED VIEW IF EXISTS {}".format(JSONB_VIEW))
+        self.session.query(RefreshLog).delete()
+        self.session.query(CacheGeneration).delete()
+        self.session.commit()
+
+    def test_refresh_view(self):
+        self.assertFalse(refresh.is_populated(self.session, VIEW))
+        # CONCURRENTLY can't populate a view for the first time
+        refresh.refresh_view(self.session, VIEW)
+        self.assertTrue(refresh.is_populated(self.session, VIEW))
+        refresh.refresh_view(self.session, VIEW)
+        log = self.session.query(RefreshLog).order_by(RefreshLog.id).all()
+        self.assertEqual([(l.name, l.method, l.row_count) for l in log],
+                         [(VIEW, 'blocking', 3), (VIEW, 'concurrently', 3)])
+
+    def test_refresh_view_row_count(self):
+        row_counts = {JSONB_VIEW: "SELECT coalesce(jsonb_array_length(entries), 0) FROM {}".format(JSONB_VIEW)}
+        with mock.patch.dict(refresh.ROW_COUNTS, row_counts):
+            refresh.refresh_view(self.session, JSONB_VIEW)
+        self.assertEqual(self.session.query(RefreshLog.row_count).scalar(), 3)
+
+    def test_refresh_all(self):
+        generation = api_cache.current_generation(self.session, api_cache.MAP_WEEK, force=True)
+        refresh.refresh_all(self.session, views=[VIEW, JSONB_VIEW], warm=False)
+        refresh.refresh_all(self.session, views=[VIEW, JSONB_VIEW], warm=False)
+        log = self.session.query(RefreshLog).order_by(RefreshLog.id).all()
+        self.assertEqual([(l.name, l.method) for l in log],
+                         [(VIEW, 'blocking'), (JSONB_VIEW, 'blocking'),
+                          (VIEW, 'concurrently'), (JSONB_VIEW, 'concurrently')])
+        self.assertEqual(api_cache.current_generation(self.session, api_cache.MAP_WEEK, force=True),
+                         generation + 2)
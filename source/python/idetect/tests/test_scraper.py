@@ -3,7 +3,7 @@ from unittest import TestCase
 
 from sqlalchemy import create_engine
 
-from idetect.model import Base, Session, Status, Gkg, Analysis, DocumentContent
+from idetect.model import Base, Session, Status, Gkg, Analysis, DocumentContent, DocumentTerm
 from idetect.scraper import scrape
 
 
@@ -42,6 +42,9 @@ class TestScraper(TestCase):
                 .filter(DocumentContent.content_ts.match('Katrina & Louisiana')).all()
         )
         self.assertIn(content, matches)
+        words = [w for w, in self.session.query(DocumentTerm.word)
+                 .filter(DocumentTerm.content_id == content.id).all()]
+        self.assertIn('katrina', words)
 
     def test_scrape_pdf(self):
         gkg = Gkg(
@@ -8,7 +8,7 @@ from sqlalchemy import create_engine, func
 from tabulate import tabulate
 
 from idetect.fact_api import FactApi, add_filters, get_filter_counts, get_timeline_counts, get_histogram_counts, \
-    get_wordcloud, get_urllist, get_count, get_urllist_grouped
+    get_wordcloud, get_wordcloud_sampled, get_urllist, get_count, get_count_estimate, get_urllist_grouped
 from idetect.model import Session, DocumentContent
 
 logger = logging.getLogger(__name__)
@@ -147,7 +147,6 @@ class TestSyriaYear(TestCase):
     def test_wordcloud(self):
         t0 = time.time()
         terms = get_wordcloud(self.session,
-                              self.engine,
                               fromdate=self.start_date,
                               todate=self.plus_1_yr,
                               location_ids=self.syria_location_ids)
@@ -159,6 +158,17 @@ class TestSyriaYear(TestCase):
             self.start_date, self.plus_1_yr
         ))
 
+    def test_wordcloud_sampled(self):
+        terms = get_wordcloud_sampled(self.session,
+                                      fromdate=self.start_date,
+                                      todate=self.plus_1_yr,
+                                      location_ids=self.syria_location_ids)
+        self.assertGreater(len(terms), 0)
+        self.assertEqual(terms, get_wordcloud_sampled(self.session,
+                                                      fromdate=self.start_date,
+                                                      todate=self.plus_1_yr,
+                                                      location_ids=self.syria_location_ids))
+
     def test_none_location(self):
         # TODO this isn't about Syria, move it somewhere else
         counts = get_filter_counts(self.session, location_ids=['NULL'])
@@ -206,7 +216,8 @@ class TestSyriaYear(TestCase):
 
     def test_filter_ts(self):
         t0 = time.time()
-        query = add_filters(self.session.query(FactApi.content_id, DocumentContent.content_clean),
+        query = add_filters(self.session.query(FactApi.content_id, DocumentContent.content_clean)
+                            .join(DocumentContent, DocumentContent.id == FactApi.content_id),
                             fromdate=self.start_date,
                             todate=self.plus_1_yr,
                             location_ids=self.syria_location_ids,
@@ -218,11 +229,25 @@ class TestSyriaYear(TestCase):
         for id, content_clean in results:
             self.assertTrue('jordan' in content_clean.lower())
 
+    def test_aggregates_ts(self):
+        # the aggregate queries are grouped, so the text search mustn't plan them on their own
+        filters = dict(fromdate=self.start_date, todate=self.plus_1_yr, location_ids=self.syria_location_ids,
+                       ts='Jordan')
+        f_c = get_filter_counts(self.session, **filters)
+        self.assertGreater(len(f_c), 0)
+        timeline = get_timeline_counts(self.session, **filters)
+        self.assertGreater(len(timeline), 0)
+        histogram = get_histogram_counts(self.session, **filters)
+        self.assertGreater(len(histogram), 0)
+        # every fact counted in the timeline is also counted in the histogram
+        self.assertEqual(sum(t['count'] for t in timeline), sum(h['count'] for h in histogram))
+
     @skip("Too slow in practice")
     def test_filter_ts_exhaustive(self):
         # make sure that the query found everything that it was supposed to
         t0 = time.time()
-        query = add_filters(self.session.query(FactApi.content_id, DocumentContent.content_clean, FactApi.gdelt_day),
+        query = add_filters(self.session.query(FactApi.content_id, DocumentContent.content_clean, FactApi.gdelt_day)
+                            .join(DocumentContent, DocumentContent.id == FactApi.content_id),
                             fromdate=self.start_date,
                             todate=self.plus_1_yr,
                             location_ids=self.syria_location_ids,
@@ -289,6 +314,36 @@ class TestSyriaYear(TestCase):
         self.assertGreater(len(ids),1000)
         self.assertEqual(len(ids), len(set(ids)))
 
+    def test_urllist_after_fact(self):
+        result1 = get_urllist(self.session,
+                              limit=64,
+                              fromdate=self.start_date,
+                              todate=self.plus_1_yr,
+                              location_ids=self.syria_location_ids)
+        result2 = get_urllist(self.session,
+                              after_fact=result1[31]['fact_id'],
+                              fromdate=self.start_date,
+                              todate=self.plus_1_yr,
+                              location_ids=self.syria_location_ids)
+        self.assertEqual([r['fact_id'] for r in result1[32:]], [r['fact_id'] for r in result2])
+
+    def test_urllist_excerpt(self):
+        filters = dict(fromdate=self.start_date, todate=self.plus_1_yr, location_ids=self.syria_location_ids)
+        full = get_urllist(self.session, **filters)
+        excerpts = get_urllist(self.session, excerpt=True, **filters)
+        for f, e in zip(full, excerpts):
+            self.assertNotIn('content_clean', e)
+            self.assertEqual(f['content_clean'][f['excerpt_start']:f['excerpt_end']],
+                             e['excerpt'][e['excerpt_start'] - e['excerpt_offset']:e['excerpt_end'] - e['excerpt_offset']])
+
+    def test_count_estimate(self):
+        filters = dict(fromdate=self.start_date, todate=self.plus_1_yr, location_ids=self.syria_location_ids)
+        c = get_count(self.session, **filters)
+        self.assertEqual((c, True), get_count_estimate(self.session, exact_limit=c, **filters))
+        estimate, exact = get_count_estimate(self.session, exact_limit=c - 1, **filters)
+        self.assertFalse(exact)
+        self.assertGreaterEqual(estimate, c)
+
     def test_urllist_ts(self):
         t0 = time.time()
         result1 = get_urllist(self.session,
@@ -8,8 +8,10 @@ from unittest import TestCase
 
 from sqlalchemy import create_engine, func
 
-from idetect.model import Base, Session, Status, Gkg, Analysis
-from idetect.worker import Worker, Initiator
+from idetect.fact_api import get_job
+from idetect.model import Base, Session, Status, Gkg, Analysis, Priority, DisplacementType
+from idetect.retry import RetryPolicy, retry_due
+from idetect.worker import Worker, BatchWorker, Initiator
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -74,6 +76,25 @@ class TestWorker(TestCase):
 
         self.assertFalse(worker.work(), "Worker found work")
 
+    def test_work_priority(self):
+        worker = Worker(scraping_filter, Status.SCRAPING, Status.SCRAPED, Status.SCRAPING_FAILED,
+                        TestWorker.nap_fn, self.engine)
+        gkg1 = Gkg(
+            document_identifier="http://www.cnn.com/2013/08/23/us/hurricane-katrina-statistics-fast-facts/index.html")
+        bulk = Analysis(gkg=gkg1, status=Status.NEW)
+        self.session.add(bulk)
+        self.session.commit()
+        gkg2 = Gkg(
+            document_identifier="http://www.cnn.com/2013/08/23/us/hurricane-katrina-statistics-fast-facts/index.html")
+        interactive = Analysis(gkg=gkg2, status=Status.NEW, priority=Priority.INTERACTIVE)
+        self.session.add(interactive)
+        self.session.commit()
+
+        # the newer, interactive analysis is claimed ahead of the older bulk one
+        self.assertTrue(worker.work(), "Worker didn't find work")
+        self.assertEqual(interactive.get_updated_version().status, Status.SCRAPED)
+        self.assertEqual(bulk.get_updated_version().status, Status.NEW)
+
     def test_rework(self):
         worker = Worker(scraping_filter, Status.SCRAPING, Status.SCRAPED, Status.SCRAPING_FAILED,
                         TestWorker.nap_fn, self.engine)
@@ -118,6 +139,143 @@ class TestWorker(TestCase):
 
         self.assertFalse(worker.work(), "Worker found work")
 
+    def test_work_retry(self):
+        policies = [(RuntimeError, RetryPolicy(3600, 3600, 2))]
+        worker = Worker(lambda query: query.filter((Analysis.status == Status.NEW) |
+                                                   retry_due(Status.SCRAPING_FAILED)),
+                        Status.SCRAPING, Status.SCRAPED, Status.SCRAPING_FAILED,
+                        TestWorker.err_fn, self.engine, retry_policies=policies)
+        gkg = Gkg(
+            document_identifier="http://www.cnn.com/2013/08/23/us/hurricane-katrina-statistics-fast-facts/index.html")
+        analysis = Analysis(gkg=gkg, status=Status.NEW)
+        self.session.add(analysis)
+        self.session.commit()
+        self.assertTrue(worker.work(), "Worker didn't find work")
+
+        analysis2 = analysis.get_updated_version()
+        self.assertEqual(analysis2.status, Status.SCRAPING_FAILED)
+        self.assertEqual(analysis2.retry_attempts, 1)
+        self.assertIsNotNone(analysis2.next_attempt_at)
+        # an analyse_url job waiting for its retry hasn't failed
+        job = get_job(self.session, analysis.gkg_id)
+        self.assertFalse(job['failed'])
+        self.assertIn('next_attempt_at', job)
+        # not due yet
+        self.assertFalse(worker.work(), "Worker found work")
+
+        analysis2.next_attempt_at = func.now() - timedelta(minutes=1)
+        self.session.commit()
+        self.assertTrue(worker.work(), "Worker didn't find work")
+
+        analysis3 = analysis.get_updated_version()
+        self.assertEqual(analysis3.status, Status.DEAD_LETTER)
+        self.assertIsNone(analysis3.next_attempt_at)
+        self.assertTrue(analysis3.error_msg.startswith(Status.SCRAPING_FAILED))
+        self.assertTrue(get_job(self.session, analysis.gkg_id)['failed'])
+        self.assertFalse(worker.work(), "Worker found work")
+
+    def test_work_retry_unmatched(self):
+        # exceptions no policy covers fail the stage as usual, without a retry
+        policies = [(KeyError, RetryPolicy(3600, 3600, 2))]
+        worker = Worker(lambda query: query.filter((Analysis.status == Status.NEW) |
+                                                   retry_due(Status.SCRAPING_FAILED)),
+                        Status.SCRAPING, Status.SCRAPED, Status.SCRAPING_FAILED,
+                        TestWorker.err_fn, self.engine, retry_policies=policies)
+        analysis = Analysis(gkg=Gkg(document_identifier="unmatched"), status=Status.NEW)
+        self.session.add(analysis)
+        self.session.commit()
+        self.assertTrue(worker.work(), "Worker didn't find work")
+
+        analysis2 = analysis.get_updated_version()
+        self.assertEqual(analysis2.status, Status.SCRAPING_FAILED)
+        self.assertIsNone(analysis2.next_attempt_at)
+        self.assertFalse(worker.work(), "Worker found work")
+
+    def test_claim_clears_next_attempt(self):
+        seen = []
+        worker = Worker(lambda query: query.filter(retry_due(Status.SCRAPING_FAILED)),
+                        Status.SCRAPING, Status.SCRAPED, Status.SCRAPING_FAILED,
+                        lambda a: seen.append(a.get_updated_version().next_attempt_at), self.engine,
+                        retry_policies=[])
+        gkg = Gkg(
+            document_identifier="http://www.cnn.com/2013/08/23/us/hurricane-katrina-statistics-fast-facts/index.html")
+        analysis = Analysis(gkg=gkg, status=Status.SCRAPING_FAILED,
+                            next_attempt_at=func.now() - timedelta(minutes=1))
+        self.session.add(analysis)
+        self.session.commit()
+        self.assertTrue(worker.work(), "Worker didn't find work")
+        self.assertEqual(seen, [None])
+
+    @staticmethod
+    def batch_fn(analyses):
+        for analysis in analyses:
+            if analysis.gkg.document_identifier == "bad":
+                raise RuntimeError("bad document")
+            analysis.category = DisplacementType.OTHER
+
+    def test_batch_work(self):
+        worker = BatchWorker(lambda query: query.filter(Analysis.status == Status.SCRAPED),
+                             Status.CLASSIFYING, Status.CLASSIFIED, Status.CLASSIFYING_FAILED,
+                             TestWorker.batch_fn, self.engine, batch_size=2)
+        analyses = [Analysis(gkg=Gkg(document_identifier=identifier), status=Status.SCRAPED)
+                    for identifier in ["good1", "good2", "bad"]]
+        self.session.add_all(analyses)
+        self.session.commit()
+
+        self.assertTrue(worker.work(), "Worker didn't find work")
+        self.assertTrue(worker.work(), "Worker didn't find work")
+        self.assertFalse(worker.work(), "Worker found work")
+
+        statuses = {a.gkg.document_identifier: a.get_updated_version().status for a in analyses}
+        self.assertEqual(statuses, {"good1": Status.CLASSIFIED, "good2": Status.CLASSIFIED,
+                                    "bad": Status.CLASSIFYING_FAILED})
+        self.assertEqual(analyses[0].get_updated_version().category, DisplacementType.OTHER)
+
+    def test_batch_work_stale(self):
+        def stale_fn(analyses):
+            for analysis in analyses:
+                if analysis.gkg.document_identifier == "stale":
+                    # someone else moves this Analysis on while we are working on it
+                    other_session = Session()
+                    other = other_session.query(Analysis).get(analysis.gkg_id)
+                    other.create_new_version(Status.SCRAPED)
+                    other_session.close()
+                    raise RuntimeError("stale document")
+                analysis.category = DisplacementType.OTHER
+
+        worker = BatchWorker(lambda query: query.filter(Analysis.status == Status.SCRAPED),
+                             Status.CLASSIFYING, Status.CLASSIFIED, Status.CLASSIFYING_FAILED,
+                             stale_fn, self.engine, batch_size=2)
+        analyses = [Analysis(gkg=Gkg(document_identifier=identifier), status=Status.SCRAPED)
+                    for identifier in ["stale", "good"]]
+        self.session.add_all(analyses)
+        self.session.commit()
+
+        self.assertTrue(worker.work(), "Worker didn't find work")
+
+        statuses = {a.gkg.document_identifier: a.get_updated_version().status for a in analyses}
+        self.assertEqual(statuses, {"stale": Status.SCRAPED, "good": Status.CLASSIFIED})
+
+    def test_work_skip(self):
+        worker = Worker(lambda query: query.filter(Analysis.status == Status.SCRAPED),
+                        Status.CLASSIFYING, Status.CLASSIFIED, Status.CLASSIFYING_FAILED,
+                        lambda analysis: None, self.engine,
+                        skip_status=Status.SKIPPED, skip_function=lambda analysis: analysis.relevance is False)
+        relevant = Analysis(gkg=Gkg(document_identifier="relevant"), status=Status.SCRAPED, relevance=True)
+        irrelevant = Analysis(gkg=Gkg(document_identifier="irrelevant"), status=Status.SCRAPED, relevance=False)
+        self.session.add_all([relevant, irrelevant])
+        self.session.commit()
+        self.assertEqual(worker.work_all(), 2)
+        self.assertEqual(relevant.get_updated_version().status, Status.CLASSIFIED)
+        self.assertEqual(irrelevant.get_updated_version().status, Status.SKIPPED)
+
+    def test_retry_policy_delay(self):
+        policy = RetryPolicy(60, 600, 5)
+        for attempts, expected in [(1, 60), (2, 120), (3, 240), (4, 480), (5, 600)]:
+            delay = policy.delay(attempts)
+            self.assertGreaterEqual(delay, expected / 2)
+            self.assertLessEqual(delay, expected)
+
     @staticmethod
     def snooze_fn(analysis):
         time.sleep(5)
@@ -1,24 +1,42 @@
 import errno
+import gc
 import logging
 import os
 import random
+import select
 import signal
 import time
-from multiprocessing import Process
+from multiprocessing import Process, get_context
 
-from idetect.model import Analysis, Session, Gkg, Status
+from sqlalchemy import text
+from sqlalchemy.orm import object_session
+
+from idetect.model import Analysis, Session, Gkg, Status, NotLatestException
+from idetect.retry import schedule_retry, clear_retry
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Postgres channel used to wake up idle workers when high priority work is submitted
+WORK_CHANNEL = 'idetect_work'
+
+
+def notify_workers(session):
+    """Wake up any idle Workers once the current transaction of session commits"""
+    session.execute(text("NOTIFY {}".format(WORK_CHANNEL)))
+
 
 class Worker:
     def __init__(self, filter_function, working_status, success_status, failure_status, function, engine,
-                 max_sleep=60, timeout_seconds=300):
+                 max_sleep=60, timeout_seconds=300, retry_policies=None, skip_status=None, skip_function=None):
         """
         Create a Worker that looks for Analyses with a given status. When it finds one, it marks it with
         working_status and runs a function. If the function returns without an exception, it advances the Analysis to
         success_status. If the function raises an exception, it advances the Analysis to failure_status.
+        If retry_policies are given (see idetect.retry), failed Analyses are scheduled for a retry, or moved to
+        Status.DEAD_LETTER once they have failed too many times.
+        If skip_function is given, Analyses it returns True for after a successful run are advanced to skip_status
+        instead of success_status, so that later stages don't need to look at them.
         """
         self.filter_function = filter_function
         self.working_status = working_status
@@ -26,9 +44,15 @@ class Worker:
         self.failure_status = failure_status
         self.function = function
         self.engine = engine
+        self.retry_policies = retry_policies
+        self.skip_status = skip_status
+        self.skip_function = skip_function
         self.terminated = False
         self.max_sleep = max_sleep
         self.timeout_seconds = timeout_seconds
+        self.install_signal_handlers()
+
+    def install_signal_handlers(self):
         signal.signal(signal.SIGINT, self.terminate)
         signal.signal(signal.SIGTERM, self.terminate)
         signal.signal(signal.SIGALRM, self.timeout)
@@ -41,6 +65,12 @@ class Worker:
         logger.warning("Worker {} timed out".format(os.getpid()))
         raise TimeoutError(os.strerror(errno.ETIME))
 
+    def next_status(self, analysis):
+        """The status to advance a successfully processed Analysis to"""
+        if self.skip_function is not None and self.skip_function(analysis):
+            return self.skip_status
+        return self.success_status
+
     def work(self):
         """
         Look for analyses in the given session and run function on them
@@ -52,15 +82,17 @@ class Worker:
             # Get an analysis
             # ... and lock it for updates
             # ... that meets the conditions specified in the filter function
-            # ... sort by updated date
-            # ... pick the first (oldest)
+            # ... sort by priority, then updated date
+            # ... pick the first (most urgent, then oldest)
             analysis = self.filter_function(session.query(Analysis)) \
                 .with_for_update() \
-                .order_by(Analysis.updated) \
+                .order_by(Analysis.priority.desc(), Analysis.updated) \
                 .first()
             if analysis is None:
                 return False  # no work to be done
             analysis_status = analysis.status
+            # the retry it was waiting for is happening now
+            analysis.next_attempt_at = None
             analysis.create_new_version(self.working_status)
             logger.info("Worker {} claimed Analysis {} in status {}".format(
                 os.getpid(), analysis.gkg_id, analysis_status))
@@ -68,34 +100,50 @@ class Worker:
             # make sure to release a FOR UPDATE lock, if we got one
             session.rollback()
 
+        try:
+            self.process(analysis, analysis_status, self.function)
+        finally:
+            session.close()
+        return True
+
+    def process(self, analysis, analysis_status, function):
+        """Run function on a claimed analysis and advance it to the success or failure status"""
+        session = object_session(analysis)
         start = time.time()
         try:
             # set a timeout so if this worker stalls, we recover
             signal.alarm(self.timeout_seconds)
             # actually run the work function on this analysis
-            self.function(analysis)
+            function(analysis)
             delta = time.time() - start
+            success_status = self.next_status(analysis)
             logger.info("Worker {} processed Analysis {} {} -> {} {}s".format(
-                os.getpid(), analysis.gkg_id, analysis_status, self.success_status, delta))
+                os.getpid(), analysis.gkg_id, analysis_status, success_status, delta))
             analysis.error_msg = None
             analysis.processing_time = delta
-            analysis.create_new_version(self.success_status)
+            if self.retry_policies is not None:
+                clear_retry(analysis)
+            analysis.create_new_version(success_status)
         except Exception as e:
             delta = time.time() - start
+            failure_status = self.failure_status
+            if self.retry_policies is not None:
+                failure_status = schedule_retry(analysis, e, self.retry_policies, self.failure_status)
             logger.warning("Worker {} failed to process Analysis {} {} -> {}".format(
-                os.getpid(), analysis.gkg_id, analysis_status, self.failure_status),
+                os.getpid(), analysis.gkg_id, analysis_status, failure_status),
                 exc_info=e)
             analysis.error_msg = str(e)
+            if failure_status == Status.DEAD_LETTER:
+                # the status no longer says which stage gave up
+                analysis.error_msg = "{} after {} attempts: {}".format(
+                    self.failure_status, analysis.retry_attempts, e)
             analysis.processing_time = delta
-            analysis.create_new_version(self.failure_status)
+            analysis.create_new_version(failure_status)
             session.commit()
         finally:
             # clear the timeout
             signal.alarm(0)
-            if session is not None:
-                session.rollback()
-                session.close()
-        return True
+            session.rollback()
 
     def work_all(self):
         """Work repeatedly until there is no work to do. Return a count of the number of units of work done"""
@@ -104,30 +152,176 @@ class Worker:
             count += 1
         return count
 
+    def listen(self):
+        """
+        Open a connection LISTENing on WORK_CHANNEL so that naps can be cut short
+        when new high priority work arrives. Returns None if that isn't possible.
+        """
+        try:
+            connection = self.engine.raw_connection()
+            connection.connection.set_isolation_level(0)  # autocommit, so notifications are delivered
+            connection.cursor().execute("LISTEN {}".format(WORK_CHANNEL))
+            return connection
+        except Exception as e:
+            logger.warning("Worker {} unable to listen for notifications".format(os.getpid()), exc_info=e)
+            return None
+
+    def nap(self, connection, seconds):
+        """Sleep for up to seconds, waking early if another process calls notify_workers"""
+        if connection is None:
+            time.sleep(seconds)
+            return
+        pg_connection = connection.connection
+        if select.select([pg_connection], [], [], seconds) != ([], [], []):
+            pg_connection.poll()
+            del pg_connection.notifies[:]
+
     def work_indefinitely(self):
         """While there is work to do, do it. If there's no work to do, take increasingly long naps until there is."""
         logger.info("Worker {} working indefinitely".format(os.getpid()))
         time.sleep(random.randrange(self.max_sleep))  # stagger start times
+        connection = self.listen()
         sleep = 1
-        while not self.terminated:
-            if self.work_all() > 0:
-                sleep = 1
-            else:
-                time.sleep(sleep)
-                sleep = min(self.max_sleep, sleep * 2)
+        try:
+            while not self.terminated:
+                if self.work_all() > 0:
+                    sleep = 1
+                else:
+                    self.nap(connection, sleep)
+                    sleep = min(self.max_sleep, sleep * 2)
+        finally:
+            if connection is not None:
+                connection.close()
 
     @staticmethod
-    def start_processes(num, status, working_status, success_status, failure_status, function, engine, max_sleep=60):
+    def start_processes(num, status, working_status, success_status, failure_status, function, engine, max_sleep=60,
+                        retry_policies=None):
         processes = []
         engine.dispose()  # each Worker must have its own session, made in-Process
         for i in range(num):
-            worker = Worker(status, working_status, success_status, failure_status, function, engine, max_sleep)
+            worker = Worker(status, working_status, success_status, failure_status, function, engine, max_sleep,
+                            retry_policies=retry_policies)
             process = Process(target=worker.work_indefinitely, daemon=True)
             processes.append(process)
             process.start()
         return processes
 
 
+    def work_forked(self):
+        """Entry point for a Worker forked by run_preforked"""
+        self.install_signal_handlers()
+        self.work_indefinitely()
+
+    def run_preforked(self, num):
+        """
+        Run num copies of this Worker in processes forked from this one, restarting any that
+        die, until this process is terminated. Anything loaded before calling this (spaCy and
+        sklearn models in particular) is shared copy-on-write by the forked Workers instead of
+        being loaded separately by each of them.
+        """
+        # Move everything loaded so far out of reach of the garbage collector, so that
+        # collections in the children don't write to (and so copy) the shared pages
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        self.engine.dispose()  # each Worker must have its own connections, made in-Process
+        context = get_context('fork')
+
+        def start():
+            process = context.Process(target=self.work_forked, daemon=True)
+            process.start()
+            logger.info("Worker {} forked Worker {}".format(os.getpid(), process.pid))
+            return process
+
+        processes = [start() for i in range(num)]
+        try:
+            while not self.terminated:
+                time.sleep(1)
+                for i, process in enumerate(processes):
+                    if not process.is_alive():
+                        logger.warning("Worker {} exited with {}, restarting".format(process.pid, process.exitcode))
+                        processes[i] = start()
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+
+class BatchWorker(Worker):
+    def __init__(self, filter_function, working_status, success_status, failure_status, function, engine,
+                 batch_size=32, **kwargs):
+        """
+        Create a Worker that claims up to batch_size Analyses at a time and runs function once on the list of them,
+        so that models can process the whole batch in one go. Status changes for the batch, along with anything
+        function changed on the Analyses, are committed in a single transaction. If function raises an exception,
+        the Analyses are processed one at a time instead, so that one bad Analysis doesn't fail the whole batch.
+        """
+        super().__init__(filter_function, working_status, success_status, failure_status, function, engine,
+                         **kwargs)
+        self.batch_size = batch_size
+
+    def work(self):
+        """
+        Look for a batch of analyses and run function on them, managing status appropriately.
+        Return True iff some Analyses were processed (successfully or not)
+        """
+        session = Session()
+        try:
+            # Get a batch of analyses, skipping any that another Worker is claiming right now
+            analyses = self.filter_function(session.query(Analysis)) \
+                .with_for_update(skip_locked=True) \
+                .order_by(Analysis.priority.desc(), Analysis.updated) \
+                .limit(self.batch_size) \
+                .all()
+            if len(analyses) == 0:
+                session.close()
+                return False  # no work to be done
+            analysis_statuses = [analysis.status for analysis in analyses]
+            for analysis in analyses:
+                analysis.next_attempt_at = None
+            Analysis.create_new_versions(session, [(analysis, self.working_status) for analysis in analyses])
+            logger.info("Worker {} claimed Analyses {}".format(
+                os.getpid(), ", ".join(str(analysis.gkg_id) for analysis in analyses)))
+        finally:
+            # make sure to release a FOR UPDATE lock, if we got one
+            session.rollback()
+
+        start = time.time()
+        try:
+            signal.alarm(self.timeout_seconds)
+            self.function(analyses)
+            signal.alarm(0)
+            delta = (time.time() - start) / len(analyses)
+            new_statuses = [(analysis, self.next_status(analysis)) for analysis in analyses]
+            logger.info("Worker {} processed {} Analyses -> {} {}s each".format(
+                os.getpid(), len(analyses), ", ".join(sorted(set(s for a, s in new_statuses))), delta))
+            for analysis in analyses:
+                analysis.error_msg = None
+                analysis.processing_time = delta
+                if self.retry_policies is not None:
+                    clear_retry(analysis)
+            Analysis.create_new_versions(session, new_statuses)
+        except Exception as e:
+            signal.alarm(0)
+            session.rollback()
+            logger.warning("Worker {} failed to process batch, processing Analyses individually".format(
+                os.getpid()), exc_info=e)
+            for analysis, analysis_status in zip(analyses, analysis_statuses):
+                try:
+                    self.process(analysis, analysis_status, lambda a: self.function([a]))
+                except NotLatestException:
+                    # someone else changed this Analysis since we claimed it; leave it to them
+                    session.rollback()
+                    logger.info("Worker {} skipped Analysis {}, which changed while it was being processed".format(
+                        os.getpid(), analysis.gkg_id))
+        finally:
+            signal.alarm(0)
+            session.rollback()
+            session.close()
+        return True
+
+
 class Initiator(Worker):
     def __init__(self, engine, max_sleep=60):
         """
@@ -1,20 +1,22 @@
 import json
 import logging
+import os
+import threading
+import time
 
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, flash, \
+    json as flask_json
 from sqlalchemy import create_engine, desc, func, asc
 
 from idetect.fact_api import get_filter_counts, get_histogram_counts, get_timeline_counts, \
-    get_urllist, get_wordcloud, filter_params, get_count, get_group_count, get_map_week, get_urllist_grouped, \
-    create_new_analysis_from_url,work, get_document, get_facts_for_document
-from idetect.model import db_url, Analysis, Session, Gkg, Status, Base
-from idetect.scraper import scrape
-from idetect.classifier import classify
-from idetect.fact_extractor import extract_facts
-from idetect.geotagger import process_locations
-# from idetect.nlp_models.category import * 
-# from idetect.nlp_models.relevance import * 
-# from idetect.nlp_models.base_model import CustomSklLsiModel
+    get_urllist, get_wordcloud, filter_params, FilterException, get_count_estimate, get_group_count, get_map_week, get_urllist_grouped, page_params, \
+    create_new_analysis_from_url,work, get_document, get_facts_for_document, get_job
+from idetect import api_cache
+from idetect.model import db_url, Analysis, Session, Gkg, Status, Base, Priority
+from idetect.startup import report_startup
+from idetect.worker import notify_workers
+# The NLP pipeline (scraper, classifier models, spaCy) is only needed by analyse_url with wait=true,
+# so it is imported there rather than slowing down the start of every API process.
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +34,7 @@ c_m = None
 def get_c_m():
     global c_m 
     if c_m is None:
+        from idetect.nlp_models.category import CategoryModel
         c_m = CategoryModel()
     return c_m
 
@@ -39,6 +42,7 @@ r_m = None
 def get_r_m():
     global r_m
     if r_m is None:
+        from idetect.nlp_models.relevance import RelevanceModel
         r_m = RelevanceModel()
     return r_m
 
@@ -106,6 +110,10 @@ def search_url():
         session.close()
 
 
+@app.errorhandler(FilterException)
+def filter_error(e):
+    return json.dumps({'success': False, 'status': str(e)}), 400, {'ContentType': 'application/json'}
+
 
 @app.context_processor
 def utility_processor():
@@ -121,7 +129,8 @@ def filters():
     try:
         data = request.get_json(silent=True) or request.form
         filters = filter_params(data)
-        result = get_filter_counts(session, **filters)
+        result = api_cache.cached(session, 'filters', filters,
+                                  lambda: get_filter_counts(session, **filters))
         resp = jsonify(result)
         resp.status_code = 200
         return resp
@@ -135,7 +144,8 @@ def timeline():
     try:
         data = request.get_json(silent=True) or request.form
         filters = filter_params(data)
-        result = get_timeline_counts(session, **filters)
+        result = api_cache.cached(session, 'timeline', filters,
+                                  lambda: get_timeline_counts(session, **filters))
         resp = jsonify(result)
         resp.status_code = 200
         return resp
@@ -149,7 +159,8 @@ def histogram():
     try:
         data = request.get_json(silent=True) or request.form
         filters = filter_params(data)
-        result = get_histogram_counts(session, **filters)
+        result = api_cache.cached(session, 'histogram', filters,
+                                  lambda: get_histogram_counts(session, **filters))
         resp = jsonify(result)
         resp.status_code = 200
         return resp
@@ -163,7 +174,8 @@ def wordcloud():
     try:
         data = request.get_json(silent=True) or request.form
         filters = filter_params(data)
-        result = get_wordcloud(session, engine, **filters)
+        result = api_cache.cached(session, 'wordcloud', filters,
+                                  lambda: get_wordcloud(session, **filters))
         resp = jsonify(result)
         resp.status_code = 200
         return resp
@@ -177,11 +189,33 @@ def urllist():
     try:
         data = request.get_json(silent=True) or request.form
         filters = filter_params(data)
-        limit = data.get('limit', 32)
-        offset = data.get('offset', 0)
-        entries = get_urllist(session, limit=limit, offset=offset, **filters)
-        count = get_count(session, **filters)
-        resp = jsonify({'entries': entries, 'nentries': count})
+        limit, offset = page_params(data)
+        try:
+            # pass the next_after_fact of one page as after_fact to get the next one
+            after_fact = data.get('after_fact')
+            after_fact = int(after_fact) if after_fact not in (None, '') else None
+        except (TypeError, ValueError):
+            return json.dumps({'success': False, 'status': 'after_fact must be an integer'}), \
+                   400, {'ContentType': 'application/json'}
+        if after_fact is not None and offset:
+            # after_fact already says where the page starts
+            return json.dumps({'success': False, 'status': 'offset cannot be combined with after_fact'}), \
+                   400, {'ContentType': 'application/json'}
+        # excerpt=true returns the text around each fact rather than its whole document,
+        # which is available from /document/<gkg_id>
+        excerpt = str(data.get('excerpt', False)).lower() in ('true', '1')
+        entries = api_cache.cached(session, 'urllist', filters,
+                                   lambda: get_urllist(session, limit=limit, offset=offset,
+                                                       after_fact=after_fact, excerpt=excerpt, **filters),
+                                   limit=limit, offset=offset, after_fact=after_fact, excerpt=excerpt)
+        # the count only depends on the filters, so it is shared by every page
+        nentries, exact = api_cache.cached(session, 'urllist_count', filters,
+                                           lambda: get_count_estimate(session, **filters))
+        result = {'entries': entries,
+                  'nentries': nentries,
+                  'nentries_exact': exact,
+                  'next_after_fact': entries[-1]['fact_id'] if len(entries) == limit else None}
+        resp = jsonify(result)
         resp.status_code = 200
         return resp
     finally:
@@ -194,13 +228,30 @@ def urllist_grouped():
     try:
         data = request.get_json(silent=True) or request.form
         filters = filter_params(data)
-        limit = data.get('limit', 32)
-        offset = data.get('offset', 0)
-        entries = get_urllist_grouped(session, limit=limit, offset=offset, **filters)
+        limit, offset = page_params(data)
         # TODO for url_list grouped count should be the number of groups rather than the number of entries
-        factcount = get_count(session, **filters)
-        groupcount = get_group_count(session, **filters)
-        resp = jsonify({'groups': entries, 'ngroups': groupcount,'tot_nfacts':factcount})
+        result = api_cache.cached(session, 'urllist_grouped', filters,
+                                  lambda: {'groups': get_urllist_grouped(session, limit=limit, offset=offset, **filters),
+                                           'ngroups': get_group_count(session, **filters),
+                                           'tot_nfacts': api_cache.cached(
+                                               session, 'urllist_count', filters,
+                                               lambda: get_count_estimate(session, **filters))[0]},
+                                  limit=limit, offset=offset)
+        resp = jsonify(result)
+        resp.status_code = 200
+        return resp
+    finally:
+        session.close()
+
+
+@app.route('/document/<int:gkg_id>', methods=['GET'])
+def document(gkg_id):
+    session = Session()
+    try:
+        document = get_document(session, gkg_id)
+        if not document:
+            return json.dumps({'success': False, 'status': 'unknown gkg_id'}), 404, {'ContentType': 'application/json'}
+        resp = jsonify({'document': document[0], 'facts': get_facts_for_document(session, gkg_id)})
         resp.status_code = 200
         return resp
     finally:
@@ -211,30 +262,61 @@ def urllist_grouped():
 def map_week_mview():
     session = Session()
     try:
-        entries = get_map_week(session)
+        entries = api_cache.cached(session, 'map_week', {}, lambda: get_map_week(session))
         resp = jsonify(entries)
         resp.status_code = 200
         return resp
     finally:
         session.close()
 
+# how often a job event stream checks for progress, and how long it stays open before the
+# client has to reconnect (EventSource does so by itself after JOB_EVENTS_RETRY_MS)
+JOB_EVENTS_POLL_SECONDS = 1
+JOB_EVENTS_MAX_SECONDS = 30
+JOB_EVENTS_RETRY_MS = 1000
+# each open stream holds a uwsgi thread; keep most of them for the other endpoints
+JOB_EVENTS_MAX_STREAMS = int(os.environ.get('JOB_EVENTS_MAX_STREAMS', 2))
+job_event_streams = threading.BoundedSemaphore(JOB_EVENTS_MAX_STREAMS)
+
+
 @app.route('/analyse_url', methods=['POST'])
 def analyse_url():    
     session = Session()
     status=None
     gkg_id=None
+    data = request.get_json(silent=True) or request.form
     try:
-        url = request.get_json(silent=True)['url'] or request.form['url']
+        url = data['url']
     except Exception as e:
         return json.dumps({'success': False,'Exception':str(e),'status':'missing or null url parameter'}), 422, {'ContentType': 'application/json'}
     if url is None:
         return json.dumps({'success': False,'status':'null url parameter'}), 422, {'ContentType': 'application/json'}
+    # By default the url is handed to the background workers ahead of the bulk backlog
+    # and a job id is returned immediately; follow it at /analyse_url/<job_id> or
+    # /analyse_url/<job_id>/events. wait=true runs the pipeline inside this request.
+    wait = str(data.get('wait', False)).lower() in ('true', '1')
     gkg = session.query(Gkg.id).filter(
          Gkg.document_identifier.like("%" + url + "%")).order_by(Gkg.date.asc()).first()
     if gkg: 
         gkg_id=gkg.id
         status='url already in IDETECT DB'
+    elif not wait:
+        try:
+            analysis=create_new_analysis_from_url(session,url,priority=Priority.INTERACTIVE)
+            gkg_id=analysis.gkg_id
+            notify_workers(session)
+            session.commit()
+            resp = jsonify({'job_id': gkg_id, 'status': 'url submitted to IDETECT workers',
+                            'poll': url_for('analyse_url_job', gkg_id=gkg_id),
+                            'events': url_for('analyse_url_job_events', gkg_id=gkg_id)})
+            resp.status_code = 202
+            return resp
+        finally:
+            session.close()
     else:
+        from idetect.scraper import scrape
+        from idetect.fact_extractor import extract_facts
+        from idetect.geotagger import process_locations
         analysis=create_new_analysis_from_url(session,url)
         gkg_id=analysis.gkg_id
         status='url added to IDETECT DB'
@@ -251,12 +333,73 @@ def analyse_url():
     try:
         document=get_document(session, gkg_id)
         entries = get_facts_for_document(session, gkg_id)
-        resp = jsonify({'document': document, 'facts': entries, 'status' : status})
+        resp = jsonify({'job_id': gkg_id, 'document': document, 'facts': entries, 'status' : status})
+        resp.status_code = 200
+        return resp
+    finally:
+        session.close()
+
+
+@app.route('/analyse_url/<int:gkg_id>', methods=['GET'])
+def analyse_url_job(gkg_id):
+    session = Session()
+    try:
+        job = get_job(session, gkg_id)
+        if job is None:
+            return json.dumps({'success': False, 'status': 'unknown job_id'}), 404, {'ContentType': 'application/json'}
+        resp = jsonify(job)
         resp.status_code = 200
         return resp
     finally:
         session.close()
 
+
+def sse(event, data):
+    return "event: {}\ndata: {}\n\n".format(event, flask_json.dumps(data))
+
+
+@app.route('/analyse_url/<int:gkg_id>/events', methods=['GET'])
+def analyse_url_job_events(gkg_id):
+    if not job_event_streams.acquire(blocking=False):
+        # too many streams open in this process: poll /analyse_url/<job_id> instead
+        return json.dumps({'success': False, 'status': 'too many event streams',
+                           'poll': url_for('analyse_url_job', gkg_id=gkg_id)}), 503, \
+               {'ContentType': 'application/json', 'Retry-After': str(JOB_EVENTS_MAX_SECONDS)}
+
+    def events():
+        yield "retry: {}\n\n".format(JOB_EVENTS_RETRY_MS)
+        last_status = None
+        deadline = time.time() + JOB_EVENTS_MAX_SECONDS
+        while time.time() < deadline:
+            # use a fresh session for every check so the stream doesn't hold a connection
+            session = Session()
+            try:
+                job = get_job(session, gkg_id)
+                if job is None:
+                    yield sse('error', {'job_id': gkg_id, 'status': 'unknown job_id'})
+                    return
+                if job['done'] or job['failed']:
+                    yield sse('result', job)
+                    return
+                if job['status'] != last_status:
+                    last_status = job['status']
+                    yield sse('progress', job)
+                else:
+                    yield ": keepalive\n\n"
+            finally:
+                session.close()
+            time.sleep(JOB_EVENTS_POLL_SECONDS)
+        yield sse('timeout', {'job_id': gkg_id, 'status': last_status})
+
+    resp = Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # called however the stream ends, including when the client goes away
+    resp.call_on_close(job_event_streams.release)
+    return resp
+
+
+report_startup("API")
+
 if __name__ == "__main__":
     # Start flask app
     app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
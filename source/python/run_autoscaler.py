@@ -0,0 +1,29 @@
+import logging
+import os
+import sys
+
+from sqlalchemy import create_engine
+
+from idetect.autoscaler import Autoscaler
+from idetect.model import db_url, Base, Session
+from idetect.startup import report_startup
+
+if __name__ == "__main__":
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.root.addHandler(handler)
+
+    engine = create_engine(db_url())
+    Session.configure(bind=engine)
+    Base.metadata.create_all(engine)
+
+    cpu_budget = os.environ.get('AUTOSCALER_CPUS')
+    memory_budget_mb = os.environ.get('AUTOSCALER_MEMORY_MB')
+    autoscaler = Autoscaler(cpu_budget=float(cpu_budget) if cpu_budget else None,
+                            memory_budget_mb=int(memory_budget_mb) if memory_budget_mb else None)
+    report_startup(__file__)
+    logger.info("Starting autoscaler...")
+    autoscaler.run()
+    logger.info("Autoscaler stopped.")
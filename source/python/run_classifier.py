@@ -1,4 +1,5 @@
 import logging
+import os
 import sys
 
 from sqlalchemy import create_engine
@@ -6,12 +7,27 @@ import re
 import string
 import numpy as np
 import pandas as pd
-from idetect.classifier import classify
+from idetect import classification_cache
+from idetect.classifier import classify_batch, skip_counts, skip_extraction
 from idetect.nlp_models.category import * 
 from idetect.nlp_models.relevance import * 
 from idetect.nlp_models.base_model import CustomSklLsiModel
 from idetect.model import db_url, Base, Session, Status, Analysis
-from idetect.worker import Worker
+from idetect.retry import RetryPolicy, retry_due
+from idetect.startup import report_startup
+from idetect.worker import BatchWorker
+
+RETRY_POLICIES = [
+    (Exception, RetryPolicy(600, 6 * 3600, 3)),
+]
+# number of scraped Analyses each Worker claims and classifies in one pass through the models
+BATCH_SIZE = int(os.environ.get('CLASSIFIER_BATCH_SIZE', 32))
+# predict relevance first and only categorize relevant articles (off unless opted in, see docker.env)
+CASCADE = os.environ.get('CLASSIFIER_CASCADE', '0') == '1'
+# move irrelevant articles to Status.SKIPPED instead of extracting and geotagging them (off unless opted in)
+SKIP_IRRELEVANT = os.environ.get('SKIP_IRRELEVANT', '0') == '1'
+# look up predictions for previously seen texts in idetect_classification_cache
+USE_CACHE = os.environ.get('CLASSIFIER_CACHE', '1') == '1'
 
 if __name__ == "__main__":
     logger = logging.getLogger(__name__)
@@ -26,10 +42,35 @@ if __name__ == "__main__":
 
     c_m = CategoryModel()
     r_m = RelevanceModel()
+    # run the models once so that anything they initialize lazily is shared by forked Workers
+    c_m.predict("Warm up")
+    r_m.predict("Warm up")
+
+    def classify_latest(articles):
+        # pick up new model versions from the model store without restarting
+        for model in (c_m, r_m):
+            if model.refresh() and USE_CACHE:
+                # predictions from the old version will never be used again
+                session = Session()
+                try:
+                    classification_cache.prune(session, model)
+                finally:
+                    session.close()
+        classify_batch(articles, c_m, r_m, cascade=CASCADE, use_cache=USE_CACHE)
+        logger.info("Classifier skipped {} cache {}".format(dict(skip_counts), dict(classification_cache.cache_counts)))
 
-    worker = Worker(lambda query: query.filter(Analysis.status == Status.SCRAPED), Status.CLASSIFYING,
-                    Status.CLASSIFIED, Status.CLASSIFYING_FAILED,
-                    lambda article: classify(article, c_m, r_m), engine)
-    logger.info("Starting worker...")
-    worker.work_indefinitely()
+    worker = BatchWorker(lambda query: query.filter((Analysis.status == Status.SCRAPED) |
+                                                    retry_due(Status.CLASSIFYING_FAILED)),
+                         Status.CLASSIFYING, Status.CLASSIFIED, Status.CLASSIFYING_FAILED,
+                         classify_latest, engine, batch_size=BATCH_SIZE, retry_policies=RETRY_POLICIES,
+                         skip_status=Status.SKIPPED, skip_function=skip_extraction if SKIP_IRRELEVANT else None)
+    report_startup(__file__)
+    # WORKER_PROCESSES > 1 forks that many Workers from this process so they share its models
+    processes = int(os.environ.get('WORKER_PROCESSES', 1))
+    if processes > 1:
+        logger.info("Starting {} workers...".format(processes))
+        worker.run_preforked(processes)
+    else:
+        logger.info("Starting worker...")
+        worker.work_indefinitely()
     logger.info("Worker stopped.")
@@ -0,0 +1,62 @@
+"""
+Compile a version of the category or relevance model from the model store into a LinearScorer,
+check it against the original on documents from the database, and publish it as a new version.
+
+    python run_compile_model.py relevance --make-current
+"""
+import argparse
+import logging
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+from idetect.model import db_url, Session
+from idetect.nlp_models.linear_scorer import compile_pipeline, verify
+from idetect.nlp_models.model_store import ModelStore
+from idetect.nlp_models.retrain import TARGETS
+
+if __name__ == "__main__":
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.root.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description="Compile a model pipeline into a compact linear scorer")
+    parser.add_argument('model', choices=sorted(TARGETS))
+    parser.add_argument('--from-version', help="version to compile, defaults to the current one")
+    parser.add_argument('--version', help="version to publish as, defaults to <from version>_linear")
+    parser.add_argument('--make-current', action='store_true', help="make workers switch to the new version")
+    parser.add_argument('--sample', type=int, default=200, help="number of documents to verify on")
+    args = parser.parse_args()
+
+    engine = create_engine(db_url())
+    Session.configure(bind=engine)
+
+    store = ModelStore()
+    from_version = args.from_version or store.current_version(args.model)
+    pipeline = store.load(args.model, from_version)
+    scorer = compile_pipeline(pipeline)
+
+    session = Session()
+    try:
+        # the model's input column; verifying doesn't need labels, so any document will do
+        text = TARGETS[args.model][0]
+        texts = [t for t, in session.query(text).filter(text.isnot(None)).limit(args.sample)]
+    finally:
+        session.close()
+    if not texts:
+        raise ValueError("No documents to verify {} against".format(args.model))
+    difference = verify(pipeline, scorer, texts)
+
+    start = time.time()
+    for text in texts:
+        scorer.predict([text])
+    logger.info("Compiled {} {}: max difference {}, {:.2f}ms per document".format(
+        args.model, from_version, difference, (time.time() - start) * 1000 / len(texts)))
+
+    version = args.version or '{}_linear'.format(from_version)
+    store.publish(args.model, version, scorer, source='{} {}'.format(args.model, from_version),
+                  make_current=args.make_current)
+    logger.info("Published {} version {}".format(args.model, version))
@@ -1,13 +1,21 @@
 import logging
+import os
 import sys
 
 from sqlalchemy import create_engine
 
-from idetect.fact_extractor import extract_facts
+from idetect.fact_extractor import extract_facts, get_nlp
 from idetect.load_data import load_countries, load_terms
 from idetect.model import db_url, Base, Session, Status, Analysis, Country, FactKeyword
+from idetect.retry import RetryPolicy, retry_due
+from idetect.startup import report_startup
 from idetect.worker import Worker
 
+RETRY_POLICIES = [
+    (TimeoutError, RetryPolicy(3600, 12 * 3600, 2)),
+    (Exception, RetryPolicy(600, 6 * 3600, 3)),
+]
+
 if __name__ == "__main__":
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
@@ -32,9 +40,21 @@ if __name__ == "__main__":
         load_terms(session)
     session.close()
 
-    worker = Worker(lambda query: query.filter(Analysis.status == Status.CLASSIFIED),
+    # load and parse once so that the models, and anything spaCy initializes lazily,
+    # are shared by forked Workers
+    get_nlp()("Warm up the models.")
+
+    worker = Worker(lambda query: query.filter((Analysis.status == Status.CLASSIFIED) |
+                                               retry_due(Status.EXTRACTING_FAILED)),
                     Status.EXTRACTING, Status.EXTRACTED, Status.EXTRACTING_FAILED,
-                    extract_facts, engine)
-    logger.info("Starting worker...")
-    worker.work_indefinitely()
+                    extract_facts, engine, retry_policies=RETRY_POLICIES)
+    report_startup(__file__)
+    # WORKER_PROCESSES > 1 forks that many Workers from this process so they share its models
+    processes = int(os.environ.get('WORKER_PROCESSES', 1))
+    if processes > 1:
+        logger.info("Starting {} workers...".format(processes))
+        worker.run_preforked(processes)
+    else:
+        logger.info("Starting worker...")
+        worker.work_indefinitely()
     logger.info("Worker stopped.")
@@ -0,0 +1,56 @@
+import logging
+import signal
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+from idetect.fact_api_sync import sync_once
+from idetect.model import db_url, Base, Session
+from idetect.startup import report_startup
+
+# how often to look for Analyses that have been geotagged or edited
+SYNC_SECONDS = 60
+# how often to look for rows of Analyses and facts that have been deleted
+SWEEP_SECONDS = 60 * 60
+
+terminated = False
+
+
+def terminate(signum, frame):
+    global terminated
+    terminated = True
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.root.addHandler(handler)
+
+    engine = create_engine(db_url())
+    Session.configure(bind=engine)
+    Base.metadata.create_all(engine)
+
+    signal.signal(signal.SIGINT, terminate)
+    signal.signal(signal.SIGTERM, terminate)
+    report_startup(__file__)
+    logger.info("Starting fact API sync...")
+    swept = 0
+    while not terminated:
+        session = Session()
+        try:
+            sweep_deleted = time.time() - swept > SWEEP_SECONDS
+            sync_once(session, sweep_deleted)
+            if sweep_deleted:
+                swept = time.time()
+        except Exception as e:
+            logger.warning("Fact API sync failed", exc_info=e)
+        finally:
+            session.close()
+        for _ in range(SYNC_SECONDS):
+            if terminated:
+                break
+            time.sleep(1)
+    logger.info("Fact API sync stopped.")
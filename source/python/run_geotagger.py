@@ -3,10 +3,19 @@ import sys
 
 from sqlalchemy import create_engine
 
+from idetect.geo_external import GeotagException
 from idetect.geotagger import process_locations
 from idetect.model import db_url, Base, Session, Status, Analysis
+from idetect.retry import RetryPolicy, retry_due
+from idetect.startup import report_startup
 from idetect.worker import Worker
 
+RETRY_POLICIES = [
+    # the geocoding service may be unavailable or rate limiting us
+    ((GeotagException, TimeoutError), RetryPolicy(900, 12 * 3600, 5)),
+    (Exception, RetryPolicy(600, 6 * 3600, 3)),
+]
+
 if __name__ == "__main__":
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
@@ -18,9 +27,11 @@ if __name__ == "__main__":
     Session.configure(bind=engine)
     Base.metadata.create_all(engine)
 
-    worker = Worker(lambda query: query.filter(Analysis.status == Status.EXTRACTED),
+    worker = Worker(lambda query: query.filter((Analysis.status == Status.EXTRACTED) |
+                                               retry_due(Status.GEOTAGGING_FAILED)),
                     Status.GEOTAGGING, Status.GEOTAGGED, Status.GEOTAGGING_FAILED,
-                    process_locations, engine)
+                    process_locations, engine, retry_policies=RETRY_POLICIES)
+    report_startup(__file__)
     logger.info("Starting worker...")
     worker.work_indefinitely()
     logger.info("Worker stopped.")
@@ -4,6 +4,7 @@ import sys
 from sqlalchemy import create_engine
 
 from idetect.model import db_url, Base, Session
+from idetect.startup import report_startup
 from idetect.worker import Initiator
 
 if __name__ == "__main__":
@@ -18,6 +19,7 @@ if __name__ == "__main__":
     Base.metadata.create_all(engine)
 
     worker = Initiator(engine)
+    report_startup(__file__)
     logger.info("Starting worker...")
     worker.work_indefinitely()
     logger.info("Worker stopped.")
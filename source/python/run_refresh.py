@@ -0,0 +1,58 @@
+"""
+Refresh the fact API materialized views without blocking API queries, see idetect/refresh.py
+
+    python run_refresh.py              # refresh once
+    python run_refresh.py --every 60   # refresh every 60 minutes until stopped
+"""
+import argparse
+import logging
+import signal
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+from idetect.model import db_url, Base, Session
+from idetect.refresh import refresh_all
+
+terminated = False
+
+
+def terminate(signum, frame):
+    global terminated
+    terminated = True
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.root.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description="Refresh the fact API materialized views")
+    parser.add_argument('--every', type=int, help="keep refreshing, every this many minutes")
+    parser.add_argument('--no-warm', action='store_true', help="don't warm the API cache afterwards, which needs API_CACHE_DIR")
+    args = parser.parse_args()
+
+    engine = create_engine(db_url())
+    Session.configure(bind=engine)
+    Base.metadata.create_all(engine)
+
+    signal.signal(signal.SIGINT, terminate)
+    signal.signal(signal.SIGTERM, terminate)
+    while not terminated:
+        start = time.time()
+        session = Session()
+        try:
+            refresh_all(session, warm=not args.no_warm)
+        except Exception as e:
+            if not args.every:
+                raise
+            logger.warning("Refresh failed", exc_info=e)
+        finally:
+            session.close()
+        if not args.every:
+            break
+        while not terminated and time.time() - start < args.every * 60:
+            time.sleep(1)
@@ -0,0 +1,59 @@
+"""
+Retrain the category or relevance model on the documents in the database and publish it
+to the model store. Workers pick up the new version automatically if it is made current.
+The Analysis statuses to take labels from have to be given explicitly, because nothing
+records which labels a person has checked; see idetect/nlp_models/retrain.py.
+
+    python run_retrain.py relevance --status edited --version relevance_sgd_20180301 --make-current
+"""
+import argparse
+import logging
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+from idetect.model import db_url, Session
+from idetect.nlp_models.model_store import ModelStore
+from idetect.nlp_models.retrain import train, TARGETS, CHUNK_SIZE, N_FEATURES
+
+STOP_WORDS = '/home/idetect/data/stop_words_en_long.txt'
+
+if __name__ == "__main__":
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.root.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description="Retrain a classifier model without loading the corpus into memory")
+    parser.add_argument('model', choices=sorted(TARGETS))
+    parser.add_argument('--version', help="version to publish as, defaults to <model>_sgd_<timestamp>")
+    parser.add_argument('--make-current', action='store_true', help="make workers switch to the new version")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="documents held in memory at once")
+    parser.add_argument('--n-features', type=int, default=N_FEATURES, help="size of the hashed feature space")
+    parser.add_argument('--passes', type=int, default=1, help="number of passes over the corpus")
+    statuses = parser.add_mutually_exclusive_group(required=True)
+    statuses.add_argument('--status', action='append', dest='statuses',
+                          help="train on the labels of Analyses in this status, may be repeated")
+    statuses.add_argument('--all-statuses', action='store_true',
+                          help="train on every labelled Analysis, including labels that came from the deployed models")
+    parser.add_argument('--stop-words', default=STOP_WORDS)
+    args = parser.parse_args()
+
+    engine = create_engine(db_url())
+    Session.configure(bind=engine)
+
+    with open(args.stop_words) as f:
+        stop_words = f.read().split('\n')
+
+    session = Session()
+    try:
+        model = train(session, args.model, stop_words, None if args.all_statuses else args.statuses,
+                      args.chunk_size, args.n_features, args.passes)
+    finally:
+        session.close()
+
+    version = args.version or '{}_sgd_{}'.format(args.model, time.strftime('%Y%m%d%H%M%S'))
+    ModelStore().publish(args.model, version, model, source='run_retrain.py', make_current=args.make_current)
+    logger.info("Published {} version {}".format(args.model, version))
@@ -1,27 +1,34 @@
 import logging
 import sys
-from datetime import timedelta
 
-from sqlalchemy import create_engine, func
+import requests
+from sqlalchemy import create_engine
 
 from idetect.model import db_url, Base, Session, Status, Analysis
-from idetect.scraper import scrape
+from idetect.politeness import polite, polite_filter
+from idetect.retry import RetryPolicy, retry_due
+from idetect.scraper import scrape, RetrievalException
+from idetect.startup import report_startup
 from idetect.worker import Worker
 
 MAX_RETRIEVAL_ATTEMPTS = 3
 HOURS_BETWEEN_ATTEMPTS = 12
 
+RETRY_POLICIES = [
+    # the host may just be down for a while; retry sooner
+    ((RetrievalException, requests.RequestException, TimeoutError),
+     RetryPolicy(3600, HOURS_BETWEEN_ATTEMPTS * 3600, MAX_RETRIEVAL_ATTEMPTS)),
+    (Exception, RetryPolicy(HOURS_BETWEEN_ATTEMPTS * 3600, 4 * HOURS_BETWEEN_ATTEMPTS * 3600, MAX_RETRIEVAL_ATTEMPTS)),
+]
+
 
 # Filter function for identifying analyses to scrape
 def scraping_filter(query):
     # Choose either New analyses OR
-    # Analyses where Scraping Failed &
-    # less than 3 scraping attempts &
-    # last scraping attempt greater than 12 hours ago
-    return query.filter((Analysis.status == Status.NEW) |
-                        ((Analysis.status == Status.SCRAPING_FAILED) &
-                         (Analysis.retrieval_attempts < MAX_RETRIEVAL_ATTEMPTS) &
-                         (func.now() > Analysis.retrieval_date + timedelta(hours=HOURS_BETWEEN_ATTEMPTS))))
+    # Analyses where Scraping Failed & the next retry is due
+    # ... whose domain isn't being rate limited or deferred
+    return polite_filter(
+        query.filter((Analysis.status == Status.NEW) | retry_due(Status.SCRAPING_FAILED)))
 
 
 if __name__ == "__main__":
@@ -36,7 +43,8 @@ if __name__ == "__main__":
     Base.metadata.create_all(engine)
 
     worker = Worker(scraping_filter, Status.SCRAPING, Status.SCRAPED, Status.SCRAPING_FAILED,
-                    scrape, engine)
+                    polite(scrape), engine, retry_policies=RETRY_POLICIES)
+    report_startup(__file__)
     logger.info("Starting worker...")
     worker.work_indefinitely()
     logger.info("Worker stopped.")
@@ -1,5 +1,7 @@
 #!/bin/bash
 
-echo "REFRESH MATERIALIZED VIEW idetect_fact_api_locations" | psql -h localdb -U idetect
-echo "REFRESH MATERIALIZED VIEW idetect_fact_api" | psql -h localdb -U idetect
-echo "REFRESH MATERIALIZED VIEW idetect_map_week_mview" | psql -h localdb -U idetect
\ No newline at end of file
+# idetect_fact_api and idetect_fact_api_locations are kept up to date by run_fact_api_sync.py
+# Manual fallback for run_refresh.py, which normally refreshes the views without blocking the API
+echo "REFRESH MATERIALIZED VIEW CONCURRENTLY idetect_map_week_mview" | psql -h localdb -U idetect
+# Invalidate the cached /map_week responses, see idetect/api_cache.py
+echo "INSERT INTO idetect_cache_generations (name, generation) VALUES ('map_week', 1) ON CONFLICT (name) DO UPDATE SET generation = idetect_cache_generations.generation + 1, updated = now()" | psql -h localdb -U idetect